@@ -0,0 +1,64 @@
+"""
+Synthetic networks for benchmarking: any number of routes, stops per route and transfer density, generated
+deterministically from a seed so runs are comparable over time.
+"""
+
+import random
+
+from transit.data_providers.base import BaseDataProvider
+from transit.route import Route
+from transit.stop import Stop
+
+
+class SyntheticDataProvider(BaseDataProvider):
+    """
+    Serves a generated network. Each stop position of a route is, with probability `transfer_density`, a shared
+    "hub" stop (served by about `routes_per_hub` routes on average) and otherwise a stop of its own.
+    """
+    # Everything is in memory, there's nothing to gain from a thread pool
+    MAX_CONCURRENT_REQUESTS = 1
+
+    def __init__(self, routes=100, stops_per_route=30, transfer_density=0.1, routes_per_hub=3, seed=0) -> None:
+        self.route_count = routes
+        self.stops_per_route = stops_per_route
+        self.transfer_density = transfer_density
+
+        rng = random.Random(seed)
+        hub_count = max(1, int(routes * stops_per_route * transfer_density / routes_per_hub))
+
+        self.routes = []
+        self.route_stops = {}
+
+        for route_idx in range(routes):
+            route_id = f"route-{route_idx}"
+            self.routes.append(Route(name=f"Route {route_idx}", id=route_id, line_name=f"line-{route_idx % 10}"))
+
+            stops = []
+            used = set()
+            for position in range(stops_per_route):
+                hub = rng.randrange(hub_count) if rng.random() < transfer_density else None
+
+                if hub is not None and hub not in used:
+                    used.add(hub)
+                    stops.append(Stop(name=f"Hub {hub}", id=f"hub-{hub}"))
+                else:
+                    stops.append(Stop(name=f"Stop {route_idx}-{position}", id=f"stop-{route_idx}-{position}"))
+
+            self.route_stops[route_id] = stops
+
+
+    def get_all_routes(self):
+        return [Route(name=route.name, id=route.id, line_name=route.line_name) for route in self.routes]
+
+
+    def get_stops_for_route(self, route_id):
+        return [Stop(name=stop.name, id=stop.id) for stop in self.route_stops[route_id]]
+
+
+    @property
+    def params(self) -> dict:
+        return {
+            "routes": self.route_count,
+            "stops_per_route": self.stops_per_route,
+            "transfer_density": self.transfer_density,
+        }
@@ -0,0 +1,208 @@
+"""
+Time the main TransitMap operations on a synthetic network and keep a history of the results.
+
+    python -m benchmarks.run --routes 500 --stops-per-route 40 --transfer-density 0.2
+
+Every run is appended to a JSONL history (benchmarks/results.jsonl by default) together with the commit it was
+run on, and compared against the last run with the same parameters, so regressions show up as numbers.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks.network import SyntheticDataProvider
+from transit import planner
+from transit.system import TransitMap
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "results.jsonl")
+
+
+def percentile(samples, share) -> float:
+    """
+    Nearest-rank percentile of a non-empty list of samples
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def measure(operation, repeat):
+    """
+    Call `operation` `repeat` times, returns the timings (in seconds) and the peak memory (in bytes) allocated
+    during one extra, traced call. Tracing slows everything down, so it never overlaps the timed calls.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return timings, peak
+
+
+def measure_queries(query, pairs):
+    """
+    Call `query(origin, destination)` once per pair, returns the timings and the peak memory allocated during
+    traced (untimed) calls for the first 100 pairs
+    """
+    timings = []
+    for origin, destination in pairs:
+        started = time.perf_counter()
+        query(origin, destination)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        for origin, destination in pairs[:100]:
+            query(origin, destination)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return timings, peak
+
+
+def summarize(timings, peak) -> dict:
+    return {
+        "count": len(timings),
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 4),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 4),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 4),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run(provider, queries=1000, repeat=5, seed=0) -> dict:
+    """
+    Benchmark loading and querying the provider's network, returns {operation: summary}
+    """
+    results = {}
+
+    def load():
+        transit_map = TransitMap(provider)
+        transit_map.load_stops()
+        return transit_map
+
+    results["load_stops"] = summarize(*measure(load, repeat))
+
+    transit_map = load()
+
+    results["get_connecting_stops"] = summarize(*measure(transit_map.get_connecting_stops, repeat))
+
+    def stats():
+        transit_map.get_routes_with_most_stops()
+        transit_map.get_routes_with_least_stops()
+
+    results["route_stats"] = summarize(*measure(stats, repeat))
+
+    rng = random.Random(seed)
+    stops = list(transit_map.stops.values())
+    pairs = [(rng.choice(stops), rng.choice(stops)) for _ in range(queries)]
+
+    # One itinerary, then the five best alternatives, for the same pairs straight on the graph (past the plan cache)
+    graph = transit_map.network.graph
+    indexes = [(graph.stop_index[origin.name], graph.stop_index[destination.name]) for origin, destination in pairs]
+    results["plan"] = summarize(*measure_queries(
+        lambda origin_idx, destination_idx: planner.plan(graph, origin_idx, destination_idx), indexes
+    ))
+    results["plan_alternatives"] = summarize(*measure_queries(
+        lambda origin_idx, destination_idx: planner.plan_alternatives(graph, origin_idx, destination_idx, k=5),
+        indexes
+    ))
+
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path) -> list:
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def format_report(record, previous=None) -> str:
+    """
+    A table of the results, with the change in p50 against a previous run when there is one
+    """
+    lines = [f"{'operation':<22} {'p50 ms':>10} {'p99 ms':>10} {'peak KiB':>10} {'p50 vs last':>12}"]
+
+    for operation, summary in record["results"].items():
+        change = ""
+        if previous is not None and operation in previous["results"]:
+            before = previous["results"][operation]["p50_ms"]
+            if before:
+                change = f"{(summary['p50_ms'] - before) / before:+.1%}"
+
+        lines.append(
+            f"{operation:<22} {summary['p50_ms']:>10.3f} {summary['p99_ms']:>10.3f} {summary['peak_kib']:>10.1f} "
+            f"{change:>12}"
+        )
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TransitMap on a synthetic network")
+    parser.add_argument("--routes", type=int, default=100)
+    parser.add_argument("--stops-per-route", type=int, default=30)
+    parser.add_argument("--transfer-density", type=float, default=0.1,
+                        help="share of route stops that are shared with other routes")
+    parser.add_argument("--queries", type=int, default=1000,
+                        help="random origin / destination pairs to plan and find alternatives for")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repetitions of the other operations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSONL file results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="don't record this run in the history")
+    args = parser.parse_args(argv)
+
+    provider = SyntheticDataProvider(args.routes, args.stops_per_route, args.transfer_density, seed=args.seed)
+    params = dict(provider.params, queries=args.queries, seed=args.seed)
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "params": params,
+        "results": run(provider, args.queries, args.repeat, args.seed),
+    }
+
+    previous = next((r for r in reversed(load_history(args.history)) if r["params"] == params), None)
+    print(format_report(record, previous))
+
+    if not args.no_save:
+        append_history(args.history, record)
+
+    return record
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,91 @@
-from transit.client import CLI
+import time
+
+# Taken before anything heavy is imported, for --timings
+started = time.perf_counter()
+
+from transit.client import CLI, SNAPSHOT_PATH, SNAPSHOT_TTL
+from transit import metrics
+import argparse
 import logging
+import os
 
 """
     Entrypoint to run when the CLI program when this script is directly invoked.
 """
 if __name__ == "__main__":
-    transit_cli = CLI()
+    parser = argparse.ArgumentParser(description="MBTA subway routes, statistics and route finder")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="plan origin/destination pairs from a CSV or JSONL file ('-' for stdin) and exit")
+    parser.add_argument("--output", metavar="FILE", default="-", help="where to write batch results (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="batch input/output format (default: detect input, write JSONL)")
+    parser.add_argument("--optimize", choices=["transfers", "stops"], default="transfers",
+                        help="what batch planning minimizes")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to spread batch planning (or --serve route planning) over")
+    parser.add_argument("--serve", action="store_true",
+                        help="run the HTTP query service instead of the interactive prompt")
+    parser.add_argument("--host", default="127.0.0.1", help="address the HTTP service listens on")
+    parser.add_argument("--port", type=int, default=8080, help="port the HTTP service listens on")
+    parser.add_argument("--live", action="store_true",
+                        help="with --serve, follow the real-time vehicle / prediction feed and serve it at /live")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="record metrics and write them (Prometheus text format) to FILE on exit")
+    parser.add_argument("--snapshot", metavar="FILE", default=SNAPSHOT_PATH,
+                        help="network snapshot to start from and keep up to date (default: %(default)s)")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="always load the network from the API, without reading or writing a snapshot")
+    parser.add_argument("--refresh", action="store_true",
+                        help="load the network from the API even if the snapshot is fresh, and rewrite it")
+    parser.add_argument("--gtfs", metavar="AGENCY=PATH", action="append", default=[],
+                        help="also load the GTFS feed at PATH as AGENCY, with walking transfers to the MBTA network "
+                             "(repeatable)")
+    parser.add_argument("--timings", action="store_true",
+                        help="print how long each start-up phase took to stderr on exit")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.REGISTRY.enabled = True
+
+    gtfs_feeds = {}
+    for feed in args.gtfs:
+        agency, separator, path = feed.partition("=")
+        if not separator or not agency or not path:
+            parser.error(f"--gtfs expects AGENCY=PATH, got {feed!r}")
+        gtfs_feeds[agency] = path
+
+    if gtfs_feeds and args.live:
+        parser.error("--live follows the MBTA feed only and can't be combined with --gtfs")
+
+    snapshot_path = None if args.no_snapshot else args.snapshot
+    if gtfs_feeds and snapshot_path == SNAPSHOT_PATH:
+        # Keep the combined network apart from the MBTA-only one
+        root, extension = os.path.splitext(SNAPSHOT_PATH)
+        snapshot_path = f"{root}-{'-'.join(sorted(gtfs_feeds))}{extension}"
+
+    snapshot_ttl = 0 if args.refresh else SNAPSHOT_TTL
+    transit_cli = CLI(snapshot_path, snapshot_ttl, started, gtfs_feeds)
 
     logging.basicConfig(level=logging.WARN)
 
-    # Question 1
-    transit_cli.display_all_routes()
+    try:
+        if args.batch:
+            transit_cli.run_batch(args.batch, args.output, args.optimize, args.workers, args.format)
+        elif args.serve:
+            # One worker process is no better than planning on a thread
+            transit_cli.serve(args.host, args.port, args.workers if args.workers > 1 else 0, args.live)
+        else:
+            # Question 1
+            transit_cli.display_all_routes()
 
-    # Question 2
-    transit_cli.display_stop_statistics()
+            # Question 2
+            transit_cli.display_stop_statistics()
 
-    # Question 3
-    transit_cli.display_travel_route_prompt()
+            # Question 3
+            transit_cli.display_travel_route_prompt()
+    finally:
+        if args.metrics:
+            with open(args.metrics, "w") as f:
+                f.write(metrics.REGISTRY.render())
+        if args.timings:
+            transit_cli.print_timings()
@@ -0,0 +1,45 @@
+import json
+
+from benchmarks import run
+from benchmarks.network import SyntheticDataProvider
+from transit.system import TransitMap
+
+
+def test_synthetic_network():
+    provider = SyntheticDataProvider(routes=20, stops_per_route=10, transfer_density=0.3, seed=1)
+    transit_map = TransitMap(provider)
+    transit_map.load_stops()
+
+    assert len(transit_map.routes) == 20
+    assert all(len(route.stops) == 10 for route in transit_map.routes.values())
+    assert transit_map.get_connecting_stops()
+
+    # Same seed, same network
+    again = SyntheticDataProvider(routes=20, stops_per_route=10, transfer_density=0.3, seed=1)
+    assert again.route_stops == provider.route_stops
+
+
+def test_run_records_history(tmp_path, capsys):
+    history = tmp_path / "results.jsonl"
+    argv = ["--routes", "10", "--stops-per-route", "5", "--queries", "20", "--repeat", "2", "--history", str(history)]
+
+    run.main(argv)
+    record = run.main(argv)
+
+    records = [json.loads(line) for line in history.read_text().splitlines()]
+    assert len(records) == 2
+    assert records[1]["params"] == record["params"]
+    assert set(record["results"]) == {"load_stops", "get_connecting_stops", "route_stats", "plan",
+                                     "plan_alternatives"}
+    assert record["results"]["plan"]["count"] == 20
+
+    # The second run is compared against the first
+    assert "%" in capsys.readouterr().out.splitlines()[-1]
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+
+    assert run.percentile(samples, 0.5) == 50
+    assert run.percentile(samples, 0.99) == 99
+    assert run.percentile([3], 0.99) == 3
@@ -0,0 +1,85 @@
+import os
+
+from transit.client import CLI
+from transit.system import TransitMap
+
+from spatial_test import Downtown
+from transit_system_test import TestSystem
+
+
+def test_load_network_saves_snapshot(tmp_path):
+    path = str(tmp_path / "cache" / "network.tmap")
+    cli = CLI(snapshot_path=path)
+    cli.transit_map.data_provider = TestSystem()
+
+    cli.load_network()
+
+    assert cli.transit_map.get_routes_with_most_stops() == [('Green', 5)]
+    assert os.path.exists(path)
+    assert [phase for phase, _ in cli.timings] == ["imports", "fetch", "save snapshot"]
+
+
+def test_load_network_from_snapshot(tmp_path):
+    path = str(tmp_path / "network.tmap")
+    transit_map = TransitMap(TestSystem())
+    transit_map.save_snapshot(path)
+
+    cli = CLI(snapshot_path=path)
+    cli.load_network()
+
+    # Answered without ever creating a data provider
+    assert cli.transit_map.data_provider is None
+    assert cli.transit_map.get_routes_with_most_stops() == [('Green', 5)]
+    assert [phase for phase, _ in cli.timings] == ["imports", "snapshot"]
+
+
+def test_load_network_stale_snapshot(tmp_path):
+    path = str(tmp_path / "network.tmap")
+    TransitMap(TestSystem()).save_snapshot(path)
+    os.utime(path, (0, 0))
+
+    cli = CLI(snapshot_path=path)
+    cli.transit_map.data_provider = TestSystem()
+    cli.load_network()
+
+    assert [phase for phase, _ in cli.timings] == ["imports", "fetch", "save snapshot"]
+    assert os.path.getmtime(path) > 0
+
+
+def test_load_network_bad_snapshot(tmp_path):
+    path = tmp_path / "network.tmap"
+    path.write_bytes(b"not a snapshot")
+
+    cli = CLI(snapshot_path=str(path))
+    cli.transit_map.data_provider = TestSystem()
+    cli.load_network()
+
+    assert cli.transit_map.get_routes_with_least_stops() == [('Blue', 2)]
+
+
+def test_load_network_empty_snapshot(tmp_path):
+    path = tmp_path / "network.tmap"
+    path.write_bytes(b"")
+
+    cli = CLI(snapshot_path=str(path))
+    cli.transit_map.data_provider = TestSystem()
+    cli.load_network()
+
+    assert [phase for phase, _ in cli.timings] == ["imports", "fetch", "save snapshot"]
+    assert path.stat().st_size > 0
+
+
+def test_get_travel_info_shows_walks(capsys):
+    cli = CLI(snapshot_path=None)
+    cli.transit_map = TransitMap(Downtown())
+    cli.transit_map.load_stops()
+
+    origin = cli.transit_map.get_stop_from_string("Charles/MGH")
+    for destination in ("Haymarket", "Courthouse"):
+        cli.get_travel_info(origin, cli.transit_map.get_stop_from_string(destination))
+
+    assert capsys.readouterr().out.splitlines()[1:] == [
+        "Charles/MGH to Haymarket -> Red, walk Park Street -> Downtown Crossing (205 m), Orange",
+        "",
+        "Charles/MGH to Courthouse -> ",
+    ]
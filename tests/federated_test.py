@@ -0,0 +1,133 @@
+import pytest
+
+from transit.data_providers.base import BaseDataProvider
+from transit.data_providers.federated import FederatedDataProvider
+from transit.planner import Leg, Walk
+from transit.route import Route
+from transit.stop import Stop
+from transit.system import TransitMap
+from transit.timetable import Trip
+
+
+class Subway(BaseDataProvider):
+    STOPS = {
+        1: [
+            Stop(name="Union Station", id="union", latitude=42.0, longitude=-71.0),
+            Stop(name="Downtown", id="downtown", latitude=42.01, longitude=-71.0),
+        ],
+        2: [
+            Stop(name="Downtown", id="downtown", latitude=42.01, longitude=-71.0),
+            Stop(name="Harbor", id="harbor", latitude=42.02, longitude=-71.0),
+        ],
+    }
+
+    def get_all_routes(self):
+        return [Route(name="Red", id=1, line_name="R"), Route(name="Blue", id=2, line_name="B")]
+
+    def get_stops_for_route(self, route_id):
+        return self.STOPS[route_id]
+
+
+class Rail(BaseDataProvider):
+    def get_all_routes(self):
+        return [Route(name="Commuter", id="cr", line_name="CR"), Route(name="Red", id="red", line_name="CR")]
+
+    def get_stops_for_route(self, route_id):
+        if route_id == "red":
+            return [Stop(name="Airport", id="airport", latitude=42.1, longitude=-71.0)]
+
+        return [
+            # About 56 m from the subway's Union Station
+            Stop(name="Union Station", id="union", latitude=42.0005, longitude=-71.0),
+            Stop(name="Airport", id="airport", latitude=42.1, longitude=-71.0),
+        ]
+
+    def get_trips(self, route_ids, service_date=None):
+        for route_id in route_ids:
+            yield Trip(id=f"{route_id}-1", route_id=route_id, stops=["Union Station", "Airport"], arrivals=[0, 600],
+                       departures=[0, 600])
+
+
+@pytest.fixture
+def transit_map():
+    transit_map = TransitMap(FederatedDataProvider({"subway": Subway(), "rail": Rail()}))
+    transit_map.load_stops()
+    return transit_map
+
+
+def test_namespacing(transit_map):
+    assert sorted(transit_map.routes) == ["Blue", "Commuter", "Red (rail)", "Red (subway)"]
+    assert transit_map.get_route_from_string("Red (subway)").id == "subway:1"
+    assert transit_map.get_route_from_string("Commuter").line_name == "rail:CR"
+
+    # Only names used by both agencies are qualified
+    assert sorted(transit_map.stops) == [
+        "Airport", "Downtown", "Harbor", "Union Station (rail)", "Union Station (subway)"
+    ]
+    assert transit_map.get_stop_from_string("Union Station (rail)").id == "rail:union"
+    assert transit_map.get_stop_from_string("Downtown").latitude == 42.01
+    assert transit_map.get_connecting_stops() == {
+        "Downtown": ("Red (subway)", "Blue"), "Airport": ("Commuter", "Red (rail)")
+    }
+
+
+def test_walking_transfers(transit_map):
+    graph = transit_map.graph
+    subway = graph.stop_index["Union Station (subway)"]
+    rail = graph.stop_index["Union Station (rail)"]
+
+    assert list(graph.walk_stops[subway]) == [rail]
+    assert graph.get_walk_meters(rail, subway) == 56
+    # Nothing else is close enough to walk
+    assert len(graph.walk_meters) == 2
+
+
+@pytest.mark.parametrize("optimize", ["transfers", "stops"])
+def test_plan_across_agencies(transit_map, optimize):
+    origin = transit_map.get_stop_from_string("Harbor")
+    destination = transit_map.get_stop_from_string("Airport")
+    itinerary = transit_map.plan(origin, destination, optimize)
+
+    assert itinerary.legs == [
+        Leg("Blue", "Harbor", "Downtown", 1),
+        Leg("Red (subway)", "Downtown", "Union Station (subway)", 1),
+        Walk("Union Station (subway)", "Union Station (rail)", 56),
+        Leg("Commuter", "Union Station (rail)", "Airport", 1),
+    ]
+    assert itinerary.routes == ["Blue", "Red (subway)", "Commuter"]
+    assert itinerary.transfers == 2
+    assert itinerary.stops == 3
+    assert itinerary.walk_meters == 56
+
+    back = transit_map.plan(destination, origin, optimize)
+    assert [leg.__class__ for leg in back.legs] == [Leg, Walk, Leg, Leg]
+
+
+def test_snapshot_keeps_walks(transit_map, tmp_path):
+    path = str(tmp_path / "network.tmap")
+    transit_map.save_snapshot(path)
+
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(path)
+
+    stop = snapshot_map.get_stop_from_string("Union Station (rail)")
+    assert (stop.latitude, stop.longitude) == (42.0005, -71.0)
+
+    origin = transit_map.get_stop_from_string("Harbor")
+    destination = transit_map.get_stop_from_string("Airport")
+    for optimize in ("transfers", "stops"):
+        assert snapshot_map.plan(origin, destination, optimize) == transit_map.plan(origin, destination, optimize)
+
+
+def test_get_trips(transit_map):
+    route_ids = [route.id for route in transit_map.routes.values()]
+    trips = list(transit_map.data_provider.get_trips(route_ids))
+
+    # The subway has no schedules and is left out
+    assert [(trip.id, trip.route_id, trip.stops) for trip in trips] == [
+        ("rail:cr-1", "rail:cr", ["Union Station (rail)", "Airport"]),
+        ("rail:red-1", "rail:red", ["Union Station (rail)", "Airport"]),
+    ]
+
+    with pytest.raises(NotImplementedError):
+        list(transit_map.data_provider.get_trips(["subway:1"]))
@@ -0,0 +1,159 @@
+from datetime import date
+import zipfile
+
+import pytest
+
+from transit.data_providers.gtfs import GTFSDataProvider
+from transit.planner import Leg
+from transit.system import TransitMap
+
+FEED = {
+    "routes.txt": """route_id,route_long_name,route_short_name,route_type,line_id
+Red,Red Line,,1,line-Red
+Mattapan,Mattapan Trolley,,0,line-Mattapan
+1,,1,3,line-1
+""",
+    "trips.txt": """route_id,service_id,trip_id,direction_id
+Red,weekday,red-ashmont-1,0
+Red,weekday,red-ashmont-2,0
+Red,weekday,red-braintree-1,0
+Red,weekday,red-detour-1,0
+Red,weekday,red-north-1,1
+Mattapan,weekday,mattapan-1,0
+1,weekday,bus-1,0
+""",
+    # Rows of one trip are deliberately out of stop_sequence order
+    "stop_times.txt": """trip_id,arrival_time,departure_time,stop_id,stop_sequence
+red-ashmont-1,08:00:00,08:00:00,alewife-1,1
+red-ashmont-1,08:10:00,08:10:00,jfk-1,2
+red-ashmont-1,08:20:00,08:20:00,ashmont-1,3
+red-ashmont-2,09:10:00,09:10:00,jfk-1,2
+red-ashmont-2,09:00:00,09:00:00,alewife-1,1
+red-ashmont-2,09:20:00,09:20:00,ashmont-1,3
+red-braintree-1,08:05:00,08:05:00,alewife-1,1
+red-braintree-1,08:15:00,08:15:00,jfk-2,2
+red-braintree-1,08:30:00,08:30:00,braintree-1,3
+red-detour-1,08:05:00,08:05:00,alewife-1,1
+red-detour-1,08:15:00,08:15:00,jfk-2,2
+red-north-1,10:00:00,10:00:00,braintree-2,1
+red-north-1,10:15:00,10:15:00,jfk-2,2
+red-north-1,10:25:00,10:25:00,alewife-1,3
+mattapan-1,08:00:00,08:00:00,ashmont-2,1
+mattapan-1,08:10:00,08:10:00,mattapan,2
+bus-1,08:00:00,08:00:00,bus-stop,1
+""",
+    "stops.txt": """stop_id,stop_name,parent_station,location_type
+place-alfcl,Alewife,,1
+alewife-1,Alewife,place-alfcl,0
+place-jfk,JFK/UMass,,1
+jfk-1,JFK/UMass,place-jfk,0
+jfk-2,JFK/UMass,place-jfk,0
+place-asmnl,Ashmont,,1
+ashmont-1,Ashmont,place-asmnl,0
+ashmont-2,Ashmont,place-asmnl,0
+place-brntn,Braintree,,1
+braintree-1,Braintree,place-brntn,0
+braintree-2,Braintree,place-brntn,0
+mattapan,Mattapan,,0
+bus-stop,Massachusetts Ave @ Beacon St,,0
+""",
+    "calendar.txt": """service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+weekday,1,1,1,1,1,0,0,20240101,20241231
+""",
+    "calendar_dates.txt": """service_id,date,exception_type
+weekday,20240704,2
+""",
+}
+
+
+@pytest.fixture
+def feed_path(tmp_path):
+    path = tmp_path / "gtfs.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, contents in FEED.items():
+            archive.writestr(name, contents)
+    return str(path)
+
+
+def test_get_all_routes(feed_path):
+    provider = GTFSDataProvider(feed_path)
+
+    assert [(r.name, r.id, r.line_name) for r in provider.get_all_routes()] == [
+        ("Red Line", "Red", "line-Red"),
+        ("Mattapan Trolley", "Mattapan", "line-Mattapan"),
+    ]
+
+
+def get_sequences(provider, route_id):
+    return [
+        (sequence.direction, [stop.name for stop in sequence.stops])
+        for sequence in provider.get_stops_for_route(route_id)
+    ]
+
+
+def test_get_stops_for_route(feed_path):
+    provider = GTFSDataProvider(feed_path)
+
+    # One sequence per branch, busiest (Ashmont) first; the detour only runs along a stretch of them
+    assert get_sequences(provider, "Red") == [
+        (0, ["Alewife", "JFK/UMass", "Ashmont"]),
+        (0, ["Alewife", "JFK/UMass", "Braintree"]),
+    ]
+    # Platforms resolve to their stations
+    assert [s.id for s in provider.get_stops_for_route("Red")[1].stops] == ["place-alfcl", "place-jfk", "place-brntn"]
+    assert get_sequences(provider, "Mattapan") == [(0, ["Ashmont", "Mattapan"])]
+
+
+def test_branches_are_not_joined(feed_path):
+    transit_map = TransitMap(GTFSDataProvider(feed_path))
+    transit_map.load_stops()
+
+    red = transit_map.get_route_from_string("Red Line")
+    ashmont = transit_map.get_stop_from_string("Ashmont")
+    braintree = transit_map.get_stop_from_string("Braintree")
+    assert red.get_ride_length(ashmont, braintree) is None
+    assert red.get_stops_between(ashmont, braintree) == []
+
+    # Getting from one terminus to the other means changing trains at JFK/UMass
+    assert transit_map.plan(ashmont, braintree, optimize="stops").legs == [
+        Leg(route="Red Line", board="Ashmont", alight="JFK/UMass", stops=1),
+        Leg(route="Red Line", board="JFK/UMass", alight="Braintree", stops=1),
+    ]
+
+
+def test_route_types(feed_path):
+    provider = GTFSDataProvider(feed_path, route_types=None)
+
+    assert len(provider.get_all_routes()) == 3
+    assert get_sequences(provider, "1") == [(0, ["Massachusetts Ave @ Beacon St"])]
+
+
+def test_extracted_feed_directory(tmp_path):
+    for name, contents in FEED.items():
+        (tmp_path / name).write_text(contents)
+
+    provider = GTFSDataProvider(str(tmp_path))
+    stops_by_route = provider.get_stops_for_routes(["Red", "Mattapan"])
+
+    assert [len(sequences) for sequences in stops_by_route.values()] == [2, 1]
+
+
+def test_get_trips(feed_path):
+    provider = GTFSDataProvider(feed_path)
+    trips = {trip.id: trip for trip in provider.get_trips(["Red"])}
+
+    assert sorted(trips) == ["red-ashmont-1", "red-ashmont-2", "red-braintree-1", "red-detour-1", "red-north-1"]
+
+    trip = trips["red-ashmont-2"]
+    assert trip.route_id == "Red"
+    assert trip.stops == ["Alewife", "JFK/UMass", "Ashmont"]
+    assert trip.departures == [9 * 3600, 9 * 3600 + 600, 9 * 3600 + 1200]
+
+
+def test_get_trips_service_date(feed_path):
+    provider = GTFSDataProvider(feed_path)
+
+    # A Monday, a Saturday and a holiday taken out in calendar_dates.txt
+    assert len(list(provider.get_trips(["Red", "Mattapan"], date(2024, 7, 1)))) == 6
+    assert list(provider.get_trips(["Red", "Mattapan"], date(2024, 7, 6))) == []
+    assert list(provider.get_trips(["Red", "Mattapan"], date(2024, 7, 4))) == []
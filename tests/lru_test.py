@@ -0,0 +1,40 @@
+from transit.lru import MISSING, LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", None)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, MISSING, 3)
+    assert cache.get("b", "default") == "default"
+
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.evictions, stats.size, stats.maxsize) == (3, 2, 1, 2, 2)
+    assert stats.hit_rate == 0.6
+
+
+def test_cached_none():
+    cache = LRUCache(1)
+    cache.put("unreachable", None)
+
+    assert cache.get("unreachable") is None
+
+
+def test_clear_keeps_stats():
+    cache = LRUCache(1)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.stats.hits == 1
+
+
+def test_disabled():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+
+    assert cache.get("a") is MISSING
@@ -0,0 +1,394 @@
+from datetime import date
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from transit import metrics
+from transit.data_providers.cache import ResponseCache
+from transit.data_providers.mbta import APIError, MBTADataProvider
+from transit.planner import Leg
+from transit.system import TransitMap
+
+ROUTES = {
+    "data": [
+        {
+            "id": "Red",
+            "attributes": {"long_name": "Red Line"},
+            "relationships": {"line": {"data": {"id": "line-Red"}}},
+        },
+        {
+            "id": "Orange",
+            "attributes": {"long_name": "Orange Line"},
+            "relationships": {"line": {"data": {"id": "line-Orange"}}},
+        },
+    ]
+}
+
+STOPS = {
+    "Red": {"data": [
+        {"id": "place-alfcl", "attributes": {"name": "Alewife"}},
+        {"id": "place-dwnxg", "attributes": {"name": "Downtown Crossing"}},
+    ]},
+    "Orange": {"data": [
+        {"id": "place-ogmnl", "attributes": {"name": "Oak Grove"}},
+        {"id": "place-dwnxg", "attributes": {"name": "Downtown Crossing"}},
+    ]},
+}
+
+def get_pattern(pattern_id, route_id, direction_id, typicality, trip_id):
+    return {
+        "id": pattern_id,
+        "type": "route_pattern",
+        "attributes": {"direction_id": direction_id, "typicality": typicality, "sort_order": len(pattern_id)},
+        "relationships": {
+            "route": {"data": {"id": route_id, "type": "route"}},
+            "representative_trip": {"data": {"id": trip_id, "type": "trip"}},
+        },
+    }
+
+
+def get_trip(trip_id, stop_ids):
+    return {
+        "id": trip_id,
+        "type": "trip",
+        "relationships": {"stops": {"data": [{"id": stop_id, "type": "stop"} for stop_id in stop_ids]}},
+    }
+
+
+def get_platform(stop_id, name, parent_id):
+    return {
+        "id": stop_id,
+        "type": "stop",
+        "attributes": {"name": name},
+        "relationships": {"parent_station": {"data": {"id": parent_id, "type": "stop"}}},
+    }
+
+
+ROUTE_PATTERNS = {
+    "data": [
+        get_pattern("Red-1-0", "Red", 0, 1, "trip-red-0"),
+        get_pattern("Red-1-1", "Red", 1, 1, "trip-red-1"),
+        get_pattern("Red-2-0", "Red", 0, 1, "trip-red-braintree"),
+        get_pattern("Red-3-0", "Red", 0, 3, "trip-red-shuttle"),
+        get_pattern("Orange-1-0", "Orange", 0, 1, "trip-orange-0"),
+    ],
+    "included": [
+        get_trip("trip-red-0", ["70061", "70077", "70093"]),
+        get_trip("trip-red-braintree", ["70061", "70077", "70105"]),
+        get_trip("trip-red-1", ["70078", "70061"]),
+        get_trip("trip-red-shuttle", ["70077"]),
+        get_trip("trip-orange-0", ["70036", "70020"]),
+        get_platform("70061", "Alewife", "place-alfcl"),
+        get_platform("70077", "Downtown Crossing", "place-dwnxg"),
+        get_platform("70078", "Downtown Crossing", "place-dwnxg"),
+        get_platform("70093", "Ashmont", "place-asmnl"),
+        get_platform("70105", "Braintree", "place-brntn"),
+        get_platform("70036", "Oak Grove", "place-ogmnl"),
+        get_platform("70020", "Downtown Crossing", "place-dwnxg"),
+    ],
+}
+
+def get_schedule(trip_id, route_id, stop_id, stop_sequence, arrival, departure):
+    return {
+        "type": "schedule",
+        "attributes": {"stop_sequence": stop_sequence, "arrival_time": arrival, "departure_time": departure},
+        "relationships": {
+            "route": {"data": {"id": route_id, "type": "route"}},
+            "stop": {"data": {"id": stop_id, "type": "stop"}},
+            "trip": {"data": {"id": trip_id, "type": "trip"}},
+        },
+    }
+
+
+# A late Red Line trip (out of order, running past midnight) and an Orange Line trip with a stop that isn't included
+SCHEDULES = {
+    "data": [
+        get_schedule("red-late", "Red", "70077", 2, "2026-09-02T00:10:00-04:00", "2026-09-02T00:10:00-04:00"),
+        get_schedule("red-late", "Red", "70061", 1, None, "2026-09-01T23:55:30-04:00"),
+        get_schedule("orange-1", "Orange", "70036", 1, None, "2026-09-01T08:00:00-04:00"),
+        get_schedule("orange-1", "Orange", "missing", 2, "2026-09-01T08:05:00-04:00", None),
+        get_schedule("orange-1", "Orange", "70020", 3, "2026-09-01T08:20:00-04:00", None),
+    ],
+    "included": [
+        get_platform("70061", "Alewife", "place-alfcl"),
+        get_platform("70077", "Downtown Crossing", "place-dwnxg"),
+        get_platform("70036", "Oak Grove", "place-ogmnl"),
+        get_platform("70020", "Downtown Crossing", "place-dwnxg"),
+    ],
+}
+
+LAST_MODIFIED = "Tue, 01 Sep 2026 12:00:00 GMT"
+
+
+class MBTAStandIn(BaseHTTPRequestHandler):
+    """
+    Minimal local stand-in for the v3 API: serves the fixtures above and honours conditional requests.
+    Queued `server.failures` (status, headers) are returned before any real response.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        self.server.connections.add(self.client_address)
+        self.server.api_keys.append(self.headers.get("x-api-key"))
+
+        if self.server.failures:
+            status, headers = self.server.failures.pop(0)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if url.path == "/routes":
+            body = ROUTES
+        elif url.path == "/stops":
+            body = STOPS[query["filter[route]"][0]]
+        elif url.path == "/route_patterns":
+            route_ids = query["filter[route]"][0].split(",")
+            body = {
+                "data": [p for p in ROUTE_PATTERNS["data"] if p["relationships"]["route"]["data"]["id"] in route_ids],
+                "included": ROUTE_PATTERNS["included"],
+            }
+        elif url.path == "/schedules":
+            route_ids = query["filter[route]"][0].split(",")
+            body = {
+                "data": [s for s in SCHEDULES["data"] if s["relationships"]["route"]["data"]["id"] in route_ids],
+                "included": SCHEDULES["included"],
+            }
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = f'"{url.path}-{url.query}"'
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+
+        if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.api+json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MBTAStandIn)
+    server.requests = []
+    server.failures = []
+    server.connections = set()
+    server.api_keys = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def get_base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def get_provider(server, **kwargs):
+    """
+    Provider pointed at the stand-in that records backoff delays instead of sleeping
+    """
+    provider = MBTADataProvider(base_url=get_base_url(server), **kwargs)
+    provider.delays = []
+    provider.sleep = provider.delays.append
+    return provider
+
+
+def test_get_all_routes(api_server):
+    provider = MBTADataProvider(base_url=get_base_url(api_server))
+    routes = provider.get_all_routes()
+
+    assert [(r.name, r.id, r.line_name) for r in routes] == [
+        ("Red Line", "Red", "line-Red"),
+        ("Orange Line", "Orange", "line-Orange"),
+    ]
+
+
+def test_cache_serves_fresh_responses(api_server, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    provider = MBTADataProvider(cache=cache, base_url=get_base_url(api_server))
+
+    provider.get_all_routes()
+    provider.get_stops_for_route("Red")
+    assert len(api_server.requests) == 2
+
+    # A new provider (i.e. a new process) reading the same cache file doesn't go to the network at all
+    warm_provider = MBTADataProvider(cache=ResponseCache(cache.path), base_url=get_base_url(api_server))
+    assert [(s.name, s.id) for s in warm_provider.get_stops_for_route("Red")] == [
+        ("Alewife", "place-alfcl"),
+        ("Downtown Crossing", "place-dwnxg"),
+    ]
+    assert len(warm_provider.get_all_routes()) == 2
+    assert len(api_server.requests) == 2
+
+
+def test_cache_revalidates_stale_responses(api_server, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), ttl=0)
+    provider = MBTADataProvider(cache=cache, base_url=get_base_url(api_server))
+
+    first = provider.get_stops_for_route("Orange")
+    second = provider.get_stops_for_route("Orange")
+
+    assert [s.name for s in first] == [s.name for s in second]
+
+    # The second request was conditional and answered with a 304
+    assert api_server.requests[0][1] is None
+    assert api_server.requests[1][1] is not None
+    assert api_server.requests[1][1].endswith('=Orange"')
+
+
+def test_get_stops_for_routes_in_bulk(api_server):
+    provider = MBTADataProvider(base_url=get_base_url(api_server))
+    stops_by_route = provider.get_stops_for_routes(["Red", "Orange"])
+
+    assert len(api_server.requests) == 1
+    assert list(stops_by_route.keys()) == ["Red", "Orange"]
+    # One sequence per typical direction 0 pattern: the Ashmont and Braintree branches, not the shuttle
+    assert [
+        (sequence.direction, [(s.name, s.id) for s in sequence.stops]) for sequence in stops_by_route["Red"]
+    ] == [
+        (0, [("Alewife", "place-alfcl"), ("Downtown Crossing", "place-dwnxg"), ("Ashmont", "place-asmnl")]),
+        (0, [("Alewife", "place-alfcl"), ("Downtown Crossing", "place-dwnxg"), ("Braintree", "place-brntn")]),
+    ]
+    assert [[s.name for s in sequence.stops] for sequence in stops_by_route["Orange"]] == [
+        ["Oak Grove", "Downtown Crossing"]
+    ]
+
+
+def test_branches_are_not_joined(api_server):
+    transit_map = TransitMap(MBTADataProvider(base_url=get_base_url(api_server)))
+    transit_map.load_stops()
+
+    ashmont = transit_map.get_stop_from_string("Ashmont")
+    braintree = transit_map.get_stop_from_string("Braintree")
+    assert transit_map.plan(ashmont, braintree, optimize="stops").legs == [
+        Leg(route="Red Line", board="Ashmont", alight="Downtown Crossing", stops=1),
+        Leg(route="Red Line", board="Downtown Crossing", alight="Braintree", stops=1),
+    ]
+
+
+def test_get_stops_for_routes_batches(api_server):
+    provider = MBTADataProvider(base_url=get_base_url(api_server))
+    provider.BULK_ROUTE_BATCH_SIZE = 1
+
+    stops_by_route = provider.get_stops_for_routes(["Red", "Orange", "Blue"])
+
+    assert len(api_server.requests) == 3
+    assert stops_by_route["Blue"] == []
+
+
+def test_get_trips(api_server):
+    provider = MBTADataProvider(base_url=get_base_url(api_server))
+    trips = {trip.id: trip for trip in provider.get_trips(["Red", "Orange"], date(2026, 9, 1))}
+
+    assert len(api_server.requests) == 1
+    assert parse_qs(urlparse(api_server.requests[0][0]).query)["filter[date]"] == ["2026-09-01"]
+
+    red = trips["red-late"]
+    assert red.route_id == "Red"
+    assert red.stops == ["Alewife", "Downtown Crossing"]
+    assert red.arrivals == [86_130, 87_000]
+    assert red.departures == [86_130, 87_000]
+
+    orange = trips["orange-1"]
+    assert orange.stops == ["Oak Grove", "Downtown Crossing"]
+    assert orange.arrivals == [28_800, 30_000]
+
+
+def test_get_trips_defaults_to_today(api_server):
+    provider = MBTADataProvider(base_url=get_base_url(api_server))
+    list(provider.get_trips(["Red"]))
+
+    assert parse_qs(urlparse(api_server.requests[0][0]).query)["filter[date]"] == [date.today().isoformat()]
+
+
+def test_session_keeps_connection_alive(api_server):
+    provider = get_provider(api_server, api_key="secret")
+    provider.get_all_routes()
+    provider.get_stops_for_route("Red")
+    provider.get_stops_for_route("Orange")
+
+    assert len(api_server.connections) == 1
+    assert api_server.api_keys == ["secret", "secret", "secret"]
+
+
+def test_retry_after_rate_limit(api_server):
+    api_server.failures = [(429, {"Retry-After": "7"}), (503, {})]
+    provider = get_provider(api_server, backoff_factor=0.5)
+
+    assert len(provider.get_all_routes()) == 2
+    # Retry-After wins for the 429, exponential backoff (0.5 * 2^1) for the 503
+    assert provider.delays == [7.0, 1.0]
+
+
+def test_waits_for_rate_limit_reset(api_server):
+    reset_at = time.time() + 5
+    api_server.failures = [(304, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": str(reset_at)})]
+    provider = get_provider(api_server)
+
+    with pytest.raises(APIError):
+        provider.get_all_routes()
+
+    provider.get_all_routes()
+    assert len(provider.delays) == 1
+    assert 4 < provider.delays[0] <= 5
+
+
+def test_gives_up_after_max_retries(api_server):
+    api_server.failures = [(503, {})] * 3
+    provider = get_provider(api_server, max_retries=2, backoff_factor=1)
+
+    with pytest.raises(APIError, match="Status code: 503") as error:
+        provider.get_all_routes()
+
+    assert error.value.status_code == 503
+    assert provider.delays == [1, 2]
+
+
+def test_request_metrics(api_server, tmp_path):
+    metrics.REGISTRY.reset()
+    metrics.REGISTRY.enabled = True
+    try:
+        api_server.failures = [(503, {})]
+        provider = get_provider(api_server, cache=ResponseCache(str(tmp_path / "responses.sqlite3")))
+
+        provider.get_all_routes()
+        provider.get_all_routes()
+        text = metrics.REGISTRY.render()
+    finally:
+        metrics.REGISTRY.enabled = False
+        metrics.REGISTRY.reset()
+
+    assert 'transit_provider_requests_total{endpoint="routes",status="200"} 1' in text
+    assert 'transit_provider_requests_total{endpoint="routes",status="503"} 1' in text
+    assert 'transit_provider_request_seconds_count{endpoint="routes"} 2' in text
+    assert 'transit_provider_cache_total{result="hit"} 1' in text
+    assert 'transit_provider_cache_total{result="miss"} 1' in text
@@ -0,0 +1,78 @@
+import pytest
+
+from transit import metrics
+from transit.system import TransitMap
+
+from transit_system_test import TestSystem
+
+
+@pytest.fixture
+def registry():
+    metrics.REGISTRY.reset()
+    metrics.REGISTRY.enabled = True
+    yield metrics.REGISTRY
+    metrics.REGISTRY.enabled = False
+    metrics.REGISTRY.reset()
+
+
+def test_render():
+    registry = metrics.Registry(enabled=True)
+    counter = registry.counter("requests_total", "Requests", ("endpoint",))
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+
+    counter.inc('stops"1')
+    counter.inc('stops"1', amount=2)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="stops\\"1"} 3',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_disabled_records_nothing():
+    metrics.REGISTRY.reset()
+
+    transit_map = TransitMap(TestSystem())
+    transit_map.load_stops()
+    transit_map.plan(transit_map.get_stop_from_string("A"), transit_map.get_stop_from_string("J"))
+
+    assert all(not metric.values for metric in metrics.REGISTRY.metrics.values())
+    assert not metrics.REGISTRY.traces
+    assert metrics.REGISTRY.time(metrics.LOAD_SECONDS, "build") is metrics.NULL_TIMER
+
+
+def test_load_and_query_metrics(registry):
+    transit_map = TransitMap(TestSystem())
+    transit_map.load_stops()
+
+    origin = transit_map.get_stop_from_string("A")
+    transit_map.plan(origin, transit_map.get_stop_from_string("J"))
+    transit_map.plan(origin, transit_map.get_stop_from_string("J"), optimize="stops")
+    transit_map.plan_journey(origin, transit_map.get_stop_from_string("J"), "09:00")
+
+    assert [(t.query, t.options, t.found) for t in registry.traces] == [
+        ("plan", "optimize=transfers", True),
+        ("plan", "optimize=stops", True),
+        ("journey", "departure=09:00:00", False),
+    ]
+    transfer_trace = registry.traces[0]
+    assert (transfer_trace.origin, transfer_trace.destination) == ("A", "J")
+    assert transfer_trace.expanded == 5
+    assert transfer_trace.depth == 2
+
+    text = registry.render()
+    assert 'transit_plan_queries_total{query="plan",result="found"} 2' in text
+    assert 'transit_plan_queries_total{query="journey",result="not_found"} 1' in text
+    assert 'transit_load_seconds_count{phase="build"} 1' in text
+    assert 'transit_load_seconds_count{phase="timetable"} 1' in text
@@ -0,0 +1,263 @@
+from collections import deque
+import heapq
+import random
+import time
+
+import pytest
+
+from benchmarks.network import SyntheticDataProvider
+from transit import planner
+from transit.data_providers.base import BaseDataProvider
+from transit.graph import TransitGraph
+from transit.route import Route
+from transit.stop import Stop
+from transit.system import TransitMap
+
+
+class Crosstown(BaseDataProvider):
+    """
+    Three ways from O to Z: a slow local with no transfers, a shuttle to a fast metro, and two routes of the same
+    line that change at M2 without changing line
+    """
+    ROUTES = {
+        "Local": ("L", ["O", "1", "2", "3", "4", "Z"]),
+        "Shuttle": ("S", ["O", "M"]),
+        "Metro": ("M", ["M", "Z"]),
+        "Green 1": ("G", ["O", "X", "M2"]),
+        "Green 2": ("G", ["M2", "Z"]),
+        "Loop": ("P", ["P", "Q"]),
+    }
+
+    def get_all_routes(self):
+        return [Route(name=name, id=name, line_name=line) for name, (line, _) in self.ROUTES.items()]
+
+    def get_stops_for_route(self, route_id):
+        return [Stop(name=name, id=name) for name in self.ROUTES[route_id][1]]
+
+
+@pytest.fixture(scope="module")
+def crosstown():
+    transit_map = TransitMap(Crosstown())
+    transit_map.load_stops()
+    return transit_map
+
+
+def plan_alternatives(transit_map, start, end, optimize=planner.FEWEST_TRANSFERS, k=None):
+    origin = transit_map.get_stop_from_string(start)
+    destination = transit_map.get_stop_from_string(end)
+    return transit_map.plan_alternatives(origin, destination, optimize, k)
+
+
+def get_costs(itineraries):
+    return [(itinerary.transfers, itinerary.stops, itinerary.line_changes) for itinerary in itineraries]
+
+
+def test_pareto_set(crosstown: TransitMap):
+    itineraries = plan_alternatives(crosstown, "O", "Z")
+    assert [itinerary.routes for itinerary in itineraries] == [["Local"], ["Shuttle", "Metro"], ["Green 1", "Green 2"]]
+    assert get_costs(itineraries) == [(0, 5, 0), (1, 2, 1), (1, 3, 0)]
+
+    itineraries = plan_alternatives(crosstown, "O", "Z", planner.FEWEST_STOPS)
+    assert get_costs(itineraries) == [(1, 2, 1), (1, 3, 0), (0, 5, 0)]
+
+    # The best alternative is the itinerary `plan()` finds
+    origin = crosstown.get_stop_from_string("O")
+    destination = crosstown.get_stop_from_string("Z")
+    assert itineraries[0].legs == crosstown.plan(origin, destination, planner.FEWEST_STOPS).legs
+
+
+def test_top_k(crosstown: TransitMap):
+    itineraries = plan_alternatives(crosstown, "O", "Z", k=2)
+    assert [itinerary.routes for itinerary in itineraries] == [["Local"], ["Shuttle", "Metro"]]
+
+    assert get_costs(plan_alternatives(crosstown, "O", "Z", planner.FEWEST_STOPS, k=1)) == [(1, 2, 1)]
+    assert len(plan_alternatives(crosstown, "O", "Z", k=10)) == 3
+
+
+def test_trivial_and_unreachable(crosstown: TransitMap):
+    # Like `plan()`, a zero-stop ride on a route serving the stop
+    origin = crosstown.get_stop_from_string("O")
+    itineraries = plan_alternatives(crosstown, "O", "O")
+    assert itineraries == [crosstown.plan(origin, origin)]
+    assert get_costs(itineraries) == [(0, 0, 0)]
+
+    assert plan_alternatives(crosstown, "O", "Q") == []
+    assert plan_alternatives(crosstown, "O", "Q", k=3) == []
+
+
+def test_snapshot_round_trip(crosstown: TransitMap, tmp_path):
+    path = str(tmp_path / "network.snap")
+    crosstown.save_snapshot(path)
+
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(path)
+
+    # Line changes need the route lines, which are part of the snapshot
+    for optimize in (planner.FEWEST_TRANSFERS, planner.FEWEST_STOPS):
+        assert plan_alternatives(snapshot_map, "O", "Z", optimize) == plan_alternatives(crosstown, "O", "Z", optimize)
+
+
+def test_pareto_set_is_not_dominated():
+    transit_map = TransitMap(SyntheticDataProvider(routes=20, stops_per_route=12, transfer_density=0.3, seed=3))
+    transit_map.load_stops()
+    graph = transit_map.network.graph
+
+    rng = random.Random(5)
+    for _ in range(50):
+        origin_idx, destination_idx = rng.randrange(len(graph.stop_names)), rng.randrange(len(graph.stop_names))
+        itineraries = planner.plan_alternatives(graph, origin_idx, destination_idx)
+        best = planner.plan(graph, origin_idx, destination_idx)
+
+        costs = get_costs(itineraries)
+        assert len(set(costs)) == len(costs)
+        assert not any(
+            planner.dominates(cost, other) for cost in costs for other in costs if cost is not other
+        )
+        assert (best is None) == (not itineraries)
+        if best is not None:
+            assert costs[0][0] == best.transfers
+
+        # The k best are a prefix of the ranking, Pareto-optimal or not
+        top = get_costs(planner.plan_alternatives(graph, origin_idx, destination_idx, k=3))
+        assert top == sorted(top)
+        assert not costs or top[0] == costs[0]
+
+
+def get_random_graph(rng) -> TransitGraph:
+    stop_names = [f"S{i}" for i in range(rng.randint(4, 8))]
+    routes = []
+    for i in range(rng.randint(2, 5)):
+        route = Route(name=f"R{i}", id=i, line_name=f"L{rng.randrange(3)}")
+        for name in rng.sample(stop_names, rng.randint(2, len(stop_names))):
+            route.add_stop(Stop(name=name, id=name))
+        routes.append(route)
+
+    walks = [(name, rng.choice(stop_names), 100) for name in stop_names if rng.random() < 0.2]
+    return TransitGraph.from_routes(routes, walks=[walk for walk in walks if walk[0] != walk[1]])
+
+
+def get_transitions(graph, slot, direction, cost):
+    """
+    The states one step on from a state by the search's rules, with their costs: ride on without turning back,
+    or after riding a stop change to another route (walking over if need be)
+    """
+    route_idx = graph.slot_routes[slot]
+    stop_idx = graph.slot_stops[slot]
+    transfers, stops, line_changes = cost
+
+    for step in ((-1, 1) if direction == 0 else (direction,)):
+        if graph.route_offsets[route_idx] <= slot + step < graph.route_offsets[route_idx + 1]:
+            yield slot + step, step, (transfers, stops + 1, line_changes)
+
+    if direction != 0:
+        for board_idx in (stop_idx, *graph.walk_stops[stop_idx]):
+            for other in graph.stop_routes[board_idx]:
+                if other != route_idx:
+                    changes = line_changes + (graph.route_lines[other] != graph.route_lines[route_idx])
+                    yield graph.get_slot(other, board_idx), 0, (transfers + 1, stops, changes)
+
+
+def get_pareto_costs(graph, origin_idx, destination_idx) -> set:
+    """
+    Pareto set of the costs of every itinerary, by keeping every cost no other one beats at each state until
+    nothing changes (no heuristics, no ordering, no pruning against itineraries found)
+    """
+    if origin_idx == destination_idx:
+        return {(0, 0, 0)} if len(graph.stop_routes[origin_idx]) else set()
+
+    bags = {}
+    arrivals = []
+    queue = deque((graph.get_slot(route_idx, origin_idx), 0, (0, 0, 0)) for route_idx in graph.stop_routes[origin_idx])
+
+    while queue:
+        slot, direction, cost = queue.popleft()
+        if graph.slot_stops[slot] == destination_idx:
+            if direction != 0:
+                arrivals.append(cost)
+            continue
+
+        bag = bags.setdefault((slot, direction), [])
+        if any(planner.dominates(kept, cost) for kept in bag):
+            continue
+        bag[:] = [kept for kept in bag if not planner.dominates(cost, kept)] + [cost]
+        queue.extend(get_transitions(graph, slot, direction, cost))
+
+    return {
+        cost for cost in arrivals if not any(planner.dominates(other, cost) and other != cost for other in arrivals)
+    }
+
+
+def get_top_costs(graph, origin_idx, destination_idx, ranking, k) -> list:
+    """
+    Costs of the k best itineraries in a ranking, loops and all, by expanding every partial itinerary best first
+    """
+    heap = [(0, 0, 0, graph.get_slot(route_idx, origin_idx), 0) for route_idx in graph.stop_routes[origin_idx]]
+    heapq.heapify(heap)
+    costs = []
+
+    while heap and len(costs) < k:
+        *ranked, slot, direction = heapq.heappop(heap)
+        cost = tuple(ranked[ranking.index(criterion)] for criterion in range(3))
+
+        if graph.slot_stops[slot] == destination_idx:
+            if direction != 0 or origin_idx == destination_idx:
+                costs.append(cost)
+                if origin_idx == destination_idx:
+                    break
+            continue
+
+        for slot, direction, cost in get_transitions(graph, slot, direction, cost):
+            heapq.heappush(heap, (*(cost[criterion] for criterion in ranking), slot, direction))
+
+    return costs
+
+
+def test_reboarding():
+    # The fewest stops need leaving R2 and coming back to it
+    routes = []
+    for i, names in enumerate([["S4", "S0", "S3", "S6"], ["S1", "S0", "S6", "S3"], ["S2", "S3", "S4", "S0", "S1"]]):
+        route = Route(name=f"R{i}", id=i, line_name=f"L{i}")
+        for name in names:
+            route.add_stop(Stop(name=name, id=name))
+        routes.append(route)
+    graph = TransitGraph.from_routes(routes)
+
+    itineraries = planner.plan_alternatives(graph, graph.stop_index["S1"], graph.stop_index["S2"])
+    assert get_costs(itineraries) == [(0, 4, 0), (2, 3, 2)]
+
+
+def test_matches_brute_force():
+    rng = random.Random(11)
+    for _ in range(300):
+        graph = get_random_graph(rng)
+        origin_idx, destination_idx = rng.randrange(len(graph.stop_names)), rng.randrange(len(graph.stop_names))
+        pareto = get_pareto_costs(graph, origin_idx, destination_idx)
+
+        for optimize, ranking in planner.RANKINGS.items():
+            def rank(cost):
+                return tuple(cost[criterion] for criterion in ranking)
+
+            itineraries = planner.plan_alternatives(graph, origin_idx, destination_idx, optimize)
+            assert sorted(get_costs(itineraries), key=rank) == sorted(pareto, key=rank)
+
+            # (only when there is a way there: otherwise looping forever never gets there either)
+            if pareto:
+                top = planner.plan_alternatives(graph, origin_idx, destination_idx, optimize, k=4)
+                assert get_costs(top) == get_top_costs(graph, origin_idx, destination_idx, ranking, 4)
+
+
+def test_top_k_speed():
+    transit_map = TransitMap(SyntheticDataProvider(routes=20, stops_per_route=10, transfer_density=0.3, seed=1))
+    transit_map.load_stops()
+    graph = transit_map.network.graph
+
+    rng = random.Random(0)
+    pairs = [(rng.randrange(len(graph.stop_names)), rng.randrange(len(graph.stop_names))) for _ in range(50)]
+
+    start = time.perf_counter()
+    for origin_idx, destination_idx in pairs:
+        planner.plan_alternatives(graph, origin_idx, destination_idx, k=5)
+    elapsed = (time.perf_counter() - start) / len(pairs)
+
+    # About a millisecond on a developer machine, with plenty of headroom for slow CI
+    assert elapsed < 0.01
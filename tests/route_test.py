@@ -1,5 +1,5 @@
 import pytest
-from transit.route import Route
+from transit.route import INBOUND, Route, StopSequence
 from transit.stop import Stop
 
 @pytest.fixture
@@ -42,3 +42,100 @@ def test_get_connecting_stops(route_fixture : Route):
 
 def test_get_connecting_routes(route_fixture : Route):
    assert route_fixture.get_connecting_routes() == ['Line1', 'Line2', 'Line3']
+
+
+def test_add_stop(route_fixture : Route):
+    stop = Stop(id=5, name="Qux", route_associations=["Line1"])
+    assert route_fixture.has_stop(stop) == False
+
+    route_fixture.add_stop(stop)
+    assert route_fixture.has_stop(stop)
+    assert route_fixture.has_stops(stop, Stop(id=1, name="Foo"), Stop(id=2, name="Bar"))
+
+
+def test_route_associations():
+    stop = Stop(id=1, name="Foo", route_associations=["Line1"])
+    stop.add_route_association("Line2")
+    stop.add_route_association("Line1")
+
+    assert stop.route_associations == ("Line1", "Line2")
+    assert stop.is_associated_with_route("Line2")
+    assert stop.is_associated_with_route("Line3") == False
+    assert stop.is_associated_with_multiple_routes()
+
+
+def test_route_associations_after_reading():
+    stop = Stop(id=1, name="Foo")
+    for i in range(1000):
+        stop.add_route_association(f"Line{i}")
+    associations = stop.route_associations
+
+    # Reading freezes them, associating another route starts a new tuple
+    stop.add_route_association("Line1000")
+    assert len(associations) == 1000
+    assert stop.route_associations[-1] == "Line1000"
+    assert stop.route_associations is stop.route_associations
+
+
+def test_positions(route_fixture : Route):
+    foo, bar, baz, aaaaa = route_fixture.stops
+
+    assert route_fixture.get_position(baz) == 2
+    assert route_fixture.get_position(baz, direction=1) == 1
+    assert route_fixture.get_position(Stop(id=99, name="Nope")) is None
+
+
+def test_get_stops_between(route_fixture : Route):
+    foo, bar, baz, aaaaa = route_fixture.stops
+
+    assert route_fixture.get_stops_between(bar, aaaaa) == [bar, baz, aaaaa]
+    assert route_fixture.get_stops_between(aaaaa, foo) == [aaaaa, baz, bar, foo]
+    assert route_fixture.get_stops_between(foo, Stop(id=99, name="Nope")) == []
+
+    assert route_fixture.get_ride_length(foo, baz) == 2
+    assert route_fixture.get_ride_length(baz, foo) == 2
+    assert route_fixture.get_direction(baz, foo) == 1
+
+
+def test_positions_by_name(route_fixture : Route):
+    # Positions go by name, like membership, whatever the stop's id
+    assert route_fixture.get_position(Stop(id=4, name="test")) is None
+    assert route_fixture.get_position(Stop(id=None, name="Baz")) == 2
+
+    route = Route(name="r", id=1, stops=[Stop(name="A"), Stop(name="B"), Stop(name="C")])
+    assert [route.get_position(stop) for stop in route.stops] == [0, 1, 2]
+    assert route.get_ride_length(Stop(name="C"), Stop(name="A")) == 2
+
+
+def test_branched_route():
+    alewife, jfk, ashmont, braintree = (Stop(name=name) for name in ("Alewife", "JFK/UMass", "Ashmont", "Braintree"))
+    route = Route(name="Red", id="Red")
+    route.add_sequence([alewife, jfk, ashmont])
+    route.add_sequence([alewife, jfk, braintree])
+
+    assert route.stops == [alewife, jfk, ashmont, braintree]
+    assert route.sequences == [StopSequence([alewife, jfk, ashmont]), StopSequence([alewife, jfk, braintree])]
+
+    # The branches' termini are never next to each other
+    assert route.get_ride_length(ashmont, braintree) is None
+    assert route.get_stops_between(ashmont, braintree) == []
+
+    assert route.get_stops_between(braintree, alewife) == [braintree, jfk, alewife]
+    assert route.get_ride_length(alewife, braintree) == 2
+    assert route.get_direction(braintree, alewife) == INBOUND
+    assert route.get_sequences(INBOUND) == [[ashmont, jfk, alewife], [braintree, jfk, alewife]]
+
+
+def test_direction_sequences():
+    a, b, c, d = (Stop(name=name) for name in "ABCD")
+    route = Route(name="r", id=1)
+    route.add_sequence([a, b, c])
+    # Inbound skips B and serves D
+    route.add_sequence([c, d, a], INBOUND)
+
+    assert route.get_stops(INBOUND) == [c, d, a]
+    assert route.get_stops_between(c, a) == [c, d, a]
+    assert route.get_ride_length(b, c) == 1
+    assert route.get_ride_length(c, b) is None
+    assert route.get_position(d, INBOUND) == 1
+    assert route.get_position(d) is None
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from transit.search import StopNameIndex, get_edit_distance, normalize
+
+NAMES = [
+    "Park Street",
+    "Kendall/MIT",
+    "Harvard",
+    "Harvard Ave",
+    "Central",
+    "Government Center",
+    "Downtown Crossing",
+    "Massachusetts Ave @ Beacon St",
+    "St. Paul Street",
+    "Saint Mary's Street",
+    "Kenmore",
+    "Science Park/West End",
+]
+
+
+@pytest.fixture
+def index() -> StopNameIndex:
+    return StopNameIndex(NAMES)
+
+
+def test_normalize():
+    assert normalize("Park St.") == ("park", "st")
+    assert normalize("Park Street") == ("park", "st")
+    assert normalize("Government Centre") == ("government", "ctr")
+    assert normalize("Kendall/MIT") == ("kendall", "mit")
+    assert normalize("Café") == ("cafe",)
+
+
+def test_edit_distance():
+    assert get_edit_distance("kendall", "kendall", 2) == 0
+    assert get_edit_distance("kendal", "kendall", 2) == 1
+    assert get_edit_distance("harverd", "harvard", 2) == 1
+    assert get_edit_distance("abc", "xyzxyz", 2) == 3
+
+
+def test_search(index: StopNameIndex):
+    assert index.search("kendall")[0].name == "Kendall/MIT"
+    assert index.search("Park St")[0].name == "Park Street"
+    assert index.search("park st")[0].score >= index.CONFIDENT_SCORE
+    assert [m.name for m in index.search("harvard")] == ["Harvard", "Harvard Ave"]
+    assert index.search("Harvard")[0].score == 1.0
+    assert index.search("mass ave beacon")[0].name == "Massachusetts Ave @ Beacon St"
+    assert index.search("gov ctr")[0].name == "Government Center"
+    assert index.search("") == []
+
+
+def test_fuzzy_search(index: StopNameIndex):
+    assert index.search("Harverd")[0].name == "Harvard"
+    assert index.search("dowtown crossing")[0].name == "Downtown Crossing"
+    assert index.search("kenmoore")[0].name == "Kenmore"
+    assert index.search("xyzzy") == []
+
+
+def test_get_best_match(index: StopNameIndex):
+    assert index.get_best_match("kendall") == "Kendall/MIT"
+    assert index.get_best_match("park st") == "Park Street"
+    # Misspellings are suggestions, not answers
+    assert index.get_best_match("Harverd") is None
+    assert index.get_best_match("foo") is None
+
+
+def test_get_best_match_ambiguous(index: StopNameIndex):
+    # Short queries, and prefixes of much longer names, match too much to pick one
+    assert index.get_best_match("s") is None
+    assert index.get_best_match("p") is None
+    assert index.get_best_match("ken") is None
+    assert [m.name for m in index.search("ken")] == ["Kenmore", "Kendall/MIT"]
+    assert index.get_best_match("kenm") == "Kenmore"
+    assert index.get_best_match("C") is None
+
+    # Close runners-up are ambiguous even when both cover most of the name
+    union = StopNameIndex(["Union Square", "Union Station", "Sq"])
+    assert union.get_best_match("union s") is None
+    assert union.get_best_match("union sq") == "Union Square"
+    # An exact name always counts, however short
+    assert union.get_best_match("sq") == "Sq"
+
+
+def test_search_speed():
+    names = [f"{street} St @ {cross} Ave" for street in range(200) for cross in range(100)]
+    index = StopNameIndex(names)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        assert index.search("150 st 42")[0].name == "150 St @ 42 Ave"
+    elapsed = (time.perf_counter() - start) / 100
+
+    # Sub-millisecond on a developer machine, with plenty of headroom for slow CI
+    assert elapsed < 0.01
@@ -0,0 +1,166 @@
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+
+from transit.realtime import RealtimeState
+from transit.service import TransitService
+from transit.system import TransitMap
+
+from transit_system_test import TestSystem
+
+
+@pytest.fixture
+def service():
+    """
+    A service over the test network, running on its own event loop thread
+    """
+    service = TransitService(TransitMap(TestSystem()))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    asyncio.run_coroutine_threadsafe(service.start(port=0), loop).result(timeout=10)
+    yield service
+
+    asyncio.run_coroutine_threadsafe(service.stop(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.close()
+
+
+def get(service, path, connection=None):
+    connection = connection or http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    body = response.read()
+    if response.getheader("Content-Type") == "application/json":
+        body = json.loads(body)
+    return response.status, body
+
+
+def test_routes_and_stops(service):
+    status, routes = get(service, "/routes")
+    assert status == 200
+    assert [route["name"] for route in routes] == ["Blue", "Green", "Green A", "Orange", "Red"]
+    assert routes[1] == {"name": "Green", "id": 100, "line": "G", "stops": 5}
+
+    status, stops = get(service, "/stops")
+    assert [stop["name"] for stop in stops] == list("ABCDEFGHIJK")
+
+    status, matches = get(service, "/stops?q=c")
+    assert matches == [{"name": "C", "score": 1.0}]
+
+
+def test_connecting_stops_and_stats(service):
+    status, connecting = get(service, "/connecting-stops")
+    assert connecting["C"] == ["Green", "Green A", "Red"]
+
+    status, stats = get(service, "/stats")
+    assert stats["most_stops"] == [["Green", 5]]
+    assert stats["least_stops"] == [["Blue", 2]]
+    assert stats["stop_degrees"] == {"1": 7, "2": 2, "3": 2}
+    assert stats["lines"][1] == {"line": "G", "routes": 2, "route_stops": 9, "stops": 6}
+
+
+def test_plan(service):
+    connection = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+
+    status, result = get(service, "/plan?origin=F&destination=K", connection)
+    assert status == 200
+    assert result["routes"] == ["Red", "Green A"]
+    assert result["legs"][0] == {"route": "Red", "board": "F", "alight": "C", "stops": 1}
+
+    # Same connection, served from the response cache
+    assert get(service, "/plan?origin=F&destination=K", connection) == (status, result)
+    assert len(service.cache) == 1
+
+    status, health = get(service, "/health", connection)
+    assert (health["plan_cache"]["hits"], health["plan_cache"]["misses"]) == (1, 1)
+
+    status, result = get(service, "/plan?origin=A&destination=E&optimize=stops", connection)
+    assert (status, result["stops"]) == (200, 4)
+
+
+def test_plan_errors(service):
+    status, result = get(service, "/plan?origin=F")
+    assert (status, result) == (400, {"error": "Missing parameter: destination"})
+
+    status, result = get(service, "/plan?origin=F&destination=Nowhere")
+    assert status == 404
+    assert result["error"] == "Unknown Stop!"
+
+    status, result = get(service, "/plan?origin=F&destination=K&optimize=fastest")
+    assert status == 400
+
+    assert get(service, "/nope")[0] == 404
+
+
+def test_plan_alternatives(service):
+    status, result = get(service, "/plan/alternatives?origin=K&destination=G&k=5")
+    assert status == 200
+    assert [itinerary["routes"] for itinerary in result["itineraries"]][0] == ["Green A", "Red"]
+    assert result["itineraries"][0]["line_changes"] == 1
+
+    status, result = get(service, "/plan/alternatives?origin=K&destination=G")
+    assert (status, len(result["itineraries"])) == (200, 1)
+
+    status, result = get(service, "/plan/alternatives?origin=K&destination=G&k=0")
+    assert (status, result) == (400, {"error": "Invalid k: 0"})
+
+
+def test_nearest_stops(service):
+    # The test network has no stop locations
+    assert get(service, "/stops/nearest?lat=42.35&lon=-71.06&k=3") == (200, [])
+
+    status, result = get(service, "/stops/nearest?lat=42.35")
+    assert (status, result) == (400, {"error": "Missing parameter: lon"})
+    assert get(service, "/stops/nearest?lat=north&lon=-71.06")[0] == 400
+
+
+def test_live(service):
+    status, body = get(service, "/live")
+    assert status == 404
+
+    service.transit_map.realtime = RealtimeState(clock=lambda: 1000)
+    service.transit_map.realtime.record_arrival("Red", 0, "F", 700)
+    service.transit_map.realtime.record_arrival("Red", 0, "F", 1000)
+
+    status, live = get(service, "/live")
+    assert [status["route"] for status in live] == ["Red"]
+
+    status, red = get(service, "/live?route=Red")
+    assert (red["headway"], red["delay"], red["observations"]) == (300, None, 1)
+    assert get(service, "/live?route=Purple")[0] == 404
+
+
+def test_concurrent_requests(service):
+    results = []
+
+    def query():
+        results.append(get(service, "/plan?origin=A&destination=J")[1]["routes"])
+
+    threads = [threading.Thread(target=query) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [["Green", "Orange", "Blue"]] * 20
+
+
+def test_plan_in_worker_processes():
+    async def scenario():
+        service = TransitService(TransitMap(TestSystem()), workers=2)
+        await service.start(port=0)
+        try:
+            return await service.dispatch("GET", "/plan?origin=G&destination=H")
+        finally:
+            await service.stop()
+
+    status, _, body = asyncio.run(scenario())
+    assert status == 200
+    assert json.loads(body)["routes"] == ["Red", "Green", "Orange"]
+
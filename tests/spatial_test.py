@@ -0,0 +1,118 @@
+import random
+
+from transit.data_providers.base import BaseDataProvider
+from transit.planner import Walk
+from transit.route import Route
+from transit.spatial import SpatialGrid, get_distance
+from transit.stop import Stop
+from transit.system import TransitMap
+
+
+class Downtown(BaseDataProvider):
+    """
+    Park Street and Downtown Crossing are a short walk apart but share no route
+    """
+    STOPS = {
+        "Red": [
+            ("Charles/MGH", 42.361166, -71.070628),
+            ("Park Street", 42.356395, -71.062424),
+            ("South Station", 42.352271, -71.055242),
+        ],
+        "Orange": [
+            ("Haymarket", 42.363021, -71.05829),
+            ("Downtown Crossing", 42.355518, -71.060225),
+            ("Chinatown", 42.352547, -71.062752),
+        ],
+        "Silver": [("Courthouse", 42.352614, -71.046508), ("Unplaced", None, None)],
+    }
+
+    def get_all_routes(self):
+        return [Route(name=name, id=name, line_name=name) for name in self.STOPS]
+
+    def get_stops_for_route(self, route_id):
+        return [
+            Stop(name=name, id=name, latitude=latitude, longitude=longitude)
+            for name, latitude, longitude in self.STOPS[route_id]
+        ]
+
+
+def get_points(count, seed=7):
+    # Spread over roughly 10 x 10 km around Boston, with a few stops sharing a location
+    rng = random.Random(seed)
+    points = [(42.30 + rng.random() * 0.09, -71.15 + rng.random() * 0.12) for _ in range(count)]
+    return points + points[:5]
+
+
+def test_get_distance():
+    # A degree of latitude, and of longitude at 60 degrees north (half as long)
+    assert round(get_distance(42.0, -71.0, 43.0, -71.0)) == 111195
+    assert round(get_distance(60.0, 10.0, 60.0, 11.0)) == 55597
+    assert get_distance(42.0, -71.0, 42.0, -71.0) == 0
+
+
+def test_get_pairs_matches_brute_force():
+    points = get_points(800)
+    grid = SpatialGrid(points)
+
+    expected = {
+        (i, j) for i in range(len(points)) for j in range(i + 1, len(points))
+        if get_distance(*points[i], *points[j]) <= 300
+    }
+    pairs = {(i, j): meters for i, j, meters in grid.get_pairs(300)}
+
+    assert set(pairs) == expected
+    assert all(meters <= 300 for meters in pairs.values())
+    assert len(grid) == len(points)
+
+
+def test_get_nearest_matches_brute_force():
+    points = get_points(500)
+    grid = SpatialGrid(points)
+
+    # Inside the points, at their edge and well outside them
+    for latitude, longitude in [(42.35, -71.06), (42.30, -71.15), (42.5, -70.9), (40.7, -74.0)]:
+        expected = sorted((get_distance(latitude, longitude, *point), i) for i, point in enumerate(points))[:3]
+        assert grid.get_nearest(latitude, longitude, k=3) == [(i, meters) for meters, i in expected]
+
+
+def test_get_nearest_max_distance():
+    grid = SpatialGrid([(42.0, -71.0), None, (42.001, -71.0), (42.1, -71.0)])
+
+    nearest = grid.get_nearest(42.0, -71.0, k=5, max_distance=500)
+    assert [i for i, _ in nearest] == [0, 2]
+    assert grid.get_nearest(41.0, -71.0, max_distance=500) == []
+    assert SpatialGrid([]).get_nearest(42.0, -71.0) == []
+
+
+def test_walking_transfers_between_stops():
+    transit_map = TransitMap(Downtown())
+    transit_map.load_stops()
+
+    origin = transit_map.get_stop_from_string("Charles/MGH")
+    destination = transit_map.get_stop_from_string("Haymarket")
+    for optimize in ("transfers", "stops"):
+        itinerary = transit_map.plan(origin, destination, optimize)
+        assert itinerary.routes == ["Red", "Orange"]
+        assert itinerary.legs[1] == Walk("Park Street", "Downtown Crossing", 205)
+
+    # Park Street to Chinatown is 429 m, out of reach
+    graph = transit_map.graph
+    assert [graph.stop_names[i] for i in graph.walk_stops[graph.stop_index["Park Street"]]] == ["Downtown Crossing"]
+    assert transit_map.plan(origin, transit_map.get_stop_from_string("Courthouse")) is None
+
+    without_walks = TransitMap(Downtown(), walk_radius=0)
+    without_walks.load_stops()
+    assert without_walks.plan(origin, destination) is None
+
+
+def test_get_nearest_stops():
+    transit_map = TransitMap(Downtown())
+    transit_map.load_stops()
+
+    # Boston Common, between Park Street and Downtown Crossing but nearer the former
+    nearest = transit_map.get_nearest_stops(42.3560, -71.0615, k=2)
+    assert [(stop.name, round(meters)) for stop, meters in nearest] == [("Park Street", 88), ("Downtown Crossing", 118)]
+
+    assert len(transit_map.get_nearest_stops(42.3560, -71.0615, k=10)) == 7
+    assert transit_map.get_nearest_stops(42.3560, -71.0615, k=10, max_distance=100)[0][0].name == "Park Street"
+    assert transit_map.get_nearest_stops(42.0, -71.0, max_distance=1000) == []
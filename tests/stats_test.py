@@ -0,0 +1,62 @@
+from transit.route import Route
+from transit.stats import LineStats, NetworkStats
+from transit.stop import Stop
+
+
+def make_route(name, stop_names, line_name="L"):
+    return Route(name=name, id=name, stops=[Stop(name=stop_name) for stop_name in stop_names], line_name=line_name)
+
+
+ROUTES = [
+    make_route("A", ["a", "b", "c"], "X"),
+    make_route("B", ["c", "d", "e"], "X"),
+    make_route("C", ["e", "f"], "Y"),
+    make_route("D", ["f", "g", "h", "i"], "Y"),
+]
+
+
+def test_most_and_least_stops():
+    stats = NetworkStats.from_routes(ROUTES)
+
+    assert stats.get_most_stops() == [("D", 4)]
+    assert stats.get_least_stops() == [("C", 2)]
+    # Every tie is reported, including the first route
+    assert stats.get_largest(3) == [("D", 4), ("A", 3), ("B", 3)]
+    assert stats.get_smallest(2) == [("C", 2), ("A", 3)]
+
+
+def test_single_route():
+    stats = NetworkStats.from_routes(ROUTES[:1])
+
+    assert stats.get_most_stops() == [("A", 3)]
+    assert stats.get_least_stops() == [("A", 3)]
+    assert NetworkStats().get_most_stops() == []
+
+
+def test_degrees_and_lines():
+    stats = NetworkStats.from_routes(ROUTES)
+
+    assert stats.get_degree("c") == 2
+    assert stats.get_degree("z") == 0
+    assert stats.get_degree_histogram() == {1: 6, 2: 3}
+    assert stats.connecting_stop_count == 3
+    assert stats.get_line_stats() == [LineStats("X", 2, 6, 5), LineStats("Y", 2, 6, 5)]
+
+
+def test_updated():
+    stats = NetworkStats.from_routes(ROUTES)
+
+    # D loses two stops, C goes away and E is added
+    shorter = make_route("D", ["f", "g"], "Y")
+    added = make_route("E", ["a", "c", "g"], "Z")
+    updated = stats.updated(removed=[ROUTES[2], ROUTES[3]], added=[shorter, added])
+
+    assert updated == NetworkStats.from_routes([ROUTES[0], ROUTES[1], shorter, added])
+    assert updated.get_least_stops() == [("D", 2)]
+    assert updated.get_most_stops() == [("A", 3), ("B", 3), ("E", 3)]
+    assert updated.get_degree_histogram() == {1: 4, 2: 2, 3: 1}
+    assert [line.line for line in updated.get_line_stats()] == ["X", "Y", "Z"]
+
+    # The original is left alone
+    assert stats == NetworkStats.from_routes(ROUTES)
+    assert stats.get_most_stops() == [("D", 4)]
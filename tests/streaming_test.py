@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import pytest
+
+from transit.data_providers.streaming import MBTAStreamingProvider, parse_events
+from transit.planner import Itinerary, Leg
+from transit.realtime import BUFFER_SIZE, RealtimeState
+from transit.system import TransitMap
+
+
+def get_vehicle(vehicle_id, route_id, stop_id, updated_at, status="STOPPED_AT"):
+    return {
+        "id": vehicle_id,
+        "type": "vehicle",
+        "attributes": {"current_status": status, "direction_id": 0, "updated_at": updated_at},
+        "relationships": {"route": {"data": {"id": route_id}}, "stop": {"data": {"id": stop_id}}},
+    }
+
+
+def get_schedule(schedule_id, arrival_time):
+    return {"id": schedule_id, "type": "schedule", "attributes": {"arrival_time": arrival_time}}
+
+
+def get_prediction(prediction_id, route_id, schedule_id, arrival_time):
+    return {
+        "id": prediction_id,
+        "type": "prediction",
+        "attributes": {"arrival_time": arrival_time, "departure_time": None},
+        "relationships": {"route": {"data": {"id": route_id}}, "schedule": {"data": {"id": schedule_id}}},
+    }
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+STREAMS = {
+    "/vehicles": [
+        ": keep-alive\n\n",
+        format_event("reset", [get_vehicle("v1", "Red", "alfcl", "2026-10-18T08:00:00-04:00")]),
+        format_event("update", get_vehicle("v2", "Red", "alfcl", "2026-10-18T08:06:00-04:00")),
+        format_event("update", get_vehicle("v1", "Red", "davis", "2026-10-18T08:02:00-04:00", "IN_TRANSIT_TO")),
+        format_event("update", get_vehicle("v3", "Red", "alfcl", "2026-10-18T08:14:00-04:00")),
+        format_event("update", get_vehicle("v9", "Silver", "alfcl", "2026-10-18T08:15:00-04:00")),
+        format_event("remove", {"id": "v1", "type": "vehicle"}),
+    ],
+    "/predictions": [
+        format_event("reset", [
+            get_schedule("s1", "2026-10-18T08:10:00-04:00"),
+            get_prediction("p1", "Red", "s1", "2026-10-18T08:12:00-04:00"),
+        ]),
+        # Same delay again, then a change
+        format_event("update", get_prediction("p1", "Red", "s1", "2026-10-18T08:12:00-04:00")),
+        format_event("update", get_prediction("p1", "Red", "s1", "2026-10-18T08:13:00-04:00")),
+        "event: update\ndata: {not json\n\n",
+    ],
+}
+
+
+class SSEStandIn(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the v3 streaming API: sends the events in `STREAMS` for the path in small chunks, then
+    holds the stream open (like the real API) until `server.release` is set
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.server.requests.append((self.path, self.headers.get("Accept")))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        payload = "".join(STREAMS.get(path, [])).encode()
+        # Split events across chunks, the client must not care where chunks end
+        for start in range(0, len(payload), 37):
+            self.write_chunk(payload[start:start + 37])
+
+        self.server.release.wait(5)
+        self.write_chunk(b"")
+
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sse_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SSEStandIn)
+    server.daemon_threads = True
+    server.requests = []
+    server.release = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def test_parse_events():
+    lines = [": comment", "event: update", "data: {\"a\":", "data: 1}", "id: 7", "", "data: x", "", "", "event: y"]
+    events = list(parse_events(iter(lines)))
+
+    assert [(e.event, e.data, e.id) for e in events] == [("update", "{\"a\":\n1}", "7"), ("message", "x", "7")]
+
+
+def test_stream(sse_server):
+    state = RealtimeState(clock=lambda: 1792324800)
+    stream = MBTAStreamingProvider(
+        state, {"Red": "Red Line"}, base_url=f"http://127.0.0.1:{sse_server.server_address[1]}/"
+    )
+    stream.start()
+
+    try:
+        wait_for(lambda: state.get_status("Red Line").observations == 4)
+    finally:
+        sse_server.release.set()
+        stream.stop()
+
+    status = state.get_status("Red Line")
+    # Vehicles reached Alewife at 08:00, 08:06 and 08:14; p1 went from 2 to 3 minutes late
+    assert status.headway == 420
+    assert status.delay == 150
+    assert status.vehicles == 2
+    assert status.expected_wait == 360
+    assert state.get_routes() == ["Red Line"]
+
+    paths = sorted(unquote(path) for path, _ in sse_server.requests)
+    assert paths[0] == "/predictions?filter[route]=Red&include=schedule"
+    assert paths[-1] == "/vehicles?filter[route]=Red"
+    assert all(accept == "text/event-stream" for _, accept in sse_server.requests)
+
+
+def test_stream_reconnects(sse_server):
+    sse_server.release.set()
+    stream = MBTAStreamingProvider(
+        RealtimeState(), {"Red": "Red Line"}, base_url=f"http://127.0.0.1:{sse_server.server_address[1]}/",
+        backoff_factor=0.01
+    )
+    stream.start()
+
+    try:
+        wait_for(lambda: len(sse_server.requests) >= 4)
+    finally:
+        stream.stop()
+
+    assert not any(thread.is_alive() for thread in stream.threads)
+
+
+def test_memory_is_bounded():
+    state = RealtimeState()
+
+    for i in range(10000):
+        state.record_arrival("Red Line", 0, "alfcl", i * 60)
+        state.record_delay("Red Line", i % 120, at=i * 60)
+
+    buffer = state.routes["Red Line"]
+    assert len(buffer.headways) == BUFFER_SIZE
+    assert len(buffer.delays) == BUFFER_SIZE
+    assert len(state.stop_arrivals) == 1
+
+
+def test_dwelling_vehicle_is_one_arrival():
+    state = RealtimeState(clock=lambda: 1000)
+    stream = MBTAStreamingProvider(state, {"Red": "Red Line"})
+
+    # v1 dwells at Alewife, reporting STOPPED_AT every 10 seconds, then v2 arrives behind it
+    for updated_at in ("08:00:00", "08:00:10", "08:00:20"):
+        stream.handle_vehicle(get_vehicle("v1", "Red", "alfcl", f"2026-10-18T{updated_at}-04:00"))
+    assert state.get_status("Red Line").observations == 0
+
+    stream.handle_vehicle(get_vehicle("v2", "Red", "alfcl", "2026-10-18T08:05:00-04:00"))
+    status = state.get_status("Red Line")
+    assert status.headway == 300
+    assert status.observations == 1
+
+    # v2 leaves and comes back to Alewife: not a headway between two vehicles
+    stream.handle_vehicle(get_vehicle("v2", "Red", "davis", "2026-10-18T08:07:00-04:00", "IN_TRANSIT_TO"))
+    stream.handle_vehicle(get_vehicle("v2", "Red", "alfcl", "2026-10-18T08:20:00-04:00"))
+    assert state.get_status("Red Line").observations == 1
+
+
+def test_old_observations_expire():
+    now = [1000.0]
+    state = RealtimeState(max_age=300, clock=lambda: now[0])
+
+    state.record_arrival("Red Line", 0, "alfcl", 400)
+    state.record_arrival("Red Line", 0, "alfcl", 1000)
+    assert state.get_status("Red Line").headway == 600
+
+    now[0] = 2000.0
+    status = state.get_status("Red Line")
+    assert status.headway is None
+    assert status.expected_wait is None
+
+
+def test_expected_wait():
+    transit_map = TransitMap()
+    itinerary = Itinerary([Leg("Red Line", "A", "B"), Leg("Orange Line", "B", "C")])
+    assert transit_map.get_expected_wait(itinerary) is None
+
+    now = 10000.0
+    transit_map.realtime = RealtimeState(clock=lambda: now)
+    transit_map.realtime.record_arrival("Red Line", 0, "a", now - 600)
+    transit_map.realtime.record_arrival("Red Line", 0, "a", now)
+    assert transit_map.get_expected_wait(itinerary) is None
+
+    transit_map.realtime.record_arrival("Orange Line", 1, "b", now - 240)
+    transit_map.realtime.record_arrival("Orange Line", 1, "b", now)
+    transit_map.realtime.record_delay("Orange Line", 60)
+    assert transit_map.get_expected_wait(itinerary) == 300 + 120 + 60
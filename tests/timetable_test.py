@@ -0,0 +1,71 @@
+import time
+
+from transit.timetable import NEVER, JourneySearch, Timetable, Trip, format_time, parse_time, plan_journey
+
+
+def make_trip(trip_id, route_id, stops, start, step=120):
+    times = [start + i * step for i in range(len(stops))]
+    return Trip(id=trip_id, route_id=route_id, stops=stops, arrivals=times, departures=times)
+
+
+def test_parse_time():
+    assert parse_time("08:15") == 8 * 3600 + 15 * 60
+    assert parse_time("25:00:30") == 25 * 3600 + 30
+    assert format_time(parse_time("25:00:30")) == "25:00:30"
+
+
+def test_overtaking_trips_get_their_own_pattern():
+    trips = [
+        make_trip("local", "r", ["A", "B", "C"], 0, step=600),
+        # Leaves later but arrives at C first
+        make_trip("express", "r", ["A", "B", "C"], 60, step=60),
+    ]
+    timetable = Timetable.from_trips(trips, {"r": "Route"})
+
+    assert len(timetable.pattern_routes) == 2
+
+    journey = plan_journey(timetable, timetable.stop_index["A"], timetable.stop_index["C"], 0)
+    assert journey.legs[0].trip == "express"
+    assert journey.arrival == 180
+
+
+def test_one_to_all():
+    trips = [
+        make_trip("a", "1", ["A", "B", "C"], 0),
+        make_trip("b", "2", ["C", "D"], 300),
+    ]
+    timetable = Timetable.from_trips(trips, {"1": "One", "2": "Two"})
+    search = JourneySearch(timetable, timetable.stop_index["A"], 0)
+
+    assert [format_time(search.arrival_at(timetable.stop_index[s])) for s in "BCD"] == [
+        "00:02:00", "00:04:00", "00:07:00"
+    ]
+    assert search.journey_to(timetable.stop_index["D"]).routes == ["One", "Two"]
+
+    # Nothing goes back to A
+    assert JourneySearch(timetable, timetable.stop_index["D"], 0).arrival_at(timetable.stop_index["A"]) == NEVER
+
+
+def test_full_day_speed():
+    # A grid of 20 east-west and 20 north-south lines crossing at 400 stops, with a trip every 5 minutes in
+    # each direction from 05:00 to 01:00 - about 20000 trips
+    trips = []
+    for line in range(20):
+        east = [f"{line}-{i}" for i in range(20)]
+        north = [f"{i}-{line}" for i in range(20)]
+
+        for start in range(5 * 3600, 25 * 3600, 300):
+            for name, stops in (("e", east), ("n", north)):
+                trips.append(make_trip(f"{name}{line}-{start}", f"{name}{line}", stops, start))
+                trips.append(make_trip(f"{name}{line}-{start}-back", f"{name}{line}", stops[::-1], start))
+
+    routes = {f"{name}{line}": f"{name}{line}" for name in "en" for line in range(20)}
+    timetable = Timetable.from_trips(trips, routes)
+
+    queries = [(f"{i}-0", f"{19 - i}-19", 6 * 3600 + i * 1800) for i in range(20)]
+    started = time.perf_counter()
+    for origin, destination, departure in queries:
+        journey = plan_journey(timetable, timetable.stop_index[origin], timetable.stop_index[destination], departure)
+        assert journey is not None
+
+    assert (time.perf_counter() - started) / len(queries) < 0.02
@@ -1,10 +1,19 @@
 import pytest
+import io
+import pickle
+import threading
+import time
 from functools import cache
 
-from transit.route import Route
+from transit.planner import Leg
+from transit.route import Route, StopSequence
 from transit.stop import Stop
 from transit.data_providers.base import BaseDataProvider
 from transit.system import TransitMap
+from transit import batch
+from transit.graph import TransitGraph
+from transit.snapshot import SnapshotError, read_graph, read_snapshot, write_snapshot
+from transit.timetable import Trip, parse_time
 
 STOPS = {
     100: [
@@ -36,6 +45,18 @@ STOPS = {
     ],
 }
 
+# (trip id, route id, [(stop, "HH:MM")])
+TRIPS = [
+    ("green-1", 100, [("A", "08:00"), ("B", "08:05"), ("C", "08:10"), ("D", "08:15"), ("E", "08:20")]),
+    ("green-2", 100, [("A", "08:30"), ("B", "08:35"), ("C", "08:40"), ("D", "08:45"), ("E", "08:50")]),
+    ("red-1", 200, [("F", "08:00"), ("C", "08:06"), ("G", "08:12")]),
+    ("red-2", 200, [("F", "08:10"), ("C", "08:16"), ("G", "08:22")]),
+    ("orange-1", 300, [("H", "08:00"), ("D", "08:10"), ("I", "08:20")]),
+    ("orange-2", 300, [("H", "08:20"), ("D", "08:30"), ("I", "08:40")]),
+    ("blue-1", 400, [("I", "08:25"), ("J", "08:30")]),
+    ("blue-2", 400, [("I", "08:45"), ("J", "08:50")]),
+]
+
 class TestSystem(BaseDataProvider):
     def get_all_routes(self):
         return [
@@ -53,6 +74,22 @@ class TestSystem(BaseDataProvider):
             
         return stops
 
+    def get_trips(self, route_ids, service_date=None):
+        for trip_id, route_id, stop_times in TRIPS:
+            if route_id in route_ids:
+                times = [parse_time(time) for _, time in stop_times]
+                yield Trip(id=trip_id, route_id=route_id, stops=[stop for stop, _ in stop_times], arrivals=times,
+                           departures=times)
+
+class SlowTestSystem(TestSystem):
+    MAX_CONCURRENT_REQUESTS = 5
+
+    def get_stops_for_route(self, route_id):
+        # Earlier routes take longer, so completion order is the reverse of request order
+        time.sleep(0.2 - route_id / 5000)
+        return super().get_stops_for_route(route_id)
+
+
 @cache
 def get_transit_map():
     data_provider = TestSystem()
@@ -108,6 +145,10 @@ def test_route_serviced_by_same_line_as_stop(transit_system_fixture: TransitMap)
     assert transit_system_fixture.route_serviced_by_same_line_as_stop(route, stop)
     assert transit_system_fixture.route_serviced_by_same_line_as_stop(route, stop2) == False
 
+    # B is only served by the G line, so not by the same line as Red
+    red = transit_system_fixture.get_route_from_string('Red')
+    assert transit_system_fixture.route_serviced_by_same_line_as_stop(red, stop) == False
+
 
 def test_same_route(transit_system_fixture: TransitMap):
     # Direct Routes
@@ -155,3 +196,447 @@ def test_changeover_routes(transit_system_fixture: TransitMap):
         result = transit_system_fixture.get_routes_for_stops(origin, destination)
 
         assert expected == result
+
+
+def test_plan_legs(transit_system_fixture: TransitMap):
+    origin = transit_system_fixture.get_stop_from_string("F")
+    destination = transit_system_fixture.get_stop_from_string("K")
+    itinerary = transit_system_fixture.plan(origin, destination)
+
+    assert itinerary.routes == ["Red", "Green A"]
+    assert [(leg.board, leg.alight, leg.stops) for leg in itinerary.legs] == [("F", "C", 1), ("C", "K", 2)]
+    assert itinerary.transfers == 1
+
+
+def test_plan_fewest_stops(transit_system_fixture: TransitMap):
+    test_cases = [
+        ("A", "E", ["Green"], 4),
+        ("E", "K", ["Green", "Green A"], 4),
+        ("A", "J", ["Green", "Orange", "Blue"], 5),
+        ("G", "H", ["Red", "Green", "Orange"], 3),
+    ]
+
+    for start, end, expected_routes, expected_stops in test_cases:
+        origin = transit_system_fixture.get_stop_from_string(start)
+        destination = transit_system_fixture.get_stop_from_string(end)
+        itinerary = transit_system_fixture.plan(origin, destination, optimize="stops")
+
+        assert itinerary.routes == expected_routes
+        assert itinerary.stops == expected_stops
+
+
+def test_get_stops_for_routes_concurrently():
+    data_provider = SlowTestSystem()
+    route_ids = [route.id for route in data_provider.get_all_routes()]
+
+    start = time.perf_counter()
+    stops_by_route = data_provider.get_stops_for_routes(route_ids)
+    elapsed = time.perf_counter() - start
+
+    assert list(stops_by_route.keys()) == route_ids
+    assert [stop.name for stop in stops_by_route[150]] == ["K", "B", "C", "D"]
+    # Five 0.1-0.2s requests in parallel, rather than ~0.75s back to back
+    assert elapsed < 0.5
+
+
+def test_snapshot_round_trip(transit_system_fixture: TransitMap, tmp_path):
+    path = str(tmp_path / "network.snap")
+    transit_system_fixture.save_snapshot(path)
+
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(path)
+
+    assert list(snapshot_map.routes.keys()) == list(transit_system_fixture.routes.keys())
+    assert snapshot_map.get_route_from_string('Green').id == 100
+    assert snapshot_map.get_stop_from_string('C') == transit_system_fixture.get_stop_from_string('C')
+    assert snapshot_map.get_routes_with_most_stops() == [('Green', 5)]
+
+    for start, end in [("A", "J"), ("F", "K"), ("E", "K"), ("C", "G")]:
+        origin = snapshot_map.get_stop_from_string(start)
+        destination = snapshot_map.get_stop_from_string(end)
+
+        for optimize in ("transfers", "stops"):
+            expected = transit_system_fixture.plan(origin, destination, optimize)
+            assert snapshot_map.plan(origin, destination, optimize) == expected
+
+
+def test_snapshot_version(transit_system_fixture: TransitMap, tmp_path):
+    path = tmp_path / "network.snap"
+    transit_system_fixture.save_snapshot(str(path))
+
+    data = bytearray(path.read_bytes())
+    data[4] = 99
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(SnapshotError, match="version 99"):
+        TransitMap().load_snapshot(str(path))
+
+
+@pytest.mark.parametrize("size", [0, 3, 100])
+def test_snapshot_too_short(transit_system_fixture: TransitMap, tmp_path, size):
+    path = tmp_path / "network.snap"
+    transit_system_fixture.save_snapshot(str(path))
+    path.write_bytes(path.read_bytes()[:size])
+
+    with pytest.raises(SnapshotError):
+        TransitMap().load_snapshot(str(path))
+
+
+def test_snapshot_rewrite_keeps_mapped_network(transit_system_fixture: TransitMap, tmp_path):
+    path = str(tmp_path / "network.snap")
+    transit_system_fixture.save_snapshot(path)
+
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(path)
+
+    # Rewriting the file must not disturb the network already mapped from it
+    transit_system_fixture.save_snapshot(path)
+    assert snapshot_map.get_routes_with_most_stops() == [('Green', 5)]
+    assert list(tmp_path.iterdir()) == [tmp_path / "network.snap"]
+
+
+def test_snapshot_skips_stops_without_routes(transit_system_fixture: TransitMap, tmp_path):
+    path = str(tmp_path / "network.snap")
+    routes = transit_system_fixture.network.routes.values()
+    graph = TransitGraph.from_routes(routes, stop_names=["Gone"], walks=[("A", "B", 120)])
+
+    write_snapshot(path, routes, graph)
+    _, stops, mapped = read_snapshot(path)
+
+    assert "Gone" not in stops
+    assert mapped.stop_names == [name for name in graph.stop_names if name != "Gone"]
+    assert mapped.get_walk_meters(mapped.stop_index["A"], mapped.stop_index["B"]) == 120
+
+
+def test_pickled_snapshot_graph(transit_system_fixture: TransitMap, tmp_path):
+    path = str(tmp_path / "network.snap")
+    transit_system_fixture.save_snapshot(path)
+
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(path)
+    graph = snapshot_map.graph
+
+    # Pickled as the path while the file is the one that was mapped
+    copy = pickle.loads(pickle.dumps(graph))
+    assert copy.snapshot_path == path
+    assert copy.snapshot_fingerprint == graph.snapshot_fingerprint
+
+    # ... and as the arrays once it has been rewritten
+    transit_system_fixture.save_snapshot(path)
+    with pytest.raises(SnapshotError, match="rewritten"):
+        read_graph(path, graph.snapshot_fingerprint)
+
+    copy = pickle.loads(pickle.dumps(graph))
+    assert copy.snapshot_path is None
+    assert copy.stop_names == graph.stop_names
+    assert list(copy.slot_routes) == list(graph.slot_routes)
+    assert list(copy.route_stops) == list(graph.route_stops)
+
+
+class BranchedSystem(BaseDataProvider):
+    """
+    A trunk from Alewife to JFK/UMass splitting to Ashmont and Braintree, and a crosstown bus
+    """
+    def get_all_routes(self):
+        return [Route(name="Red", id="Red", line_name="R"), Route(name="Bus", id="Bus", line_name="B")]
+
+    def get_stops_for_route(self, route_id):
+        if route_id == "Bus":
+            return [Stop(name="Ashmont"), Stop(name="Fields Corner")]
+        return [
+            StopSequence([Stop(name=name) for name in ("Alewife", "JFK/UMass", "Ashmont")]),
+            StopSequence([Stop(name=name) for name in ("Alewife", "JFK/UMass", "Braintree")]),
+        ]
+
+
+def test_branched_route(tmp_path):
+    transit_map = TransitMap(BranchedSystem())
+    transit_map.load_stops()
+
+    # Riding from one branch to the other means changing trains at the junction
+    ashmont = transit_map.get_stop_from_string("Ashmont")
+    braintree = transit_map.get_stop_from_string("Braintree")
+    assert transit_map.plan(ashmont, braintree, "stops").legs == [
+        Leg(route="Red", board="Ashmont", alight="JFK/UMass", stops=1),
+        Leg(route="Red", board="JFK/UMass", alight="Braintree", stops=1),
+    ]
+    itinerary = transit_map.plan(ashmont, braintree)
+    assert (itinerary.routes, itinerary.transfers, itinerary.line_changes) == (["Red", "Red"], 1, 0)
+
+    assert transit_map.get_route_from_string("Red").get_ride_length(ashmont, braintree) is None
+    assert transit_map.get_routes_for_stops(transit_map.get_stop_from_string("Alewife"), braintree) == ["Red"]
+    assert transit_map.refresh().is_empty
+
+    # The sequences survive a snapshot
+    path = str(tmp_path / "network.snap")
+    transit_map.save_snapshot(path)
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(path)
+    assert snapshot_map.routes == transit_map.routes
+    assert snapshot_map.plan(ashmont, braintree, "stops") == transit_map.plan(ashmont, braintree, "stops")
+
+
+def test_instances_do_not_share_state(transit_system_fixture: TransitMap):
+    other_map = TransitMap(TestSystem())
+    assert len(other_map.routes) == 0
+
+    other_map.load_routes()
+    assert len(other_map.routes) == 5
+    assert other_map.graph is None
+    assert transit_system_fixture.get_route_from_string('Green') is not other_map.get_route_from_string('Green')
+
+
+def test_queries_during_reload():
+    transit_map = TransitMap(TestSystem())
+    transit_map.load_stops()
+    first_version = transit_map.network.version
+    errors = []
+
+    def query():
+        try:
+            for _ in range(200):
+                network = transit_map.network
+                origin = network.stops["F"]
+                destination = network.stops["J"]
+                assert transit_map.get_routes_for_stops(origin, destination) == ["Red", "Green", "Orange", "Blue"]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(20):
+        transit_map.reload()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert transit_map.network.version == first_version + 20
+
+
+class ChangingTestSystem(TestSystem):
+    def __init__(self):
+        self.routes = TestSystem().get_all_routes()
+        self.stops = {route_id: list(stops) for route_id, stops in STOPS.items()}
+
+    def get_all_routes(self):
+        return list(self.routes)
+
+    def get_stops_for_route(self, route_id):
+        return list(self.stops[route_id])
+
+
+def test_refresh():
+    data_provider = ChangingTestSystem()
+    transit_map = TransitMap(data_provider)
+    transit_map.load_stops()
+    before = transit_map.network
+
+    assert transit_map.refresh().is_empty
+    assert transit_map.network is before
+
+    # Blue is discontinued, Purple replaces it, Orange skips H and gains Z
+    data_provider.routes = [r for r in data_provider.routes if r.name != "Blue"]
+    data_provider.routes.append(Route(name="Purple", id=500, line_name="P"))
+    data_provider.stops[500] = [Stop(id=9, name="I"), Stop(id=12, name="Z"), Stop(id=10, name="J")]
+    data_provider.stops[300] = [Stop(id=4, name="D"), Stop(id=9, name="I"), Stop(id=12, name="Z")]
+
+    diff = transit_map.refresh()
+    after = transit_map.network
+
+    assert diff.added_routes == ["Purple"]
+    assert diff.removed_routes == ["Blue"]
+    assert [(c.route, c.added_stops, c.removed_stops) for c in diff.changed_routes] == [("Orange", ["Z"], ["H"])]
+    assert after.version == before.version + 1
+
+    # Untouched routes and stops are shared with the previous network, which itself is unchanged
+    assert after.routes["Green"] is before.routes["Green"]
+    assert after.stops["A"] is before.stops["A"]
+    assert "Blue" in before.routes and "H" in before.stops
+
+    assert list(after.routes.keys()) == ["Green", "Green A", "Red", "Orange", "Purple"]
+    assert "H" not in after.stops
+    assert after.stops["I"].route_associations == ("Orange", "Purple")
+    assert after.stops["Z"].route_associations == ("Orange", "Purple")
+    assert after.connecting_stops["I"] == ("Orange", "Purple")
+    assert "Z" in after.connecting_stops
+    assert [s.name for s in after.routes["Orange"].stops] == ["D", "I", "Z"]
+
+    # H is gone from the planner graph too, and the stops still served keep their order
+    assert "H" not in after.graph.stop_index
+    assert after.graph.stop_names == [name for name in before.graph.stop_names if name != "H"] + ["Z"]
+
+    # The patched network matches one loaded from scratch
+    fresh_map = TransitMap(data_provider)
+    fresh_map.load_stops()
+    assert dict(after.connecting_stops) == dict(fresh_map.network.connecting_stops)
+    assert after.stats == fresh_map.network.stats
+
+    origin = after.stops["A"]
+    destination = after.stops["J"]
+    assert transit_map.get_routes_for_stops(origin, destination) == ["Green", "Orange", "Purple"]
+
+
+def test_transfer_matrix(transit_system_fixture: TransitMap, tmp_path):
+    import numpy as np
+    from transit.transfers import UNREACHABLE
+
+    matrix = transit_system_fixture.get_transfer_matrix()
+    assert transit_system_fixture.get_transfer_matrix() is matrix
+
+    # Every pair agrees with the planner
+    names = sorted(transit_system_fixture.stops.keys())
+    table = matrix.transfers(matrix.get_stop_indexes(names)[:, np.newaxis], matrix.get_stop_indexes(names))
+    for i, start in enumerate(names):
+        for j, end in enumerate(names):
+            origin = transit_system_fixture.get_stop_from_string(start)
+            destination = transit_system_fixture.get_stop_from_string(end)
+            assert table[i, j] == transit_system_fixture.plan(origin, destination).transfers
+
+    origins = matrix.get_stop_indexes(["A", "F", "E", "J"])
+    destinations = matrix.get_stop_indexes(["G", "J", "K", "J"])
+    assert matrix.transfers(origins, destinations).tolist() == [1, 3, 1, 0]
+
+    assert UNREACHABLE not in table
+
+    # Stored alongside the network snapshot
+    transit_system_fixture.save_snapshot(str(tmp_path / "network.snap"))
+    matrix.save(str(tmp_path / "network.transfers.npy"))
+
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(str(tmp_path / "network.snap"))
+    loaded = snapshot_map.load_transfer_matrix(str(tmp_path / "network.transfers.npy"))
+
+    assert loaded.transfers(origins, destinations).tolist() == [1, 3, 1, 0]
+    assert snapshot_map.get_transfer_matrix() is loaded
+
+
+def test_plan_batch(transit_system_fixture: TransitMap, tmp_path):
+    csv_input = io.StringIO("origin,destination\nA,G\nF,J\nA,I\nA,foo\n")
+    jsonl_input = io.StringIO('{"origin": "A", "destination": "G"}\n\n{"origin": "F", "destination": "J"}\n')
+
+    assert list(batch.read_pairs(csv_input)) == [("A", "G"), ("F", "J"), ("A", "I"), ("A", "foo")]
+    assert list(batch.read_pairs(jsonl_input)) == [("A", "G"), ("F", "J")]
+
+    pairs = [("A", "G"), ("F", "J"), ("A", "I"), ("A", "foo")] * 3
+    expected = [
+        {"origin": "A", "destination": "G", "routes": ["Green", "Red"], "transfers": 1, "stops": 3},
+        {"origin": "F", "destination": "J", "routes": ["Red", "Green", "Orange", "Blue"], "transfers": 3, "stops": 4},
+        {"origin": "A", "destination": "I", "routes": ["Green", "Orange"], "transfers": 1, "stops": 4},
+        {"origin": "A", "destination": "foo", "error": "Unknown Stop!"},
+    ] * 3
+
+    assert list(transit_system_fixture.plan_batch(pairs)) == expected
+    assert list(batch.plan_batch(transit_system_fixture.graph, pairs, chunk_size=5)) == expected
+
+    # Worker processes, with the graph pickled or mapped from a snapshot
+    assert list(batch.plan_batch(transit_system_fixture.graph, pairs, workers=2, chunk_size=2)) == expected
+
+    transit_system_fixture.save_snapshot(str(tmp_path / "network.snap"))
+    snapshot_map = TransitMap()
+    snapshot_map.load_snapshot(str(tmp_path / "network.snap"))
+    assert list(snapshot_map.plan_batch(pairs, workers=2)) == expected
+
+    output = io.StringIO()
+    batch.write_results(output, expected[:2], batch.CSV)
+    assert output.getvalue().splitlines() == [
+        "origin,destination,routes,transfers,stops,error",
+        "A,G,Green;Red,1,3,",
+        "F,J,Red;Green;Orange;Blue,3,4,",
+    ]
+
+
+def test_plan_batch_malformed_rows(transit_system_fixture: TransitMap):
+    csv_input = io.StringIO("origin,destination\nA,G\nF\nA,I\n")
+    jsonl_input = io.StringIO('{"origin": "A", "destination": "G"}\n{"origin": "A", \n[1, 2]\n{"origin": "F"}\n'
+                              '{"origin": "A", "destination": "I"}\n')
+
+    assert list(transit_system_fixture.plan_batch(batch.read_pairs(csv_input))) == [
+        {"origin": "A", "destination": "G", "routes": ["Green", "Red"], "transfers": 1, "stops": 3},
+        {"origin": "F", "destination": "", "error": "Missing origin or destination"},
+        {"origin": "A", "destination": "I", "routes": ["Green", "Orange"], "transfers": 1, "stops": 4},
+    ]
+    assert list(transit_system_fixture.plan_batch(batch.read_pairs(jsonl_input))) == [
+        {"origin": "A", "destination": "G", "routes": ["Green", "Red"], "transfers": 1, "stops": 3},
+        {"origin": "", "destination": "", "error": "Invalid JSON"},
+        {"origin": "", "destination": "", "error": "Missing origin or destination"},
+        {"origin": "F", "destination": "", "error": "Missing origin or destination"},
+        {"origin": "A", "destination": "I", "routes": ["Green", "Orange"], "transfers": 1, "stops": 4},
+    ]
+
+
+def test_get_stop_from_string_inexact(transit_system_fixture: TransitMap):
+    assert transit_system_fixture.get_stop_from_string('c').name == 'C'
+    assert transit_system_fixture.get_stop_from_string(' C ').name == 'C'
+    assert [m.name for m in transit_system_fixture.search_stops('b')] == ['B']
+
+
+def test_plan_journey(transit_system_fixture: TransitMap):
+    origin = transit_system_fixture.get_stop_from_string("A")
+    destination = transit_system_fixture.get_stop_from_string("J")
+    journey = transit_system_fixture.plan_journey(origin, destination, "08:00")
+
+    assert journey.routes == ["Green", "Orange", "Blue"]
+    assert [(leg.trip, leg.board, leg.alight) for leg in journey.legs] == [
+        ("green-1", "A", "D"), ("orange-2", "D", "I"), ("blue-2", "I", "J")
+    ]
+    assert (journey.departure, journey.arrival) == (parse_time("08:00"), parse_time("08:50"))
+
+    # Leaving any later means the second Green trip, which reaches D after the last Orange trip has left
+    assert transit_system_fixture.plan_journey(origin, destination, "08:01") is None
+
+
+def test_plan_journey_transfer_time(transit_system_fixture: TransitMap):
+    origin = transit_system_fixture.get_stop_from_string("A")
+    destination = transit_system_fixture.get_stop_from_string("G")
+
+    journey = transit_system_fixture.plan_journey(origin, destination, "08:00")
+    assert [(leg.trip, leg.board, leg.alight) for leg in journey.legs] == [("green-1", "A", "C"), ("red-2", "C", "G")]
+    assert journey.arrival == parse_time("08:22")
+
+    # 08:10 at C plus 10 minutes to change misses the last Red trip
+    assert transit_system_fixture.plan_journey(origin, destination, "08:00", transfer_time=600) is None
+
+
+def test_plan_journey_without_schedules():
+    class NoSchedules(TestSystem):
+        get_trips = BaseDataProvider.get_trips
+
+    transit_map = TransitMap(NoSchedules())
+    transit_map.load_stops()
+    stop = transit_map.get_stop_from_string("A")
+
+    with pytest.raises(NotImplementedError):
+        transit_map.plan_journey(stop, stop, "08:00")
+
+
+def test_plan_cache():
+    transit_map = TransitMap(ChangingTestSystem(), plan_cache_size=2)
+    transit_map.load_stops()
+
+    a, e, k = (transit_map.get_stop_from_string(name) for name in "AEK")
+
+    first = transit_map.plan(a, e)
+    assert transit_map.plan(a, e) is first
+    transit_map.plan(a, e, optimize="stops")
+    transit_map.plan(a, k)
+
+    stats = transit_map.get_plan_cache_stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.size) == (1, 3, 1, 2)
+
+    # A new network version never sees the old results
+    data_provider = transit_map.data_provider
+    data_provider.routes = [r for r in data_provider.routes if r.name != "Blue"]
+    transit_map.refresh()
+
+    assert transit_map.plan(a, e) is not first
+    assert transit_map.get_plan_cache_stats().size == 1
+
+
+def test_plan_cache_disabled():
+    transit_map = TransitMap(TestSystem(), plan_cache_size=0)
+    transit_map.load_stops()
+    a, e = (transit_map.get_stop_from_string(name) for name in "AE")
+
+    assert transit_map.plan(a, e) is not transit_map.plan(a, e)
+    assert transit_map.get_plan_cache_stats().hits == 0
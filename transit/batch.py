@@ -0,0 +1,190 @@
+"""
+Batch route planning: answer a stream of origin / destination pairs (e.g. a day of trip-request logs).
+
+Pairs are read lazily and processed in chunks. Within a chunk, pairs are grouped by origin and each origin gets
+a single one-to-all search that answers all of its destinations. Chunks can be spread over a process pool;
+results always come back in input order.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
+
+from transit import planner
+
+CSV = "csv"
+JSONL = "jsonl"
+
+# Pairs per unit of work: large enough that repeated origins share a search, small enough to stream
+CHUNK_SIZE = 5000
+
+
+def read_pairs(stream, format=None):
+    """
+    Yield (origin, destination) stop names from CSV (an `origin,destination` header is optional) or JSONL
+    (`{"origin": ..., "destination": ...}` per line). The format is detected from the first line if not given.
+
+    A row that can't be read doesn't stop the batch: it is yielded as (origin, destination, error), with whatever
+    names could be made out, and `plan_chunk()` turns it into an error result.
+    """
+    lines = iter(stream)
+
+    for first in lines:
+        if first.strip():
+            break
+    else:
+        return
+
+    if format is None:
+        format = JSONL if first.lstrip().startswith("{") else CSV
+
+    if format == JSONL:
+        for line in _chain(first, lines):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield "", "", "Invalid JSON"
+                continue
+            if not isinstance(record, dict):
+                record = {}
+
+            origin = record.get("origin")
+            destination = record.get("destination")
+            if isinstance(origin, str) and isinstance(destination, str):
+                yield origin, destination
+            else:
+                yield _name(origin), _name(destination), "Missing origin or destination"
+    elif format == CSV:
+        rows = csv.reader(_chain(first, lines))
+        for row in rows:
+            if not row:
+                continue
+            if [column.strip().lower() for column in row[:2]] == ["origin", "destination"]:
+                continue
+            if len(row) < 2:
+                yield row[0].strip(), "", "Missing origin or destination"
+                continue
+            yield row[0].strip(), row[1].strip()
+    else:
+        raise ValueError(f"Unknown format: {format}")
+
+
+def write_results(stream, results, format=JSONL):
+    """
+    Write results as JSONL, or CSV with the routes joined by ";"
+    """
+    if format == JSONL:
+        for result in results:
+            stream.write(json.dumps(result) + "\n")
+    elif format == CSV:
+        writer = csv.writer(stream)
+        writer.writerow(["origin", "destination", "routes", "transfers", "stops", "error"])
+        for result in results:
+            writer.writerow([
+                result["origin"],
+                result["destination"],
+                ";".join(result.get("routes") or []),
+                result.get("transfers", ""),
+                result.get("stops", ""),
+                result.get("error", ""),
+            ])
+    else:
+        raise ValueError(f"Unknown format: {format}")
+
+
+def plan_batch(graph, pairs, optimize=planner.FEWEST_TRANSFERS, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Plan every (origin, destination) pair, yielding one result dict per pair in input order:
+    `{"origin", "destination", "routes", "transfers", "stops"}`, or `{"origin", "destination", "error"}`
+    """
+    chunks = _chunk(pairs, chunk_size)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from plan_chunk(graph, chunk, optimize)
+        return
+
+    # The graph is sent to each worker once; a snapshot-backed graph travels as its path (see TransitGraph)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph,)) as executor:
+        # Keep a bounded number of chunks in flight so arbitrarily long inputs stream through
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_plan_chunk_in_worker, chunk, optimize))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def plan_chunk(graph, pairs, optimize=planner.FEWEST_TRANSFERS) -> list:
+    """
+    Plan a list of pairs, running one search per distinct origin. (origin, destination, error) entries from
+    `read_pairs()` come back as that error.
+    """
+    results = [None] * len(pairs)
+    by_origin = {}
+
+    for i, (origin, destination, *error) in enumerate(pairs):
+        if error:
+            results[i] = {"origin": origin, "destination": destination, "error": error[0]}
+        elif origin not in graph.stop_index or destination not in graph.stop_index:
+            results[i] = {"origin": origin, "destination": destination, "error": "Unknown Stop!"}
+        else:
+            by_origin.setdefault(origin, []).append(i)
+
+    for origin, indexes in by_origin.items():
+        search = planner.search_from(graph, graph.stop_index[origin], optimize)
+
+        for i in indexes:
+            destination = pairs[i][1]
+            itinerary = search.itinerary_to(graph.stop_index[destination])
+
+            if itinerary is None:
+                results[i] = {"origin": origin, "destination": destination, "error": "No route found"}
+            else:
+                results[i] = {
+                    "origin": origin,
+                    "destination": destination,
+                    "routes": itinerary.routes,
+                    "transfers": itinerary.transfers,
+                    "stops": itinerary.stops,
+                }
+
+    return results
+
+
+# Set in each worker process by `_init_worker()`
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _plan_chunk_in_worker(pairs, optimize):
+    return plan_chunk(_worker_graph, pairs, optimize)
+
+
+def _chunk(pairs, size):
+    chunk = []
+    for pair in pairs:
+        chunk.append(pair)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def _name(value):
+    return value if isinstance(value, str) else ""
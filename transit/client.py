@@ -1,24 +1,122 @@
-from transit.data_providers.mbta import MBTADataProvider
-from transit.system import TransitMap
+import os
+import sys
+import time
+
+from transit.planner import Walk
+from transit.snapshot import SnapshotError
+from transit.system import TransitMap, UnknownStopError
 from transit.stop import Stop
 
+# Network snapshot reused between runs, and how long (seconds) it is trusted before fetching from the API again
+SNAPSHOT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "transit-map", "network.tmap")
+SNAPSHOT_TTL = 24 * 60 * 60
+
 class CLI():
     transit_map = None
 
-    def __init__(self) -> None:
-        mbta_data_provider = MBTADataProvider()
-        self.transit_map = TransitMap(mbta_data_provider)
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, snapshot_ttl=SNAPSHOT_TTL, started=None, gtfs_feeds=None) -> None:
+        """
+        The network is loaded on first use: from `snapshot_path` if it is younger than `snapshot_ttl`, otherwise
+        from the MBTA API (after which the snapshot is rewritten). `snapshot_path=None` always uses the API.
+        `started` is a `time.perf_counter()` reading from program start, for the start-up timings.
+        `gtfs_feeds` maps agency names to GTFS feeds to load alongside the MBTA network (see
+        `transit/data_providers/federated.py`).
+        """
+        self.snapshot_path = snapshot_path
+        self.snapshot_ttl = snapshot_ttl
+        self.gtfs_feeds = dict(gtfs_feeds or {})
+        self.started = time.perf_counter() if started is None else started
+
+        # (phase, seconds) for each start-up phase, in order (see `print_timings()`)
+        self.timings = [("imports", time.perf_counter() - self.started)]
+
+        # The data provider (and `requests` with it) is only created if the snapshot can't be used
+        self.transit_map = TransitMap()
 
 
     def get_divider(self):
         return "\n" + ("=" * 30)
 
-    
+
+    def record_timing(self, phase, started):
+        self.timings.append((phase, time.perf_counter() - started))
+
+
+    def print_timings(self, file=sys.stderr):
+        for phase, seconds in self.timings:
+            print(f"{phase:>20}: {seconds * 1000:8.1f} ms", file=file)
+
+
+    def get_data_provider(self):
+        """
+        The MBTA data provider (federated with any GTFS feeds), created on first use
+        """
+        if self.transit_map.data_provider is None:
+            started = time.perf_counter()
+            from transit.data_providers.cache import ResponseCache
+            from transit.data_providers.mbta import MBTADataProvider
+
+            provider = MBTADataProvider(cache=ResponseCache())
+            if self.gtfs_feeds:
+                from transit.data_providers.federated import FederatedDataProvider
+                from transit.data_providers.gtfs import GTFSDataProvider
+
+                providers = {"mbta": provider}
+                providers.update((agency, GTFSDataProvider(path)) for agency, path in self.gtfs_feeds.items())
+                provider = FederatedDataProvider(providers)
+
+            self.transit_map.data_provider = provider
+            self.record_timing("provider", started)
+
+        return self.transit_map.data_provider
+
+
+    def load_network(self):
+        """
+        Load the whole network, preferring a fresh snapshot over the API
+        """
+        if self.transit_map.network.is_loaded:
+            return
+
+        if self.snapshot_path is not None and self.__is_snapshot_fresh():
+            started = time.perf_counter()
+            try:
+                self.transit_map.load_snapshot(self.snapshot_path)
+                self.record_timing("snapshot", started)
+                return
+            except (OSError, SnapshotError):
+                # Unreadable or from another version, fetch it again
+                pass
+
+        self.get_data_provider()
+        started = time.perf_counter()
+        self.transit_map.load_stops()
+        self.record_timing("fetch", started)
+
+        if self.snapshot_path is not None:
+            started = time.perf_counter()
+            try:
+                os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+                self.transit_map.save_snapshot(self.snapshot_path)
+                self.record_timing("save snapshot", started)
+            except OSError:
+                # Only costs the next run a fetch
+                pass
+
+
+    def __is_snapshot_fresh(self) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self.snapshot_path) < self.snapshot_ttl
+        except OSError:
+            return False
+
+
     def display_all_routes(self):
         """
         Prints a list of all current Subway routes
         """
-        self.transit_map.load_routes()
+        self.load_network()
+        self.timings.append(("first output", time.perf_counter() - self.started))
         print("\nAll Subway routes: ", self.get_divider())
 
         # Assumption: We should sort these so they are in a consistent order
@@ -33,14 +131,13 @@ class CLI():
         3. A list of the stops that connect two or more subway routes along with the relevant route names for
         each of those stops.
         """
-        self.transit_map.load_routes()
-        self.transit_map.load_stops()
-        
+        self.load_network()
+
         print("\nThe subway route(s) with the most stops are: ", self.get_divider())
-        
+
         for name, count in self.transit_map.get_routes_with_most_stops():
             print(f"{name}: {count}")
-        
+
         print("\nThe subway route(s) with the fewest stops are: ", self.get_divider())
         for name, count in self.transit_map.get_routes_with_least_stops():
             print(f"{name}: {count}")
@@ -55,6 +152,9 @@ class CLI():
         """
         Displays the prompt which asks users to enter their origin, destination
         """
+        self.load_network()
+        self.timings.append(("first prompt", time.perf_counter() - self.started))
+
         while True:
             print(f"\n\nRoute Finder", self.get_divider())
             origin_string = input("Enter origin: ")
@@ -68,18 +168,89 @@ class CLI():
             try:
                 origin = self.transit_map.get_stop_from_string(origin_string)
                 destination = self.transit_map.get_stop_from_string(destination_string)
-            except:
+            except UnknownStopError:
                 print(f"Unknown origin -> destination: [{origin_string}] -> [{destination_string}]")
+
+                for stop_string in (origin_string, destination_string):
+                    if stop_string in self.transit_map.stops:
+                        continue
+                    suggestions = self.transit_map.search_stops(stop_string, limit=3)
+                    if suggestions:
+                        print(f"Did you mean ({stop_string}): {', '.join(match.name for match in suggestions)}?")
                 continue
 
             try:
                 self.get_travel_info(origin, destination)
             except Exception as e:
-                print(f"An error occurred: {e}")   
-    
+                print(f"An error occurred: {e}")
+
 
     def get_travel_info(self, origin : Stop, destination : Stop):
         """
-        Wrapper around `get_routes_for_stops()`
+        Print the routes to take between two stops, and any walk between them (the stops are named differently,
+        so the walk isn't obvious from the routes alone)
+        """
+        itinerary = self.transit_map.plan(origin, destination)
+        print(f"\n{origin.name} to {destination.name} ->", ", ".join(format_legs(itinerary)))
+
+
+    def run_batch(self, input_path, output_path="-", optimize="transfers", workers=1, format=None):
+        """
+        Plan every origin/destination pair in a CSV or JSONL file ("-" for stdin) and stream the results out
+        (JSONL by default, or the input's format when it is given explicitly)
         """
-        print(f"\n{origin.name} to {destination.name} ->", ", ".join(self.transit_map.get_routes_for_stops(origin, destination)))
+        from transit import batch
+
+        self.load_network()
+
+        input_file = sys.stdin if input_path == "-" else open(input_path, newline="")
+        output_file = sys.stdout if output_path == "-" else open(output_path, "w", newline="")
+
+        try:
+            pairs = batch.read_pairs(input_file, format)
+            results = self.transit_map.plan_batch(pairs, optimize, workers)
+            batch.write_results(output_file, results, format or batch.JSONL)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not sys.stdout:
+                output_file.close()
+
+
+    def serve(self, host="127.0.0.1", port=8080, workers=0, live=False):
+        """
+        Load the network once and answer HTTP queries until interrupted (see `transit/service.py`). With `live`,
+        the real-time feed is followed too and served at /live.
+        """
+        import asyncio
+        from transit.service import TransitService
+
+        # A long-running service can afford the provider, and needs it to reload
+        self.get_data_provider()
+        self.load_network()
+
+        stream = self.transit_map.follow_realtime() if live else None
+
+        service = TransitService(self.transit_map, workers=workers)
+        print(f"Serving on http://{host}:{port}/ (control + c to stop)")
+
+        try:
+            asyncio.run(service.serve_forever(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if stream is not None:
+                stream.stop()
+
+
+def format_legs(itinerary) -> list:
+    """
+    Route names of an itinerary's rides, with its walks as "walk <from> -> <to> (<meters> m)" in between (empty
+    for None)
+    """
+    if itinerary is None:
+        return []
+    return [
+        f"walk {leg.board} -> {leg.alight} ({leg.meters} m)" if isinstance(leg, Walk) else leg.route
+        for leg in itinerary.legs
+    ]
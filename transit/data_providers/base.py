@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 class BaseDataProvider(ABC):
+    # Upper bound on concurrent `get_stops_for_route()` calls made by `get_stops_for_routes()`
+    MAX_CONCURRENT_REQUESTS = 8
+
     @abstractmethod
     def get_all_routes(self):
         """
@@ -11,6 +15,42 @@ class BaseDataProvider(ABC):
     @abstractmethod
     def get_stops_for_route(self, route_id):
         """
-        Load all stops for a given route
+        Load all stops for a given route, in travel order. A route that doesn't run along one line of stops
+        (e.g. one with branches) can instead return a list of `transit.route.StopSequence`s, one per pattern and
+        direction.
+        """
+        pass
+
+    def get_stops_for_routes(self, route_ids):
+        """
+        Load the stops for several routes, returns a dict of route id -> stops in the same order as `route_ids`.
+
+        By default this fans `get_stops_for_route()` out over a bounded thread pool, so loading N routes takes
+        about as long as the slowest request rather than the sum of all of them. Providers that can fetch
+        everything in fewer calls should override it.
+        """
+        route_ids = list(route_ids)
+        max_workers = min(self.MAX_CONCURRENT_REQUESTS, len(route_ids))
+
+        if max_workers <= 1:
+            return {route_id: self.get_stops_for_route(route_id) for route_id in route_ids}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map() yields results in submission order regardless of completion order
+            return dict(zip(route_ids, executor.map(self.get_stops_for_route, route_ids)))
+
+    def get_trips(self, route_ids, service_date=None):
+        """
+        Scheduled trips of the given routes (see `transit.timetable.Trip`), limited to those running on
+        `service_date` (a `datetime.date`) if one is given. Stops are identified by name, like in `Network`.
+
+        Schedules are optional: providers without them raise NotImplementedError.
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't provide schedules")
+
+    def get_walking_transfers(self, stops):
+        """
+        (stop name, stop name, meters) walking transfers between the given stops (provider `Stop`s, one per name)
+        that this provider knows about. Transfers at a shared stop name need no walk and aren't listed.
         """
-        pass
\ No newline at end of file
+        return []
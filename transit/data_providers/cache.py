@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+import json
+import os
+import sqlite3
+import threading
+import time
+
+@dataclass
+class CachedResponse:
+    body: dict
+    etag: str = None
+    last_modified: str = None
+    fetched_at: float = 0.0
+
+    def is_fresh(self, ttl) -> bool:
+        """
+        Fresh responses can be used without asking the server at all
+        """
+        return (time.time() - self.fetched_at) < ttl
+
+
+class ResponseCache():
+    """
+    Persistent store of API responses keyed by endpoint, backed by a single SQLite file.
+
+    Entries younger than `ttl` seconds are served as-is; older entries keep their validators (ETag /
+    Last-Modified) so the provider can revalidate them with a conditional request.
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "transit-map", "responses.sqlite3")
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # The provider may be called from several threads; sqlite3 connections aren't safe to share without a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+
+    def get(self, endpoint) -> CachedResponse:
+        """
+        Look up a cached response, returns None on a miss
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM responses WHERE endpoint = ?", (endpoint,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        body, etag, last_modified, fetched_at = row
+        return CachedResponse(body=json.loads(body), etag=etag, last_modified=last_modified, fetched_at=fetched_at)
+
+
+    def put(self, endpoint, body, etag=None, last_modified=None):
+        """
+        Store (or replace) the response for an endpoint
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (endpoint, body, etag, last_modified, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (endpoint, json.dumps(body), etag, last_modified, time.time())
+            )
+            self.connection.commit()
+
+
+    def touch(self, endpoint):
+        """
+        Mark a cached response as fresh again (after the server answered 304 Not Modified)
+        """
+        with self.lock:
+            self.connection.execute("UPDATE responses SET fetched_at = ? WHERE endpoint = ?", (time.time(), endpoint))
+            self.connection.commit()
+
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,207 @@
+"""
+Several agencies' data providers combined into one network.
+
+Every id is namespaced with its agency ("mbta:Red"), so ids can never collide between providers. Names are what
+`Network` merges stops and routes by, and they only get the agency appended ("Union Station (amtrak)") when more
+than one agency uses them: two agencies' "Union Station"s stay two stops, while the rest of every network reads
+the same as it does on its own. Stations of different agencies are then connected by walking transfers between
+stops within `walk_radius` of each other, found with a spatial grid over the stop coordinates.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from transit.data_providers.base import BaseDataProvider
+from transit.route import Route, StopSequence, to_sequences
+from transit.spatial import StopLocationIndex
+from transit.stop import Stop
+from transit.timetable import Trip
+
+# Meters walked between agencies' stops at most
+WALK_RADIUS = 300
+
+
+class FederatedDataProvider(BaseDataProvider):
+    SEPARATOR = ":"
+
+    def __init__(self, providers, walk_radius=WALK_RADIUS) -> None:
+        """
+        `providers` maps agency names (used as the id prefix) to their data providers
+        """
+        self.providers = dict(providers)
+        self.walk_radius = walk_radius
+
+        # Names used by more than one agency, and every agency a name has been seen with. Only ever grows, so a
+        # name qualified once stays qualified (and stop / route names don't change between refreshes).
+        self.lock = threading.Lock()
+        self.route_agencies = {}
+        self.stop_agencies = {}
+
+        # Namespaced route id -> the agency's own id (which needn't be a string)
+        self.provider_ids = {}
+
+
+    def get_agency(self, namespaced_id):
+        """
+        Split a namespaced id into (agency, the agency's own id)
+        """
+        agency, _, provider_id = str(namespaced_id).partition(self.SEPARATOR)
+        if agency not in self.providers:
+            raise KeyError(f"Unknown agency: {agency}")
+        return agency, self.provider_ids.get(namespaced_id, provider_id)
+
+
+    def get_all_routes(self):
+        """
+        Load every agency's routes (concurrently)
+        """
+        results = self.__map(lambda agency, provider: provider.get_all_routes(), self.providers)
+        self.__register(self.route_agencies, results)
+
+        routes = []
+        for agency, agency_routes in results.items():
+            for route in agency_routes:
+                route_id = self.__namespace(agency, route.id)
+                self.provider_ids[route_id] = route.id
+                routes.append(Route(
+                    name=self.__get_name(self.route_agencies, agency, route.name),
+                    id=route_id,
+                    line_name=self.__namespace(agency, route.line_name)
+                ))
+
+        return routes
+
+
+    def get_stops_for_route(self, route_id):
+        return self.get_stops_for_routes([route_id])[route_id]
+
+
+    def get_stops_for_routes(self, route_ids):
+        """
+        Split the routes by agency and load each agency's stops (concurrently, with the agency provider's own
+        bulk loading), returns a dict of namespaced route id -> stops in the same order as `route_ids`
+        """
+        route_ids = list(route_ids)
+        requested = self.__split(route_ids)
+
+        results = self.__map(
+            lambda agency, provider: provider.get_stops_for_routes(
+                [provider_id for _, provider_id in requested[agency]]
+            ),
+            {agency: self.providers[agency] for agency in requested}
+        )
+        self.__register(
+            self.stop_agencies,
+            {
+                agency: [
+                    stop for stops in result.values() for sequence in to_sequences(stops) for stop in sequence.stops
+                ]
+                for agency, result in results.items()
+            }
+        )
+
+        def copy(agency, stop):
+            return Stop(
+                name=self.__get_name(self.stop_agencies, agency, stop.name),
+                id=self.__namespace(agency, stop.id),
+                latitude=stop.latitude,
+                longitude=stop.longitude
+            )
+
+        stops_by_route = {}
+        for agency, pairs in requested.items():
+            for route_id, provider_id in pairs:
+                stops = list(results[agency].get(provider_id, ()))
+                if stops and isinstance(stops[0], StopSequence):
+                    stops_by_route[route_id] = [
+                        StopSequence([copy(agency, stop) for stop in sequence.stops], sequence.direction)
+                        for sequence in stops
+                    ]
+                else:
+                    stops_by_route[route_id] = [copy(agency, stop) for stop in stops]
+
+        return {route_id: stops_by_route[route_id] for route_id in route_ids}
+
+
+    def get_walking_transfers(self, stops):
+        """
+        Walks between stops of different agencies no more than `walk_radius` apart (stops of the same agency are
+        connected however that agency's own data connects them)
+        """
+        def get_agency(stop):
+            return str(stop.id).partition(self.SEPARATOR)[0]
+
+        return StopLocationIndex(stops).get_walks(
+            self.walk_radius, lambda stop, other: get_agency(stop) != get_agency(other)
+        )
+
+
+    def get_trips(self, route_ids, service_date=None):
+        """
+        Every agency's trips of the given routes, with ids and stop names as in the combined network. Agencies
+        without schedules are left out; only if none of them have any is NotImplementedError raised.
+        """
+        scheduled = False
+
+        for agency, pairs in self.__split(route_ids).items():
+            provider_ids = {provider_id: route_id for route_id, provider_id in pairs}
+
+            try:
+                for trip in self.providers[agency].get_trips(list(provider_ids), service_date):
+                    yield Trip(
+                        id=self.__namespace(agency, trip.id),
+                        route_id=provider_ids.get(trip.route_id, self.__namespace(agency, trip.route_id)),
+                        stops=[self.__get_name(self.stop_agencies, agency, name) for name in trip.stops],
+                        arrivals=trip.arrivals,
+                        departures=trip.departures
+                    )
+                scheduled = True
+            except NotImplementedError:
+                continue
+
+        if not scheduled and route_ids:
+            raise NotImplementedError("None of the federated providers provide schedules")
+
+
+    def __namespace(self, agency, provider_id):
+        return f"{agency}{self.SEPARATOR}{provider_id}"
+
+
+    def __split(self, route_ids):
+        """
+        Group namespaced route ids by agency, returns {agency: [(namespaced id, agency id)]}
+        """
+        requested = {}
+        for route_id in route_ids:
+            agency, provider_id = self.get_agency(route_id)
+            requested.setdefault(agency, []).append((route_id, provider_id))
+        return requested
+
+
+    def __map(self, function, providers):
+        """
+        Call `function(agency, provider)` for every provider concurrently, returns {agency: result} in order
+        """
+        if len(providers) <= 1:
+            return {agency: function(agency, provider) for agency, provider in providers.items()}
+
+        with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+            futures = {agency: executor.submit(function, agency, provider) for agency, provider in providers.items()}
+            return {agency: future.result() for agency, future in futures.items()}
+
+
+    def __register(self, seen, results):
+        """
+        Record which agencies use the names of the routes / stops in `results` ({agency: items})
+        """
+        with self.lock:
+            for agency, items in results.items():
+                for item in items:
+                    seen.setdefault(item.name, set()).add(agency)
+
+
+    def __get_name(self, seen, agency, name):
+        """
+        Name of an agency's route / stop in the combined network
+        """
+        return f"{name} ({agency})" if len(seen.get(name, ())) > 1 else name
@@ -0,0 +1,330 @@
+from collections import Counter
+import csv
+import io
+import os
+import zipfile
+
+from transit.data_providers.base import BaseDataProvider
+from transit.route import Route, StopSequence, is_stretch_of
+from transit.stop import Stop
+from transit.timetable import Trip, parse_time
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+class GTFSDataProvider(BaseDataProvider):
+    """
+    Loads routes and stops from a GTFS static feed (a .zip, or a directory of the extracted .txt files), without
+    any network access.
+
+    `stop_times.txt` is read one row at a time and only the distinct stop sequence ("pattern") of each trip is
+    kept, so memory grows with the number of route patterns rather than with the size of the feed. Like nearly
+    every published feed, `stop_times.txt` is expected to be grouped by trip_id.
+    """
+    # GTFS route_type values for light rail and subway, matching what `MBTADataProvider` loads
+    SUBWAY_ROUTE_TYPES = (0, 1)
+    # Patterns run by fewer trips than this share of the route's busiest pattern (e.g. one-off detours) are ignored
+    MIN_PATTERN_SHARE = 0.1
+    # Everything is local, there's nothing to gain from a thread pool
+    MAX_CONCURRENT_REQUESTS = 1
+
+    def __init__(self, path, route_types=SUBWAY_ROUTE_TYPES) -> None:
+        """
+        `route_types` is an iterable of GTFS route_type values to load, or None for every route in the feed
+        """
+        self.path = path
+        self.route_types = None if route_types is None else {str(t) for t in route_types}
+
+        self.routes = None
+        self.route_stops = None
+
+
+    def get_all_routes(self):
+        """
+        Load all routes from the feed
+        """
+        self.__load()
+        return [Route(name=name, id=route_id, line_name=line_name) for route_id, name, line_name in self.routes]
+
+
+    def get_stops_for_route(self, route_id):
+        """
+        Load the stops of a given route, as one `StopSequence` per representative pattern (see
+        `__get_route_patterns()`)
+        """
+        self.__load()
+        return [
+            StopSequence(
+                [
+                    Stop(name=name, id=stop_id, latitude=latitude, longitude=longitude)
+                    for stop_id, name, latitude, longitude in stations
+                ],
+                direction
+            )
+            for direction, stations in self.route_stops.get(route_id, ())
+        ]
+
+
+    def get_trips(self, route_ids, service_date=None):
+        """
+        Stream the scheduled trips of the given routes, one trip at a time. Platforms are resolved to their
+        stations, and stop times without a time (untimed stops between timepoints) are left out.
+        """
+        route_ids = set(route_ids)
+        services = None if service_date is None else self.get_active_services(service_date)
+
+        trips = {}
+        for trip_id, route_id, service_id in self.read_table("trips.txt", ("trip_id", "route_id", "service_id")):
+            if route_id in route_ids and (services is None or service_id in services):
+                trips[trip_id] = route_id
+
+        stations = self.__load_stations()
+
+        current_trip = None
+        current_stops = []
+
+        for trip_id, arrival, departure, stop_id, stop_sequence in self.read_table(
+            "stop_times.txt", ("trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence")
+        ):
+            if trip_id != current_trip:
+                if current_trip in trips and current_stops:
+                    yield self.__build_trip(current_trip, trips[current_trip], current_stops, stations)
+                current_trip = trip_id
+                current_stops = []
+
+            if trip_id in trips and (arrival or departure):
+                current_stops.append((int(stop_sequence), stop_id, arrival or departure, departure or arrival))
+
+        if current_trip in trips and current_stops:
+            yield self.__build_trip(current_trip, trips[current_trip], current_stops, stations)
+
+
+    def get_active_services(self, service_date) -> set:
+        """
+        Service ids running on a date, from calendar.txt and the exceptions in calendar_dates.txt
+        """
+        day = service_date.strftime("%Y%m%d")
+        services = set()
+
+        if self.has_table("calendar.txt"):
+            for service_id, runs, start_date, end_date in self.read_table(
+                "calendar.txt", ("service_id", WEEKDAYS[service_date.weekday()], "start_date", "end_date")
+            ):
+                if runs == "1" and start_date <= day <= end_date:
+                    services.add(service_id)
+
+        if self.has_table("calendar_dates.txt"):
+            for service_id, date, exception_type in self.read_table(
+                "calendar_dates.txt", ("service_id", "date", "exception_type")
+            ):
+                if date != day:
+                    continue
+                if exception_type == "1":
+                    services.add(service_id)
+                elif exception_type == "2":
+                    services.discard(service_id)
+
+        return services
+
+
+    def has_table(self, name) -> bool:
+        if os.path.isdir(self.path):
+            return os.path.exists(os.path.join(self.path, name))
+
+        with zipfile.ZipFile(self.path) as archive:
+            return name in archive.namelist()
+
+
+    def open_table(self, name):
+        """
+        Open one of the feed's tables as a csv reader, the first row being the header
+        """
+        if os.path.isdir(self.path):
+            stream = open(os.path.join(self.path, name), encoding="utf-8-sig", newline="")
+        else:
+            archive = zipfile.ZipFile(self.path)
+            stream = io.TextIOWrapper(archive.open(name), encoding="utf-8-sig", newline="")
+            # The archive stays open until the member stream is closed
+            archive.close()
+
+        return stream
+
+
+    def read_table(self, name, columns):
+        """
+        Stream rows of a table as tuples of the requested columns (missing optional columns come back as "")
+        """
+        with self.open_table(name) as stream:
+            reader = csv.reader(stream)
+            header = [column.strip() for column in next(reader)]
+            indexes = [header.index(column) if column in header else None for column in columns]
+
+            for row in reader:
+                if not row:
+                    continue
+                yield tuple(row[i] if i is not None and i < len(row) else "" for i in indexes)
+
+
+    def __load(self):
+        if self.routes is not None:
+            return
+
+        routes = []
+        for route_id, long_name, short_name, route_type, line_id in self.read_table(
+            "routes.txt", ("route_id", "route_long_name", "route_short_name", "route_type", "line_id")
+        ):
+            if self.route_types is None or route_type in self.route_types:
+                routes.append((route_id, long_name or short_name or route_id, line_id or route_id))
+
+        route_ids = {route_id for route_id, _, _ in routes}
+
+        trips = {}
+        for trip_id, route_id, direction_id in self.read_table("trips.txt", ("trip_id", "route_id", "direction_id")):
+            if route_id in route_ids:
+                trips[trip_id] = (route_id, direction_id or "0")
+
+        patterns = self.__count_patterns(trips)
+
+        stop_ids = set()
+        route_patterns = {}
+        for route_id in route_ids:
+            route_patterns[route_id] = self.__get_route_patterns(patterns.get(route_id, {}))
+            for _, pattern in route_patterns[route_id]:
+                stop_ids.update(pattern)
+
+        stops = self.__load_stations(stop_ids)
+
+        # route id -> [(direction, [station])]. Patterns that only differ by platform are the same sequence, and
+        # one that runs along a stretch of a busier one (e.g. a short turn) adds no rides of its own.
+        route_stops = {}
+        for route_id, route_pattern_list in route_patterns.items():
+            route_stops[route_id] = []
+            for direction, pattern in route_pattern_list:
+                seen = set()
+                stations = []
+                for stop_id in pattern:
+                    station = stops.get(stop_id, (stop_id, stop_id, None, None))
+                    if station[0] not in seen:
+                        seen.add(station[0])
+                        stations.append(station)
+
+                if not any(
+                    other_direction == direction and is_stretch_of(stations, other)
+                    for other_direction, other in route_stops[route_id]
+                ):
+                    route_stops[route_id].append((direction, stations))
+
+        self.route_stops = route_stops
+        self.routes = routes
+
+
+    def __count_patterns(self, trips):
+        """
+        Stream stop_times.txt and count how many trips run each stop sequence,
+        returns {route_id: {direction_id: Counter(pattern -> trips)}}
+        """
+        patterns = {}
+
+        current_trip = None
+        current_stops = []
+
+        def flush():
+            trip = trips.pop(current_trip, None)
+            if trip is not None and current_stops:
+                route_id, direction_id = trip
+                current_stops.sort()
+                pattern = tuple(stop_id for _, stop_id in current_stops)
+                patterns.setdefault(route_id, {}).setdefault(direction_id, Counter())[pattern] += 1
+
+        for trip_id, stop_id, stop_sequence in self.read_table(
+            "stop_times.txt", ("trip_id", "stop_id", "stop_sequence")
+        ):
+            if trip_id != current_trip:
+                flush()
+                current_trip = trip_id
+                current_stops = []
+
+            # Skip buffering rows of trips we don't care about (other route types)
+            if trip_id in trips:
+                current_stops.append((int(stop_sequence), stop_id))
+
+        flush()
+        return patterns
+
+
+    def __get_route_patterns(self, directions):
+        """
+        The representative patterns of a route, busiest first, as (direction, stop ids): those of direction 0 if
+        the route has it (the other direction runs along them reversed). Each one stays a sequence of its own, so
+        one branch's stops never follow another's.
+        """
+        if not directions:
+            return []
+
+        direction_id = "0" if "0" in directions else min(directions)
+        counts = directions[direction_id]
+        busiest = max(counts.values())
+
+        return [
+            (int(direction_id), pattern)
+            for pattern, trip_count in counts.most_common()
+            if trip_count >= busiest * self.MIN_PATTERN_SHARE
+        ]
+
+
+    def __build_trip(self, trip_id, route_id, stop_times, stations):
+        """
+        Turn the buffered (stop_sequence, stop_id, arrival, departure) rows of one trip into a `Trip`, merging
+        consecutive stops at the same station
+        """
+        stop_times.sort()
+        trip = Trip(id=trip_id, route_id=route_id)
+
+        for _, stop_id, arrival, departure in stop_times:
+            name = stations[stop_id][1] if stop_id in stations else stop_id
+
+            if trip.stops and trip.stops[-1] == name:
+                trip.departures[-1] = parse_time(departure)
+                continue
+
+            trip.stops.append(name)
+            trip.arrivals.append(parse_time(arrival))
+            trip.departures.append(parse_time(departure))
+
+        return trip
+
+
+    def __load_stations(self, stop_ids=None):
+        """
+        Resolve stop (platform) ids (all of them by default) to the station they belong to, returns
+        {stop_id: (station id, station name, latitude, longitude)}, the location being None where the feed has none
+        """
+        rows = {}
+        for stop_id, name, parent_station, latitude, longitude in self.read_table(
+            "stops.txt", ("stop_id", "stop_name", "parent_station", "stop_lat", "stop_lon")
+        ):
+            rows[stop_id] = (name, parent_station, parse_coordinate(latitude), parse_coordinate(longitude))
+
+        stations = {}
+        for stop_id in rows if stop_ids is None else stop_ids:
+            if stop_id not in rows:
+                continue
+
+            name, parent_station, latitude, longitude = rows[stop_id]
+            if parent_station and parent_station in rows:
+                station_name, _, station_latitude, station_longitude = rows[parent_station]
+                if station_latitude is None or station_longitude is None:
+                    # Stations are allowed to leave their location out, the platform is close enough
+                    station_latitude, station_longitude = latitude, longitude
+                stations[stop_id] = (parent_station, station_name, station_latitude, station_longitude)
+            else:
+                stations[stop_id] = (stop_id, name, latitude, longitude)
+
+        return stations
+
+
+def parse_coordinate(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
@@ -1,11 +1,69 @@
+from datetime import date, datetime
+from email.utils import parsedate_to_datetime
+import os
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
+from transit import metrics
 from transit.data_providers.base import BaseDataProvider
-from transit.route import Route
+from transit.route import OUTBOUND, Route, StopSequence, is_stretch_of
 from transit.stop import Stop
+from transit.timetable import Trip
+
+
+class APIError(Exception):
+    def __init__(self, message, status_code=None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class MBTADataProvider(BaseDataProvider):
     API_BASE_URL = "https://api-v3.mbta.com/"
+    API_KEY_ENV = "MBTA_API_KEY"
+    # Route ids per bulk request, keeps the URL comfortably short
+    BULK_ROUTE_BATCH_SIZE = 50
+    # Responses worth retrying (rate limited or a transient server-side failure)
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, cache=None, base_url=None, api_key=None, timeout=(3.05, 30), max_retries=3,
+                 backoff_factor=0.5, max_backoff=60) -> None:
+        """
+        `cache` is an optional `ResponseCache`; without one every call goes to the API.
+        `api_key` defaults to the MBTA_API_KEY environment variable (anonymous clients get a much lower rate limit).
+        `timeout` is passed to requests as-is: a (connect, read) tuple or a single number of seconds.
+        Failed requests are retried `max_retries` times, waiting `backoff_factor * 2^attempt` seconds (capped
+        at `max_backoff`) unless the server says how long to wait.
+        """
+        self.cache = cache
+
+        if base_url is not None:
+            self.API_BASE_URL = base_url
+
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        # Replaced in tests so that backoff doesn't actually wait
+        self.sleep = time.sleep
+
+        # One pooled, keep-alive session for every request (sized for `get_stops_for_routes()` fan-out)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_CONCURRENT_REQUESTS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "application/vnd.api+json"
+
+        api_key = api_key or os.environ.get(self.API_KEY_ENV)
+        if api_key:
+            self.session.headers["x-api-key"] = api_key
+
+        # Epoch time before which we've been told we have no requests left
+        self.rate_limit_lock = threading.Lock()
+        self.rate_limited_until = 0.0
 
     def get_all_routes(self):
         """
@@ -42,21 +100,296 @@ class MBTADataProvider(BaseDataProvider):
             stop_name = stop_attributes['name']
 
             stops.append(Stop(
-                name=stop_name
+                name=stop_name,
+                id=stop['id'],
+                latitude=stop_attributes.get('latitude'),
+                longitude=stop_attributes.get('longitude')
             ))
             
         return stops
     
 
+    def get_stops_for_routes(self, route_ids):
+        """
+        Load stops for many routes with one `route_patterns` request per batch of routes (instead of one
+        `stops` request per route). Each of a route's typical patterns (direction 0, in pattern sort order) is a
+        `StopSequence` of its own, from the pattern's representative trip, so branches are never joined end to end.
+        """
+        route_ids = list(route_ids)
+        results = {route_id: [] for route_id in route_ids}
+
+        for start in range(0, len(route_ids), self.BULK_ROUTE_BATCH_SIZE):
+            batch = route_ids[start:start + self.BULK_ROUTE_BATCH_SIZE]
+            method_route = (
+                f"route_patterns?filter[route]={','.join(str(r) for r in batch)}&include=representative_trip.stops"
+            )
+            document = self.get_api_document(method_route)
+
+            included = {(item['type'], item['id']): item for item in document.get('included', [])}
+
+            patterns_by_route = {}
+            for pattern in document['data']:
+                route_id = pattern['relationships']['route']['data']['id']
+                patterns_by_route.setdefault(route_id, []).append(pattern)
+
+            for route_id in batch:
+                patterns = self.__get_canonical_patterns(patterns_by_route.get(route_id, []))
+
+                for pattern in patterns:
+                    trip = included.get(('trip', pattern['relationships']['representative_trip']['data']['id']))
+                    if trip is None:
+                        continue
+
+                    seen = set()
+                    stops = []
+
+                    for stop_ref in trip['relationships']['stops']['data']:
+                        stop = included.get(('stop', stop_ref['id']))
+                        if stop is None:
+                            continue
+
+                        # Trips stop at platforms; report the parent station so ids match the `stops` endpoint
+                        parent = (stop.get('relationships', {}).get('parent_station') or {}).get('data')
+                        stop_id = parent['id'] if parent else stop['id']
+
+                        if stop_id not in seen:
+                            seen.add(stop_id)
+                            # (the platform's location stands in for the station's, they're metres apart)
+                            attributes = stop['attributes']
+                            stops.append(Stop(
+                                name=attributes['name'],
+                                id=stop_id,
+                                latitude=attributes.get('latitude'),
+                                longitude=attributes.get('longitude')
+                            ))
+
+                    # (skipping patterns that only run along a stretch of one already there)
+                    direction = pattern['attributes'].get('direction_id') or OUTBOUND
+                    names = [stop.name for stop in stops]
+                    if stops and not any(
+                        sequence.direction == direction and is_stretch_of(names, [s.name for s in sequence.stops])
+                        for sequence in results[route_id]
+                    ):
+                        results[route_id].append(StopSequence(stops, direction))
+
+        return results
+
+
+    def get_trips(self, route_ids, service_date=None):
+        """
+        Scheduled trips of the given routes on `service_date` (today if None), from one `schedules` request per
+        batch of routes. Stops are named after the platform's station, as in `get_stops_for_routes()`, and times
+        are seconds after midnight of the service date.
+        """
+        route_ids = list(route_ids)
+        service_date = service_date or date.today()
+
+        for start in range(0, len(route_ids), self.BULK_ROUTE_BATCH_SIZE):
+            batch = route_ids[start:start + self.BULK_ROUTE_BATCH_SIZE]
+            method_route = (
+                f"schedules?filter[route]={','.join(str(r) for r in batch)}"
+                f"&filter[date]={service_date.isoformat()}&include=stop"
+            )
+            document = self.get_api_document(method_route)
+
+            stop_names = {
+                item['id']: item['attributes']['name']
+                for item in document.get('included', []) if item['type'] == 'stop'
+            }
+
+            # trip id -> (route id, [(stop sequence, stop name, arrival, departure)])
+            stop_times = {}
+            for schedule in document['data']:
+                attributes = schedule['attributes']
+                relationships = schedule['relationships']
+
+                name = stop_names.get(relationships['stop']['data']['id'])
+                arrival = attributes.get('arrival_time') or attributes.get('departure_time')
+                departure = attributes.get('departure_time') or attributes.get('arrival_time')
+                if name is None or arrival is None:
+                    continue
+
+                trip = stop_times.setdefault(
+                    relationships['trip']['data']['id'], (relationships['route']['data']['id'], [])
+                )
+                trip[1].append((
+                    attributes['stop_sequence'],
+                    name,
+                    get_service_time(arrival, service_date),
+                    get_service_time(departure, service_date)
+                ))
+
+            for trip_id, (route_id, rows) in stop_times.items():
+                rows.sort(key=lambda row: row[0])
+                yield Trip(
+                    id=trip_id,
+                    route_id=route_id,
+                    stops=[name for _, name, _, _ in rows],
+                    arrivals=[arrival for _, _, arrival, _ in rows],
+                    departures=[departure for _, _, _, departure in rows]
+                )
+
+
+    def __get_canonical_patterns(self, patterns):
+        """
+        Pick the patterns that describe a route's normal service: typical (typicality 1) patterns in direction 0,
+        falling back to whatever direction 0 patterns exist, then to anything at all
+        """
+        for candidates in (
+            [
+                p for p in patterns
+                if p['attributes'].get('direction_id') == 0 and p['attributes'].get('typicality') == 1
+            ],
+            [p for p in patterns if p['attributes'].get('direction_id') == 0],
+            patterns,
+        ):
+            if candidates:
+                return sorted(candidates, key=lambda p: p['attributes'].get('sort_order', 0))
+        return []
+
+
     def get_api_results(self, endpoint):
         """
-        Helper method to make actual API calls
+        Helper method to make actual API calls, returns the `data` member of the response
         """
-        url = self.API_BASE_URL + endpoint
-        
-        response = requests.get(url)
+        return self.get_api_document(endpoint)['data']
+
+
+    def get_api_document(self, endpoint):
+        """
+        Fetch the whole JSON:API document for an endpoint. With a cache, fresh responses are served locally and stale
+        ones are revalidated with a conditional request (a 304 costs a round-trip but no payload).
+        """
+        cached = self.cache.get(endpoint) if self.cache else None
+
+        if cached is not None and cached.is_fresh(self.cache.ttl):
+            if metrics.REGISTRY.enabled:
+                metrics.PROVIDER_CACHE.inc("hit")
+            return cached.body
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
 
-        if response.status_code == 200:
-            return response.json()['data']
+        response = self.request(self.API_BASE_URL + endpoint, headers)
+
+        if response.status_code == 304 and cached is not None:
+            if metrics.REGISTRY.enabled:
+                metrics.PROVIDER_CACHE.inc("revalidated")
+            self.cache.touch(endpoint)
+            return cached.body
+        elif response.status_code == 200:
+            if metrics.REGISTRY.enabled and self.cache:
+                metrics.PROVIDER_CACHE.inc("miss")
+            body = response.json()
+            if self.cache:
+                self.cache.put(
+                    endpoint,
+                    body,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
+                )
+            return body
         else:
-            raise Exception(f"API Unavailable - Status code: {response.status_code}")
\ No newline at end of file
+            raise APIError(f"API Unavailable - Status code: {response.status_code}", response.status_code)
+
+
+    def request(self, url, headers=None):
+        """
+        GET with retries. Waits out an exhausted rate limit before sending, and backs off on connection errors
+        and retryable status codes (honouring Retry-After). Returns the last response once retries run out.
+        """
+        # Label metrics with the resource ("routes", "stops", ...) rather than the full URL
+        endpoint = url[len(self.API_BASE_URL):].split("?", 1)[0] if url.startswith(self.API_BASE_URL) else url
+
+        for attempt in range(self.max_retries + 1):
+            self.__wait_for_rate_limit()
+
+            try:
+                with metrics.REGISTRY.time(metrics.PROVIDER_REQUEST_SECONDS, endpoint):
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if metrics.REGISTRY.enabled:
+                    metrics.PROVIDER_REQUESTS.inc(endpoint, "error")
+                if attempt == self.max_retries:
+                    raise APIError(f"API Unavailable - {e}") from e
+                self.sleep(self.__get_backoff(attempt))
+                continue
+
+            if metrics.REGISTRY.enabled:
+                metrics.PROVIDER_REQUESTS.inc(endpoint, str(response.status_code))
+
+            self.__record_rate_limit(response)
+
+            if response.status_code not in self.RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+
+            self.sleep(self.__get_retry_delay(response, attempt))
+
+        return response
+
+
+    def __get_backoff(self, attempt):
+        return min(self.backoff_factor * (2 ** attempt), self.max_backoff)
+
+
+    def __get_retry_delay(self, response, attempt):
+        """
+        Prefer the server's Retry-After (seconds or an HTTP date), otherwise exponential backoff
+        """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+
+            if delay is not None:
+                return min(max(delay, 0), self.max_backoff)
+
+        return self.__get_backoff(attempt)
+
+
+    def __record_rate_limit(self, response):
+        """
+        The API reports the remaining budget in `x-ratelimit-remaining` and when it refills (epoch seconds) in
+        `x-ratelimit-reset`. Once it hits zero, hold off every thread until the reset instead of collecting 429s.
+        """
+        remaining = response.headers.get("x-ratelimit-remaining")
+        reset = response.headers.get("x-ratelimit-reset")
+
+        if remaining is None or reset is None:
+            return
+
+        try:
+            if int(remaining) > 0:
+                return
+            reset_at = float(reset)
+        except ValueError:
+            return
+
+        with self.rate_limit_lock:
+            self.rate_limited_until = max(self.rate_limited_until, reset_at)
+
+
+    def __wait_for_rate_limit(self):
+        with self.rate_limit_lock:
+            delay = self.rate_limited_until - time.time()
+
+        if delay > 0:
+            self.sleep(min(delay, self.max_backoff))
+
+
+def get_service_time(text, service_date) -> int:
+    """
+    An ISO 8601 time from the API to seconds after midnight of the service date (past 24:00:00 for trips running
+    after midnight, as in GTFS)
+    """
+    moment = datetime.fromisoformat(text)
+    return (moment.date() - service_date).days * 86400 + moment.hour * 3600 + moment.minute * 60 + moment.second
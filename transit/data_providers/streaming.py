@@ -0,0 +1,247 @@
+"""
+Real-time vehicle positions and predictions from the MBTA v3 streaming API.
+
+With `Accept: text/event-stream`, `/vehicles` and `/predictions` keep the response open and send server-sent
+events: `reset` (the full current set of resources), then `add` / `update` (one resource) and `remove` (an id and
+type) as things change. Events are parsed line by line as they arrive and folded into a `RealtimeState`: vehicles
+stopping at stops give headways, predictions next to their scheduled times give delays.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from transit import metrics
+from transit.data_providers.mbta import MBTADataProvider
+from transit.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Scheduled times, and the last delay recorded per prediction, remembered at most
+MAX_SCHEDULES = 50000
+MAX_PREDICTIONS = 50000
+
+
+@dataclass
+class Event:
+    event: str
+    data: str
+    id: str = None
+
+
+def parse_events(lines):
+    """
+    Server-sent events from an iterable of decoded lines (without line endings), yielded as each one completes
+    """
+    event = None
+    data = []
+    last_id = None
+
+    for line in lines:
+        if not line:
+            # A blank line dispatches the event
+            if data:
+                yield Event(event or "message", "\n".join(data), last_id)
+            event = None
+            data = []
+            continue
+
+        if line.startswith(":"):
+            # Comment, used as a keep-alive
+            continue
+
+        name, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+
+        if name == "event":
+            event = value
+        elif name == "data":
+            data.append(value)
+        elif name == "id":
+            last_id = value
+
+
+def parse_timestamp(text):
+    """
+    ISO 8601 timestamp (as used by the API) to epoch seconds, None for None
+    """
+    if not text:
+        return None
+    return datetime.fromisoformat(text).timestamp()
+
+
+def get_related_id(resource, relationship):
+    data = (resource.get("relationships", {}).get(relationship) or {}).get("data")
+    return data["id"] if data else None
+
+
+class MBTAStreamingProvider():
+    API_BASE_URL = MBTADataProvider.API_BASE_URL
+    API_KEY_ENV = MBTADataProvider.API_KEY_ENV
+    RESOURCES = ("vehicles", "predictions")
+
+    def __init__(self, state, route_names, base_url=None, api_key=None, timeout=(3.05, 60), backoff_factor=0.5,
+                 max_backoff=60) -> None:
+        """
+        Follow the routes in `route_names` (route id -> route name, as in `Network`) into `state`, a
+        `RealtimeState`. The read `timeout` should be longer than the server's keep-alive interval; a stream
+        that goes quiet for longer is reconnected, as is one that fails, backing off exponentially.
+        """
+        self.state = state
+        self.route_names = dict(route_names)
+
+        if base_url is not None:
+            self.API_BASE_URL = base_url
+
+        self.timeout = timeout
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "text/event-stream"
+
+        api_key = api_key or os.environ.get(self.API_KEY_ENV)
+        if api_key:
+            self.session.headers["x-api-key"] = api_key
+
+        self.schedules = LRUCache(MAX_SCHEDULES)
+        self.predicted_delays = LRUCache(MAX_PREDICTIONS)
+
+        self.stopping = threading.Event()
+        self.threads = []
+        # resource -> open response, so `stop()` can interrupt a blocked read
+        self.responses = {}
+
+
+    def get_url(self, resource):
+        url = f"{self.API_BASE_URL}{resource}?filter[route]={','.join(str(r) for r in self.route_names)}"
+        if resource == "predictions":
+            url += "&include=schedule"
+        return url
+
+
+    def start(self):
+        """
+        Follow every resource on its own daemon thread until `stop()`
+        """
+        for resource in self.RESOURCES:
+            thread = threading.Thread(target=self.run, args=(resource,), name=f"stream-{resource}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def stop(self, timeout=5):
+        self.stopping.set()
+        for response in list(self.responses.values()):
+            response.close()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+
+    def run(self, resource):
+        """
+        Consume one resource's stream, reconnecting until `stop()`
+        """
+        attempt = 0
+        while not self.stopping.is_set():
+            try:
+                with self.session.get(self.get_url(resource), stream=True, timeout=self.timeout) as response:
+                    if response.status_code != 200:
+                        raise requests.HTTPError(f"Status code: {response.status_code}", response=response)
+
+                    self.responses[resource] = response
+                    attempt = 0
+                    response.encoding = "utf-8"
+                    # Without a chunk size, chunks are handed over as they arrive rather than in fixed-size reads
+                    self.consume(resource, response.iter_lines(chunk_size=None, decode_unicode=True))
+            except (requests.RequestException, AttributeError, ValueError) as e:
+                # (closing the response from `stop()` can surface as any of these)
+                if self.stopping.is_set():
+                    break
+                logger.warning("%s stream failed: %s", resource, e)
+            finally:
+                self.responses.pop(resource, None)
+
+            self.stopping.wait(min(self.backoff_factor * (2 ** attempt), self.max_backoff))
+            attempt += 1
+
+
+    def consume(self, resource, lines):
+        for event in parse_events(lines):
+            if self.stopping.is_set():
+                break
+
+            if metrics.REGISTRY.enabled:
+                metrics.STREAM_EVENTS.inc(resource, event.event)
+
+            try:
+                self.handle_event(event.event, json.loads(event.data))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning("Skipping malformed %s event: %s", event.event, e)
+
+
+    def handle_event(self, event, data):
+        if event == "reset":
+            if any(item.get("type") == "vehicle" for item in data):
+                self.state.clear_vehicles()
+            for item in data:
+                self.handle_resource(item)
+        elif event in ("add", "update"):
+            self.handle_resource(data)
+        elif event == "remove":
+            if data.get("type") == "vehicle":
+                self.state.remove_vehicle(data["id"])
+            elif data.get("type") == "prediction":
+                self.predicted_delays.pop(data["id"])
+
+
+    def handle_resource(self, item):
+        kind = item.get("type")
+        if kind == "vehicle":
+            self.handle_vehicle(item)
+        elif kind == "prediction":
+            self.handle_prediction(item)
+        elif kind == "schedule":
+            attributes = item["attributes"]
+            scheduled = parse_timestamp(attributes.get("arrival_time") or attributes.get("departure_time"))
+            if scheduled is not None:
+                self.schedules.put(item["id"], scheduled)
+
+
+    def handle_vehicle(self, vehicle):
+        route = self.route_names.get(get_related_id(vehicle, "route"))
+        if route is None:
+            return
+
+        attributes = vehicle["attributes"]
+        self.state.set_vehicle(
+            vehicle["id"], route, attributes.get("direction_id"), get_related_id(vehicle, "stop"),
+            attributes.get("current_status"), parse_timestamp(attributes.get("updated_at")) or time.time()
+        )
+
+
+    def handle_prediction(self, prediction):
+        route = self.route_names.get(get_related_id(prediction, "route"))
+        schedule_id = get_related_id(prediction, "schedule")
+        if route is None or schedule_id is None:
+            return
+
+        scheduled = self.schedules.get(schedule_id, None)
+        attributes = prediction["attributes"]
+        predicted = parse_timestamp(attributes.get("arrival_time") or attributes.get("departure_time"))
+        if scheduled is None or predicted is None:
+            return
+
+        # Predictions are updated many times on their way to the stop; only count a change of delay
+        delay = predicted - scheduled
+        if self.predicted_delays.get(prediction["id"], None) != delay:
+            self.predicted_delays.put(prediction["id"], delay)
+            self.state.record_delay(route, delay)
@@ -0,0 +1,312 @@
+from array import array
+
+from transit.route import StopSequence
+
+
+class CSR():
+    """
+    Rows of integers stored as one flat array plus row offsets ("compressed sparse rows"): row i is
+    `values[offsets[i]:offsets[i + 1]]`. Both arrays can be plain `array`s or memoryviews over a snapshot.
+    """
+    __slots__ = ("offsets", "values")
+
+    def __init__(self, offsets, values) -> None:
+        self.offsets = offsets
+        self.values = values
+
+
+    @classmethod
+    def from_rows(cls, rows):
+        offsets = array("I", [0])
+        values = array("I")
+        for row in rows:
+            values.extend(row)
+            offsets.append(len(values))
+        return cls(offsets, values)
+
+
+    def __getitem__(self, row):
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def __reduce__(self):
+        return (CSR, (to_array(self.offsets), to_array(self.values)))
+
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class TransitGraph():
+    """
+    Integer-indexed view of a loaded network, built once by `TransitMap.load_stops()`.
+
+    Routes and stops are numbered in load order. Everything the planner touches is a flat integer array indexed
+    by those numbers, so a search never has to go back to the Route / Stop objects or scan a route's stops,
+    and the same arrays can be written to / memory-mapped from a snapshot (see `transit/snapshot.py`).
+
+    A graph "route" is one stop sequence of a `Route`: a route with several sequences (branches, or its own
+    sequence for each direction) gets one route number per sequence, all with its name and line. Riding never
+    runs off the end of one sequence onto the next, and changing between them is a transfer, like changing trains.
+    Each sequence is ridden both ways.
+
+    The route stop lists laid end to end give every (route, stop) pair a "slot": `route_stops.offsets[r]` is the
+    first slot of route r, `slot_routes[slot]` the route of a slot and `route_stops.values[slot]` its stop.
+
+    Besides changing routes at a shared stop, riders can walk between nearby stops (`walk_stops`). A transfer
+    leaves its route at `transfer_stops` and boards the next one at `transfer_boards`, which is the same stop
+    unless the transfer involves a walk.
+    """
+
+    def __init__(self, route_names, stop_names, route_stops, stop_routes, stop_slots, slot_routes,
+                 transfer_routes, transfer_stops, transfer_boards=None, walk_stops=None, walk_meters=None,
+                 route_lines=None) -> None:
+        self.route_names = route_names
+        self.stop_names = stop_names
+
+        # route index -> stop indexes, in route order
+        self.route_stops = route_stops
+        # stop index -> route indexes, in load order
+        self.stop_routes = stop_routes
+        # stop index -> (first) slot of the stop on each of `stop_routes`, row for row
+        self.stop_slots = stop_slots
+        self.slot_routes = slot_routes
+
+        # route index -> routes reachable with one transfer, the stop to get off at and the stop to board the
+        # other route at (row for row)
+        self.transfer_routes = transfer_routes
+        self.transfer_stops = transfer_stops
+        self.transfer_boards = transfer_boards if transfer_boards is not None else transfer_stops
+
+        # stop index -> stops within walking distance, and how many meters away (row for row)
+        if walk_stops is None:
+            walk_stops = CSR(array("I", [0]) * (len(stop_names) + 1), array("I"))
+            walk_meters = array("I")
+        self.walk_stops = walk_stops
+        self.walk_meters = walk_meters
+
+        # route index -> line number (routes of the same line share one), every route its own line by default
+        self.route_lines = route_lines if route_lines is not None else array("I", range(len(route_names)))
+
+        self.route_index = {name: i for i, name in enumerate(route_names)}
+        self.stop_index = {name: i for i, name in enumerate(stop_names)}
+
+        # Set when the arrays are mapped from a snapshot file (see `transit/snapshot.py`), with the fingerprint of
+        # the file that was mapped
+        self.snapshot_path = None
+        self.snapshot_fingerprint = None
+
+
+    @classmethod
+    def from_routes(cls, routes, stop_names=(), walks=()):
+        """
+        Build the graph from an iterable of (fully loaded) routes. `stop_names` are numbered first, in that order
+        (so a rebuilt graph can keep a previous graph's stop order); any of them no route serves simply have no routes.
+
+        `walks` are (stop name, stop name, meters) walking transfers, usable in both directions.
+        """
+        stop_names = list(stop_names)
+        stop_index = {name: i for i, name in enumerate(stop_names)}
+        route_names = []
+        route_lines = array("I")
+        line_index = {}
+        route_rows = []
+        stop_rows = [[] for _ in stop_names]
+        stop_slot_rows = [[] for _ in stop_names]
+        slot_routes = array("I")
+
+        # One route number per sequence (a route without stops still gets one, with no slots)
+        sequences = ((route, sequence.stops) for route in routes for sequence in route.sequences or [StopSequence()])
+
+        for route_idx, (route, stops) in enumerate(sequences):
+            route_names.append(route.name)
+            route_lines.append(line_index.setdefault(route.line_name, len(line_index)))
+            row = []
+
+            for stop in stops:
+                if stop.name not in stop_index:
+                    stop_index[stop.name] = len(stop_names)
+                    stop_names.append(stop.name)
+                    stop_rows.append([])
+                    stop_slot_rows.append([])
+
+                stop_idx = stop_index[stop.name]
+                slot = len(slot_routes)
+                row.append(stop_idx)
+                slot_routes.append(route_idx)
+
+                # A stop visited twice by the same route (e.g. a loop) keeps its first slot
+                if not stop_rows[stop_idx] or stop_rows[stop_idx][-1] != route_idx:
+                    stop_rows[stop_idx].append(route_idx)
+                    stop_slot_rows[stop_idx].append(slot)
+
+            route_rows.append(row)
+
+        route_stops = CSR.from_rows(route_rows)
+        stop_routes = CSR.from_rows(stop_rows)
+
+        # Shortest walk between each pair of stops, both ways, nearest first
+        walk_rows = [{} for _ in stop_names]
+        for name, other_name, meters in walks:
+            stop_idx = stop_index.get(name)
+            other_idx = stop_index.get(other_name)
+            if stop_idx is None or other_idx is None or stop_idx == other_idx:
+                continue
+
+            meters = round(meters)
+            for a, b in ((stop_idx, other_idx), (other_idx, stop_idx)):
+                if meters < walk_rows[a].get(b, meters + 1):
+                    walk_rows[a][b] = meters
+
+        walk_rows = [sorted(row.items(), key=lambda walk: (walk[1], walk[0])) for row in walk_rows]
+        walk_stops = CSR.from_rows([other for other, _ in row] for row in walk_rows)
+        walk_meters = array("I", (meters for row in walk_rows for _, meters in row))
+
+        transfer_routes = []
+        transfer_stops = []
+        transfer_boards = []
+        for route_idx, row in enumerate(route_rows):
+            routes_row, stops_row, boards_row = cls.__get_transfers(route_idx, row, stop_routes, walk_stops)
+            transfer_routes.append(routes_row)
+            transfer_stops.append(stops_row)
+            transfer_boards.append(boards_row)
+
+        transfer_routes = CSR.from_rows(transfer_routes)
+        return cls(
+            route_names,
+            stop_names,
+            route_stops,
+            stop_routes,
+            CSR.from_rows(stop_slot_rows),
+            slot_routes,
+            transfer_routes,
+            CSR.from_rows(transfer_stops),
+            # Same shape as `transfer_routes`, so it shares its offsets
+            CSR(transfer_routes.offsets, CSR.from_rows(transfer_boards).values),
+            walk_stops,
+            walk_meters,
+            route_lines
+        )
+
+
+    @staticmethod
+    def __get_transfers(route_idx, stops, stop_routes, walk_stops):
+        """
+        Every route reachable from `route_idx` with a single transfer, the stop to get off at and the stop to board
+        at. When two routes share several stops, the first one along `route_idx` is used; routes are only reached
+        by walking when they don't share a stop.
+        """
+        seen = {route_idx}
+        routes = []
+        transfer_stops = []
+        boards = []
+
+        for stop_idx in stops:
+            for other in stop_routes[stop_idx]:
+                if other not in seen:
+                    seen.add(other)
+                    routes.append(other)
+                    transfer_stops.append(stop_idx)
+                    boards.append(stop_idx)
+
+        for stop_idx in stops:
+            for walk_idx in walk_stops[stop_idx]:
+                for other in stop_routes[walk_idx]:
+                    if other not in seen:
+                        seen.add(other)
+                        routes.append(other)
+                        transfer_stops.append(stop_idx)
+                        boards.append(walk_idx)
+
+        return routes, transfer_stops, boards
+
+
+    def __reduce__(self):
+        """
+        A graph mapped from a snapshot is pickled as its path, so worker processes map the same file (and share its
+        pages) instead of receiving a copy of the arrays. That only holds while the file is the one that was mapped:
+        once it has been rewritten, the arrays are copied after all.
+        """
+        if self.snapshot_path is not None:
+            from transit.snapshot import get_fingerprint, read_graph
+            if get_fingerprint(self.snapshot_path) == self.snapshot_fingerprint:
+                return (read_graph, (self.snapshot_path, self.snapshot_fingerprint))
+
+        return (TransitGraph, (
+            self.route_names,
+            self.stop_names,
+            self.route_stops,
+            self.stop_routes,
+            self.stop_slots,
+            to_array(self.slot_routes),
+            self.transfer_routes,
+            self.transfer_stops,
+            self.transfer_boards,
+            self.walk_stops,
+            to_array(self.walk_meters),
+            to_array(self.route_lines)
+        ))
+
+
+    def get_walks(self):
+        """
+        The walking transfers as (stop name, stop name, meters), the way `from_routes()` takes them
+        """
+        for stop_idx, name in enumerate(self.stop_names):
+            row = self.walk_stops.offsets[stop_idx]
+            for i, other_idx in enumerate(self.walk_stops[stop_idx]):
+                yield name, self.stop_names[other_idx], self.walk_meters[row + i]
+
+
+    @property
+    def route_offsets(self):
+        return self.route_stops.offsets
+
+
+    @property
+    def slot_stops(self):
+        return self.route_stops.values
+
+
+    def get_slot(self, route_idx, stop_idx) -> int:
+        """
+        Slot of a stop on a route
+        """
+        routes = self.stop_routes.values
+        for i in range(self.stop_routes.offsets[stop_idx], self.stop_routes.offsets[stop_idx + 1]):
+            if routes[i] == route_idx:
+                return self.stop_slots.values[i]
+
+        raise KeyError(f"Stop {stop_idx} is not on route {route_idx}")
+
+
+    def get_walk_meters(self, stop_idx, other_idx) -> int:
+        """
+        Length of the walking transfer between two stops
+        """
+        start = self.walk_stops.offsets[stop_idx]
+        for i in range(start, self.walk_stops.offsets[stop_idx + 1]):
+            if self.walk_stops.values[i] == other_idx:
+                return self.walk_meters[i]
+
+        raise KeyError(f"No walk from stop {stop_idx} to {other_idx}")
+
+
+    def ride_length(self, route_idx, board_idx, alight_idx) -> int:
+        """
+        Number of stops travelled between two stops of the same route
+        """
+        return abs(self.get_slot(route_idx, alight_idx) - self.get_slot(route_idx, board_idx))
+
+
+def to_array(values):
+    """
+    Copy of a memoryview over a snapshot as an `array`, which unlike the view can be pickled. Arrays are returned as
+    they are.
+    """
+    return array("I", values) if isinstance(values, memoryview) else values
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+
+# Returned by `LRUCache.get()` for keys that aren't cached (None can be a cached value)
+MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LRUCache():
+    """
+    Thread-safe bounded mapping that evicts the least recently used entry, counting hits, misses and evictions.
+    A `maxsize` of 0 disables caching.
+    """
+
+    def __init__(self, maxsize) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            value = self.entries.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+
+    def values(self) -> list:
+        """
+        The cached values, least recently used first (not counted as lookups)
+        """
+        with self.lock:
+            return list(self.entries.values())
+
+
+    def clear(self):
+        """
+        Drop every entry (the counters are kept)
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+    @property
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self.entries), self.maxsize)
+
+
+    def __len__(self):
+        return len(self.entries)
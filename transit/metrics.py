@@ -0,0 +1,249 @@
+"""
+Counters, latency histograms and per-query traces for the hot paths: provider HTTP calls, real-time feed events,
+network load phases and planner queries. `REGISTRY.render()` exports everything in the Prometheus text format.
+
+Instrumentation is off by default. Instrumented code checks `REGISTRY.enabled` before measuring anything, so
+while it is off the only cost is that one attribute check: no clock reads, no label formatting, no locking.
+"""
+
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass
+import threading
+import time
+
+# Seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Nodes (routes or route / stop states) expanded by a search
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+
+# Most recent query traces kept in memory
+TRACE_LIMIT = 1000
+
+
+@dataclass
+class QueryTrace:
+    query: str
+    origin: str
+    destination: str
+    options: str
+    seconds: float
+    # Routes (transfer search), route / stop states (stop search) or patterns (journey search) looked at
+    expanded: int
+    # Transfers levels (transfer search), transfers (stop search) or rounds (journey search) reached
+    depth: int
+    found: bool
+
+
+class Counter():
+    def __init__(self, registry, name, help, label_names=()) -> None:
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+
+    def inc(self, *labels, amount=1):
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram():
+    def __init__(self, registry, name, help, label_names=(), buckets=LATENCY_BUCKETS) -> None:
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (the last one being +Inf), sum, count]
+        self.values = {}
+
+
+    def observe(self, value, *labels):
+        bucket = bisect_left(self.buckets, value)
+
+        with self.registry.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            state[0][bucket] += 1
+            state[1] += value
+            state[2] += 1
+
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le_value = bound if bound == "+Inf" else format_value(bound)
+                le = format_labels((*self.label_names, "le"), (*labels, le_value))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+
+            suffix = format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{suffix} {format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+
+        return lines
+
+
+class Timer():
+    """
+    Context manager observing the time spent in its block into a histogram
+    """
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class NullTimer():
+    """
+    What `Registry.time()` hands out while instrumentation is disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Registry():
+    def __init__(self, enabled=False) -> None:
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.traces = deque(maxlen=TRACE_LIMIT)
+
+
+    def counter(self, name, help, label_names=()) -> Counter:
+        return self.__register(Counter(self, name, help, label_names))
+
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.__register(Histogram(self, name, help, label_names, buckets))
+
+
+    def __register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+
+    def time(self, histogram, *labels):
+        """
+        `with REGISTRY.time(histogram, label, ...):` records how long the block took (when enabled)
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(histogram, labels)
+
+
+    def record_trace(self, trace: QueryTrace):
+        self.traces.append(trace)
+
+
+    def reset(self):
+        """
+        Drop every recorded value and trace (the metrics themselves stay registered)
+        """
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values.clear()
+            self.traces.clear()
+
+
+    def render(self) -> str:
+        """
+        Everything recorded so far, in the Prometheus text exposition format
+        """
+        with self.lock:
+            lines = []
+            for metric in self.metrics.values():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def record_query(query, origin, destination, options, started, search, found):
+    """
+    Record a finished planner query: its latency, outcome, how much the search expanded, and a trace.
+    `search` is anything with `expanded` and `depth` (the planner's search objects).
+    """
+    seconds = time.perf_counter() - started
+    expanded = search.expanded
+
+    PLAN_QUERIES.inc(query, "found" if found else "not_found")
+    PLAN_SECONDS.observe(seconds, query)
+    PLAN_EXPANDED.observe(expanded, query)
+    REGISTRY.record_trace(QueryTrace(query, origin, destination, options, seconds, expanded, search.depth, found))
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+
+PROVIDER_REQUESTS = REGISTRY.counter(
+    "transit_provider_requests_total", "HTTP requests made to a data provider", ("endpoint", "status")
+)
+PROVIDER_REQUEST_SECONDS = REGISTRY.histogram(
+    "transit_provider_request_seconds", "Latency of HTTP requests to a data provider", ("endpoint",)
+)
+PROVIDER_CACHE = REGISTRY.counter(
+    "transit_provider_cache_total", "Provider responses by cache outcome (hit, revalidated, miss)", ("result",)
+)
+STREAM_EVENTS = REGISTRY.counter(
+    "transit_stream_events_total", "Real-time feed events received", ("resource", "event")
+)
+LOAD_SECONDS = REGISTRY.histogram(
+    "transit_load_seconds", "Time spent in each network load phase", ("phase",)
+)
+PLAN_QUERIES = REGISTRY.counter(
+    "transit_plan_queries_total", "Planner queries by kind and outcome", ("query", "result")
+)
+PLAN_CACHE = REGISTRY.counter(
+    "transit_plan_cache_total", "Plan queries by result cache outcome (hit, miss)", ("result",)
+)
+PLAN_SECONDS = REGISTRY.histogram(
+    "transit_plan_seconds", "Latency of planner queries", ("query",)
+)
+PLAN_EXPANDED = REGISTRY.histogram(
+    "transit_plan_expanded_nodes", "Nodes expanded per planner query", ("query",), buckets=SIZE_BUCKETS
+)
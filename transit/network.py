@@ -0,0 +1,268 @@
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+from transit.graph import TransitGraph
+from transit.route import Route, to_sequences
+from transit.search import StopNameIndex
+from transit.spatial import StopLocationIndex
+from transit.stats import NetworkStats
+from transit.stop import Stop
+
+
+@dataclass
+class RouteChange:
+    route: str
+    added_stops: list = field(default_factory=list)
+    removed_stops: list = field(default_factory=list)
+    # Same stops, different order (or the route's id / line changed)
+    reordered: bool = False
+
+
+@dataclass
+class NetworkDiff:
+    added_routes: list = field(default_factory=list)
+    removed_routes: list = field(default_factory=list)
+    changed_routes: list = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added_routes or self.removed_routes or self.changed_routes)
+
+
+class Network():
+    """
+    Immutable snapshot of a loaded network: routes and stops keyed by name, plus everything derived from them
+    (the planner graph, connecting stops, statistics).
+
+    Nothing in a Network is modified once it has been built (the stop search and location indexes are only built
+    lazily). `TransitMap` publishes a new instance when it (re)loads, so a reader only has to take one reference
+    and can keep using it without locks, even while a reload is running on another thread.
+    """
+    __slots__ = ("version", "routes", "stops", "graph", "connecting_stops", "stats", "_stop_search", "_stop_locations")
+
+    def __init__(self, routes=None, stops=None, graph=None, version=0, connecting_stops=None, stats=None) -> None:
+        """
+        `connecting_stops` and `stats` can be passed in when they are already known (see `apply()`)
+        """
+        self.version = version
+        self.routes = MappingProxyType(dict(routes or {}))
+        self.stops = MappingProxyType(dict(stops or {}))
+        self.graph = graph
+
+        # We'll define "connecting stops" as stops that service two or more routes
+        if connecting_stops is None:
+            connecting_stops = {
+                name: stop.route_associations for name, stop in self.stops.items() if len(stop.route_associations) >= 2
+            }
+        self.connecting_stops = MappingProxyType(connecting_stops)
+
+        # Route sizes, stops per number of routes, line totals (see `transit/stats.py`)
+        if stats is None:
+            stats = NetworkStats.from_routes(self.routes.values())
+        self.stats = stats
+
+        # Fuzzy / prefix lookups of stop names, built on first use (exact lookups never need it)
+        self._stop_search = None
+        # Stops by location, for nearest-stop lookups
+        self._stop_locations = None
+
+
+    @classmethod
+    def build(cls, routes, stops_by_route, version=0, walks=()):
+        """
+        Merge provider data into a new network. `stops_by_route` maps route ids to that route's stops (or stop
+        sequences, see `BaseDataProvider.get_stops_for_route()`); stops are merged by name. Routes and stops are
+        copied, so provider objects are never shared between networks.
+        `walks` are (stop name, stop name, meters) walking transfers for the planner graph.
+        """
+        route_map = {}
+        stop_map = {}
+
+        for provider_route in routes:
+            route = Route(name=provider_route.name, id=provider_route.id, line_name=provider_route.line_name)
+            route_map[route.name] = route
+
+            for sequence in to_sequences(stops_by_route.get(route.id, ())):
+                stops = []
+                for provider_stop in sequence.stops:
+                    # Add this to the list of all stops if we haven't already seen it
+                    if provider_stop.name not in stop_map:
+                        stop_map[provider_stop.name] = copy_stop(provider_stop)
+
+                    stop = stop_map[provider_stop.name]
+
+                    # Either way, record the route against the stop and add the stop to the route info
+                    stop.add_route_association(route.name)
+                    stops.append(stop)
+
+                route.add_sequence(stops, sequence.direction)
+
+        # Build the integer-indexed graph used by the planner once, rather than on every query
+        graph = TransitGraph.from_routes(route_map.values(), walks=walks)
+
+        return cls(route_map, stop_map, graph, version)
+
+
+    def diff(self, routes, stops_by_route) -> NetworkDiff:
+        """
+        Compare freshly fetched provider data against this network
+        """
+        diff = NetworkDiff()
+        names = set()
+
+        for route in routes:
+            names.add(route.name)
+            current = self.routes.get(route.name)
+
+            if current is None:
+                diff.added_routes.append(route.name)
+                continue
+
+            old_sequences = get_sequence_names(current.sequences)
+            new_sequences = get_sequence_names(to_sequences(stops_by_route.get(route.id, ())))
+            if old_sequences == new_sequences and (current.id, current.line_name) == (route.id, route.line_name):
+                continue
+
+            old_stops = [name for _, names in old_sequences for name in names]
+            new_stops = [name for _, names in new_sequences for name in names]
+
+            old_set = set(old_stops)
+            new_set = set(new_stops)
+            diff.changed_routes.append(RouteChange(
+                route=route.name,
+                added_stops=[name for name in dict.fromkeys(new_stops) if name not in old_set],
+                removed_stops=[name for name in dict.fromkeys(old_stops) if name not in new_set],
+                reordered=old_set == new_set
+            ))
+
+        diff.removed_routes = [name for name in self.routes if name not in names]
+        return diff
+
+
+    def apply(self, diff, routes, stops_by_route, version, walks=()):
+        """
+        Build the next network from this one and a diff, copying only what the diff touches: the added / changed
+        routes, the stops whose route associations change, and the routes that reference those stops. Everything
+        else (and the connecting stop index, outside the affected stops) is shared with this network, which is
+        left untouched. The planner graph is re-derived from the result (with `walks`, as in `build()`): stops that
+        are still served keep their order, stops no route serves any more are dropped and the rest renumbered.
+        """
+        provider_routes = {route.name: route for route in routes}
+        route_order = {route.name: i for i, route in enumerate(routes)}
+
+        # Routes whose stop lists come from the provider data, and routes that just go away
+        refetched = set(diff.added_routes) | {change.route for change in diff.changed_routes}
+        removed = set(diff.removed_routes)
+
+        # Stops whose associations change: everything on a removed route, and the stops that were added to /
+        # removed from a route. A route that was only reordered keeps the same associations.
+        affected_stops = set()
+        for name in removed:
+            affected_stops.update(stop.name for stop in self.routes[name].stops)
+        for name in diff.added_routes:
+            for sequence in to_sequences(stops_by_route.get(provider_routes[name].id, ())):
+                affected_stops.update(stop.name for stop in sequence.stops)
+        for change in diff.changed_routes:
+            affected_stops.update(change.added_stops)
+            affected_stops.update(change.removed_stops)
+
+        # Final route membership of the affected stops, and a provider copy of any stop we haven't seen before
+        memberships = {}
+        for name in affected_stops:
+            current = self.stops.get(name)
+            associations = current.route_associations if current is not None else ()
+            memberships[name] = {r for r in associations if r not in removed and r not in refetched}
+
+        provider_stops = {}
+        for name in refetched:
+            for sequence in to_sequences(stops_by_route.get(provider_routes[name].id, ())):
+                for stop in sequence.stops:
+                    if stop.name in memberships:
+                        memberships[stop.name].add(name)
+                        provider_stops.setdefault(stop.name, stop)
+
+        stop_map = dict(self.stops)
+        connecting_stops = dict(self.connecting_stops)
+        # Routes that aren't changing themselves but reference a stop that is about to be replaced
+        referencing = set()
+
+        for name in affected_stops:
+            current = stop_map.pop(name, None)
+            connecting_stops.pop(name, None)
+
+            if current is not None:
+                referencing.update(current.route_associations)
+
+            if not memberships[name]:
+                continue
+
+            stop = copy_stop(current or provider_stops[name])
+            for route_name in sorted(memberships[name], key=route_order.get):
+                stop.add_route_association(route_name)
+
+            stop_map[name] = stop
+            if len(stop.route_associations) >= 2:
+                connecting_stops[name] = stop.route_associations
+
+        route_map = {}
+        for route in routes:
+            if route.name in refetched:
+                sequences = get_sequence_names(to_sequences(stops_by_route.get(route.id, ())))
+            elif route.name in referencing:
+                sequences = get_sequence_names(self.routes[route.name].sequences)
+            else:
+                route_map[route.name] = self.routes[route.name]
+                continue
+
+            copy = Route(name=route.name, id=route.id, line_name=route.line_name)
+            for direction, stop_names in sequences:
+                copy.add_sequence([stop_map[stop_name] for stop_name in stop_names], direction)
+            route_map[route.name] = copy
+
+        previous_stops = [name for name in self.graph.stop_names if name in stop_map] if self.graph is not None else ()
+        graph = TransitGraph.from_routes(route_map.values(), stop_names=previous_stops, walks=walks)
+
+        # Only the routes whose stops changed move the statistics; routes that were merely copied serve the same stops
+        stats = self.stats.updated(
+            removed=[self.routes[name] for name in removed | refetched if name in self.routes],
+            added=[route_map[name] for name in refetched]
+        )
+
+        return Network(route_map, stop_map, graph, version, connecting_stops, stats)
+
+
+    @property
+    def stop_search(self) -> StopNameIndex:
+        # Building it twice from two threads is harmless, both results are the same
+        if self._stop_search is None:
+            self._stop_search = StopNameIndex(self.stops.keys())
+        return self._stop_search
+
+
+    @property
+    def stop_locations(self) -> StopLocationIndex:
+        if self._stop_locations is None:
+            self._stop_locations = StopLocationIndex(self.stops.values())
+        return self._stop_locations
+
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        False while only the routes have been loaded
+        """
+        return self.graph is not None
+
+
+def copy_stop(stop) -> Stop:
+    """
+    A stop's identity and location, without its route associations
+    """
+    return Stop(name=stop.name, id=stop.id, latitude=stop.latitude, longitude=stop.longitude)
+
+
+def get_sequence_names(sequences) -> list:
+    """
+    (direction, stop names) of each stop sequence
+    """
+    return [(sequence.direction, [stop.name for stop in sequence.stops]) for sequence in sequences]
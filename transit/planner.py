@@ -0,0 +1,597 @@
+from collections import deque
+from dataclasses import dataclass, field
+import heapq
+import time
+
+from transit import metrics
+
+FEWEST_TRANSFERS = "transfers"
+FEWEST_STOPS = "stops"
+
+# How `ParetoSearch` ranks (transfers, stops, line changes) for each optimization: positions of the criteria, most
+# important first
+RANKINGS = {
+    FEWEST_TRANSFERS: (0, 1, 2),
+    FEWEST_STOPS: (1, 0, 2),
+}
+
+
+@dataclass
+class Leg:
+    route: str
+    board: str
+    alight: str
+    stops: int = 0
+
+
+@dataclass
+class Walk:
+    """
+    Walking transfer between two nearby stops
+    """
+    board: str
+    alight: str
+    meters: int = 0
+
+
+@dataclass
+class Itinerary:
+    # `Leg`s, with a `Walk` between two of them where the transfer needs one
+    legs: list = field(default_factory=list)
+    # Transfers onto a route of another line (e.g. Green Line B -> Red Line, but not Green Line B -> Green Line C)
+    line_changes: int = 0
+
+    @property
+    def rides(self) -> list:
+        return [leg for leg in self.legs if isinstance(leg, Leg)]
+
+    @property
+    def routes(self) -> list:
+        return [leg.route for leg in self.rides]
+
+    @property
+    def transfers(self) -> int:
+        return max(len(self.rides) - 1, 0)
+
+    @property
+    def stops(self) -> int:
+        return sum(leg.stops for leg in self.rides)
+
+    @property
+    def walk_meters(self) -> int:
+        return sum(leg.meters for leg in self.legs if isinstance(leg, Walk))
+
+
+class TransferSearch():
+    """
+    Breadth-first search over the route graph from a single origin stop. Every route serving the origin is at
+    distance 0 and each transfer adds 1, so `itinerary_to()` returns a fewest-transfer itinerary.
+
+    The search is one-to-all: it can be reused for any number of destinations from the same origin.
+    """
+
+    def __init__(self, graph, origin_idx):
+        self.graph = graph
+        self.origin_idx = origin_idx
+
+        route_count = len(graph.route_names)
+        self.distance = [-1] * route_count
+        self.parent = [-1] * route_count
+        self.transfer_stop = [-1] * route_count
+        self.transfer_board = [-1] * route_count
+
+        queue = deque()
+        for route_idx in graph.stop_routes[origin_idx]:
+            self.distance[route_idx] = 0
+            queue.append(route_idx)
+
+        while queue:
+            route_idx = queue.popleft()
+            next_distance = self.distance[route_idx] + 1
+
+            transfers = zip(
+                graph.transfer_routes[route_idx], graph.transfer_stops[route_idx], graph.transfer_boards[route_idx]
+            )
+            for other, stop_idx, board_idx in transfers:
+                if self.distance[other] == -1:
+                    self.distance[other] = next_distance
+                    self.parent[other] = route_idx
+                    self.transfer_stop[other] = stop_idx
+                    self.transfer_board[other] = board_idx
+                    queue.append(other)
+
+
+    @property
+    def expanded(self) -> int:
+        """
+        Routes reached (and so expanded) by the search
+        """
+        return sum(1 for distance in self.distance if distance != -1)
+
+
+    @property
+    def depth(self) -> int:
+        """
+        Most transfers any reached route needs
+        """
+        return max(self.distance, default=-1)
+
+
+    def itinerary_to(self, destination_idx):
+        """
+        Rebuild the itinerary to the destination, or None if it cannot be reached
+        """
+        best = -1
+        for route_idx in self.graph.stop_routes[destination_idx]:
+            distance = self.distance[route_idx]
+            if distance != -1 and (best == -1 or distance < self.distance[best]):
+                best = route_idx
+
+        if best == -1:
+            return None
+
+        hops = []
+        alight_idx = destination_idx
+        route_idx = best
+        while route_idx != -1:
+            if self.parent[route_idx] == -1:
+                hops.append((route_idx, self.origin_idx, alight_idx))
+                break
+
+            board_idx = self.transfer_board[route_idx]
+            hops.append((route_idx, board_idx, alight_idx))
+            alight_idx = self.transfer_stop[route_idx]
+            if alight_idx != board_idx:
+                hops.append((None, alight_idx, board_idx))
+            route_idx = self.parent[route_idx]
+
+        return build_itinerary(self.graph, reversed(hops))
+
+
+class StopSearch():
+    """
+    Dijkstra search over (route, stop) states. Riding to a neighbouring stop costs one stop, changing routes
+    (at the same stop or by walking to a nearby one) costs one transfer; costs are compared as (stops, transfers),
+    so `itinerary_to()` returns a fewest-stop itinerary and breaks ties on transfers.
+
+    States are the graph's slots. With a destination the search stops as soon as it is settled; without one it
+    runs to completion and `itinerary_to()` can be asked about any destination.
+    """
+
+    def __init__(self, graph, origin_idx, destination_idx=None):
+        self.graph = graph
+        self.origin_idx = origin_idx
+
+        self.cost = {}
+        self.parent = {}
+        settled = set()
+
+        heap = []
+        for route_idx in graph.stop_routes[origin_idx]:
+            self.__push(heap, graph.get_slot(route_idx, origin_idx), (0, 0), -1)
+
+        while heap:
+            stops, transfers, slot = heapq.heappop(heap)
+            if slot in settled:
+                continue
+            settled.add(slot)
+
+            stop_idx = graph.slot_stops[slot]
+            if stop_idx == destination_idx:
+                break
+
+            route_idx = graph.slot_routes[slot]
+
+            # Ride one stop in either direction
+            for neighbour in (slot - 1, slot + 1):
+                if graph.route_offsets[route_idx] <= neighbour < graph.route_offsets[route_idx + 1]:
+                    self.__push(heap, neighbour, (stops + 1, transfers), slot)
+
+            # Transfer to another route at this stop
+            for other in graph.stop_routes[stop_idx]:
+                if other != route_idx:
+                    self.__push(heap, graph.get_slot(other, stop_idx), (stops, transfers + 1), slot)
+
+            # Walk to a nearby stop and transfer there
+            for walk_idx in graph.walk_stops[stop_idx]:
+                for other in graph.stop_routes[walk_idx]:
+                    if other != route_idx:
+                        self.__push(heap, graph.get_slot(other, walk_idx), (stops, transfers + 1), slot)
+
+        # Route / stop states settled
+        self.expanded = len(settled)
+
+
+    @property
+    def depth(self) -> int:
+        """
+        Most transfers of any state reached
+        """
+        return max((cost[1] for cost in self.cost.values()), default=0)
+
+
+    def __push(self, heap, slot, cost, parent):
+        if slot not in self.cost or cost < self.cost[slot]:
+            self.cost[slot] = cost
+            self.parent[slot] = parent
+            heapq.heappush(heap, (cost[0], cost[1], slot))
+
+
+    def itinerary_to(self, destination_idx):
+        """
+        Rebuild the itinerary to the destination, or None if it cannot be reached
+        """
+        # Cheapest arrival over every route serving the destination
+        best = None
+        for slot in self.graph.stop_slots[destination_idx]:
+            if slot in self.cost and (best is None or self.cost[slot] < self.cost[best]):
+                best = slot
+
+        if best is None:
+            return None
+
+        hops = []
+        slot = best
+        alight_idx = destination_idx
+        current_route = self.graph.slot_routes[slot]
+        board_idx = destination_idx
+
+        while slot != -1:
+            route_idx = self.graph.slot_routes[slot]
+            stop_idx = self.graph.slot_stops[slot]
+
+            if route_idx != current_route:
+                # Transfer: the leg on `current_route` boarded where its earliest state is, walking there from this
+                # stop if that's somewhere else
+                hops.append((current_route, board_idx, alight_idx))
+                if board_idx != stop_idx:
+                    hops.append((None, stop_idx, board_idx))
+                alight_idx = stop_idx
+                current_route = route_idx
+
+            board_idx = stop_idx
+            slot = self.parent[slot]
+
+        hops.append((current_route, self.origin_idx, alight_idx))
+        return build_itinerary(self.graph, reversed(hops))
+
+
+class ParetoSearch():
+    """
+    Multi-criteria label-setting search over (route, stop) states, for alternatives rather than one best
+    itinerary. A label is one way of reaching a state, costed as (transfers, stops, line changes). Labels come off
+    the heap best first in the `optimize` ranking (the other criteria breaking ties) by their cost plus a lower
+    bound on the rest of the way: the fewest transfers from their route and the fewest stops from their stop to
+    the destination, which steers the search toward the destination and skips states that can't reach it.
+
+    A label is dropped as soon as one kept at the same state, or one that already reached the destination, is at
+    least as good on every criterion. The labels left at the destination are the Pareto set: no itinerary in it is
+    beaten on all three criteria by another, and there is one itinerary per distinct cost.
+
+    With `k`, the search returns the k best itineraries in the ranking instead, Pareto-optimal or not: up to k
+    labels are kept per state and the search ends when the k-th one reaches the destination, so k alternatives
+    cost little more than one.
+
+    Rides never turn back and changing routes needs at least one stop ridden first, but a route can be boarded
+    again further along. An itinerary that comes back to a state it already passed through costs at least one
+    more transfer and one more stop than the same itinerary without the loop, so loops are dropped at the state
+    they come back to and never rank ahead of the itinerary without them.
+    """
+
+    def __init__(self, graph, origin_idx, destination_idx, optimize=FEWEST_TRANSFERS, k=None):
+        if optimize not in RANKINGS:
+            raise ValueError(f"Unknown optimization: {optimize}")
+
+        self.graph = graph
+        self.origin_idx = origin_idx
+        self.destination_idx = destination_idx
+        self.k = k
+        ranking = RANKINGS[optimize]
+        # Position of each criterion in a heap entry
+        positions = [ranking.index(criterion) for criterion in range(3)]
+
+        # Labels by number: state slot, (transfers, stops, line changes), ride direction (0 right after boarding,
+        # otherwise -1 or +1 along the route), parent label
+        self.slots = []
+        self.costs = []
+        self.directions = []
+        self.parents = []
+
+        # Labels that reached the destination, best first
+        self.results = []
+
+        # Lower bounds on the transfers still needed from each route and the stops still needed from each stop;
+        # None where the destination can't be reached at all
+        transfers_left = self.__get_transfers_left()
+        stops_left = self.__get_stops_left()
+
+        # (slot, ridden since boarding) -> costs of the labels kept there
+        bags = {}
+        heap = []
+
+        def push(cost, slot, direction, parent):
+            route_bound = transfers_left[graph.slot_routes[slot]]
+            stop_bound = stops_left[graph.slot_stops[slot]] if stops_left is not None else 0
+            if route_bound is None or stop_bound is None:
+                return
+
+            # Labels are ordered and pruned by their cost plus what the rest of the way costs at least
+            bound = (cost[0] + route_bound, cost[1] + stop_bound, cost[2])
+            if k is None:
+                if any(dominates(self.costs[result], bound) for result in self.results):
+                    return
+            elif len(bags.get((slot, direction != 0), ())) >= k:
+                return
+
+            label = len(self.slots)
+            self.slots.append(slot)
+            self.costs.append(cost)
+            self.directions.append(direction)
+            self.parents.append(parent)
+            heapq.heappush(heap, (bound[ranking[0]], bound[ranking[1]], bound[ranking[2]], label))
+
+        for route_idx in graph.stop_routes[origin_idx]:
+            push((0, 0, 0), graph.get_slot(route_idx, origin_idx), 0, -1)
+
+        settled = 0
+        while heap:
+            *bound, label = heapq.heappop(heap)
+            slot = self.slots[label]
+            cost = self.costs[label]
+            direction = self.directions[label]
+
+            bag = bags.setdefault((slot, direction != 0), [])
+            if k is None:
+                bound = [bound[position] for position in positions]
+                if any(dominates(kept, cost) for kept in bag) or \
+                        any(dominates(self.costs[result], bound) for result in self.results):
+                    continue
+            elif len(bag) >= k:
+                continue
+            bag.append(cost)
+            settled += 1
+
+            stop_idx = graph.slot_stops[slot]
+            if stop_idx == destination_idx:
+                # Only arrivals on a ride count (or staying put, once): walking over to board a route at the
+                # destination isn't an itinerary of its own
+                if direction != 0 or (self.parents[label] == -1 and not self.results):
+                    self.results.append(label)
+                    if k is not None and len(self.results) >= k:
+                        break
+                continue
+
+            transfers, stops, line_changes = cost
+            route_idx = graph.slot_routes[slot]
+
+            # Ride on to the next stop, either way right after boarding
+            for step in ((-1, 1) if direction == 0 else (direction,)):
+                neighbour = slot + step
+                if graph.route_offsets[route_idx] <= neighbour < graph.route_offsets[route_idx + 1]:
+                    push((transfers, stops + 1, line_changes), neighbour, step, label)
+
+            if direction == 0:
+                continue
+
+            # Change to another route, at this stop or after a walk to a nearby one
+            line = graph.route_lines[route_idx]
+            for board_idx in (stop_idx, *graph.walk_stops[stop_idx]):
+                for other in graph.stop_routes[board_idx]:
+                    if other != route_idx:
+                        push(
+                            (transfers + 1, stops, line_changes + (graph.route_lines[other] != line)),
+                            graph.get_slot(other, board_idx), 0, label
+                        )
+
+        # Labels settled
+        self.expanded = settled
+
+
+    def __get_transfers_left(self):
+        """
+        Fewest transfers from each route to one serving the destination (a breadth-first search back from the
+        destination over the route graph)
+        """
+        graph = self.graph
+        distance = [None] * len(graph.route_names)
+
+        queue = deque()
+        for route_idx in graph.stop_routes[self.destination_idx]:
+            distance[route_idx] = 0
+            queue.append(route_idx)
+
+        # Transfers are symmetric, so the routes a route transfers to are also the ones transferring to it
+        while queue:
+            route_idx = queue.popleft()
+            for other in graph.transfer_routes[route_idx]:
+                if distance[other] is None:
+                    distance[other] = distance[route_idx] + 1
+                    queue.append(other)
+
+        return distance
+
+
+    def __get_stops_left(self):
+        """
+        Fewest stops ridden from each stop to the destination, changing routes for free (a 0-1 breadth-first search
+        back from the destination over stops). None when a route visits a stop twice, as a stop's slots then aren't
+        all listed and the bound could come out too high.
+        """
+        graph = self.graph
+        if len(graph.stop_routes.values) != len(graph.slot_routes):
+            return None
+
+        distance = [None] * len(graph.stop_names)
+        distance[self.destination_idx] = 0
+        queue = deque([self.destination_idx])
+        done = set()
+
+        while queue:
+            stop_idx = queue.popleft()
+            if stop_idx in done:
+                continue
+            done.add(stop_idx)
+            stops = distance[stop_idx]
+
+            for walk_idx in graph.walk_stops[stop_idx]:
+                if distance[walk_idx] is None or stops < distance[walk_idx]:
+                    distance[walk_idx] = stops
+                    queue.appendleft(walk_idx)
+
+            for slot in graph.stop_slots[stop_idx]:
+                route_idx = graph.slot_routes[slot]
+                for neighbour in (slot - 1, slot + 1):
+                    if graph.route_offsets[route_idx] <= neighbour < graph.route_offsets[route_idx + 1]:
+                        other = graph.slot_stops[neighbour]
+                        if distance[other] is None or stops + 1 < distance[other]:
+                            distance[other] = stops + 1
+                            queue.append(other)
+
+        return distance
+
+
+    @property
+    def depth(self) -> int:
+        """
+        Most transfers of any itinerary found
+        """
+        return max((self.costs[label][0] for label in self.results), default=0)
+
+
+    @property
+    def itineraries(self) -> list:
+        return [self.itinerary_for(label) for label in self.results]
+
+
+    def itinerary_for(self, label) -> Itinerary:
+        """
+        Rebuild the itinerary a label reached the destination with
+        """
+        path = []
+        while label != -1:
+            path.append(self.slots[label])
+            label = self.parents[label]
+        path.reverse()
+
+        graph = self.graph
+        hops = []
+        alight_idx = None
+        first = path[0]
+
+        # Every run of states on one route is a leg
+        for i, slot in enumerate(path):
+            route_idx = graph.slot_routes[slot]
+            if i + 1 < len(path) and graph.slot_routes[path[i + 1]] == route_idx:
+                continue
+
+            board_idx = graph.slot_stops[first]
+            if alight_idx is not None and alight_idx != board_idx:
+                hops.append((None, alight_idx, board_idx))
+
+            alight_idx = graph.slot_stops[slot]
+            hops.append((route_idx, board_idx, alight_idx))
+            if i + 1 < len(path):
+                first = path[i + 1]
+
+        return build_itinerary(graph, hops)
+
+
+def dominates(cost, other) -> bool:
+    """
+    Whether `cost` is at least as good as `other` on every criterion
+    """
+    return cost[0] <= other[0] and cost[1] <= other[1] and cost[2] <= other[2]
+
+
+def build_itinerary(graph, hops) -> Itinerary:
+    """
+    Convert (route index, board stop index, alight stop index) hops into an Itinerary. A hop without a route is a
+    walk.
+    """
+    legs = []
+    line_changes = 0
+    line = None
+
+    for route_idx, board_idx, alight_idx in hops:
+        if route_idx is None:
+            legs.append(Walk(
+                board=graph.stop_names[board_idx],
+                alight=graph.stop_names[alight_idx],
+                meters=graph.get_walk_meters(board_idx, alight_idx)
+            ))
+            continue
+
+        legs.append(Leg(
+            route=graph.route_names[route_idx],
+            board=graph.stop_names[board_idx],
+            alight=graph.stop_names[alight_idx],
+            stops=graph.ride_length(route_idx, board_idx, alight_idx)
+        ))
+
+        if line is not None and graph.route_lines[route_idx] != line:
+            line_changes += 1
+        line = graph.route_lines[route_idx]
+
+    return Itinerary(legs=legs, line_changes=line_changes)
+
+
+def search_from(graph, origin_idx, optimize=FEWEST_TRANSFERS):
+    """
+    One-to-all search from an origin stop index: call `itinerary_to()` on the result for as many destinations
+    as needed
+    """
+    if optimize == FEWEST_TRANSFERS:
+        return TransferSearch(graph, origin_idx)
+    elif optimize == FEWEST_STOPS:
+        return StopSearch(graph, origin_idx)
+    else:
+        raise ValueError(f"Unknown optimization: {optimize}")
+
+
+def search_between(graph, origin_idx, destination_idx, optimize=FEWEST_TRANSFERS):
+    """
+    Search from an origin stop index, stopping early once the destination is settled where the search allows it
+    """
+    if optimize == FEWEST_TRANSFERS:
+        return TransferSearch(graph, origin_idx)
+    elif optimize == FEWEST_STOPS:
+        return StopSearch(graph, origin_idx, destination_idx)
+    else:
+        raise ValueError(f"Unknown optimization: {optimize}")
+
+
+def plan(graph, origin_idx, destination_idx, optimize=FEWEST_TRANSFERS):
+    """
+    Find a single itinerary between two stop indexes, optimizing for fewest transfers or fewest stops
+    """
+    if not metrics.REGISTRY.enabled:
+        return search_between(graph, origin_idx, destination_idx, optimize).itinerary_to(destination_idx)
+
+    started = time.perf_counter()
+    search = search_between(graph, origin_idx, destination_idx, optimize)
+    itinerary = search.itinerary_to(destination_idx)
+
+    metrics.record_query(
+        "plan", graph.stop_names[origin_idx], graph.stop_names[destination_idx], f"optimize={optimize}", started,
+        search, itinerary is not None
+    )
+    return itinerary
+
+
+def plan_alternatives(graph, origin_idx, destination_idx, optimize=FEWEST_TRANSFERS, k=None) -> list:
+    """
+    Itineraries between two stop indexes that trade transfers, stops and line changes off against each other: the
+    Pareto set, or with `k` the k best, ranked by `optimize` (see `ParetoSearch`)
+    """
+    if not metrics.REGISTRY.enabled:
+        return ParetoSearch(graph, origin_idx, destination_idx, optimize, k).itineraries
+
+    started = time.perf_counter()
+    search = ParetoSearch(graph, origin_idx, destination_idx, optimize, k)
+    itineraries = search.itineraries
+
+    metrics.record_query(
+        "plan_alternatives", graph.stop_names[origin_idx], graph.stop_names[destination_idx],
+        f"optimize={optimize} k={k}", started, search, bool(itineraries)
+    )
+    return itineraries
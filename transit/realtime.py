@@ -0,0 +1,157 @@
+"""
+Live service state built from a real-time feed (see `transit/data_providers/streaming.py`).
+
+Only recent history is kept: every route has a fixed-size ring buffer of observed headways (the time between
+two vehicles of the route reaching the same stop) and of observed delays (predicted minus scheduled arrival).
+Everything else is keyed by route or bounded by an LRU, so memory stays flat no matter how long a feed runs.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+import statistics
+import threading
+import time
+
+from transit.lru import MISSING, LRUCache
+
+# Observations kept per route
+BUFFER_SIZE = 64
+
+# Observations older than this (seconds) no longer describe the current service
+MAX_AGE = 30 * 60
+
+# Vehicles, and (route, direction, stop) last arrivals, remembered at most
+MAX_VEHICLES = 5000
+MAX_STOP_ARRIVALS = 50000
+
+
+@dataclass
+class LiveStatus:
+    route: str
+    vehicles: int
+    # Median of the recent observations, in seconds (None without any)
+    headway: float = None
+    delay: float = None
+    observations: int = 0
+    # Epoch time of the latest observation
+    updated: float = None
+
+    @property
+    def expected_wait(self) -> float:
+        """
+        Average wait for the next vehicle when turning up at a random time, including how late it runs
+        """
+        if self.headway is None:
+            return None
+        return self.headway / 2 + max(self.delay or 0, 0)
+
+
+class RouteBuffer():
+    """
+    Ring buffers of one route's recent (time, headway) and (time, delay) observations
+    """
+    __slots__ = ("headways", "delays")
+
+    def __init__(self, size) -> None:
+        self.headways = deque(maxlen=size)
+        self.delays = deque(maxlen=size)
+
+
+class RealtimeState():
+    """
+    Thread-safe: a feed thread records observations while planners and request handlers read them.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE, max_age=MAX_AGE, clock=time.time) -> None:
+        self.buffer_size = buffer_size
+        self.max_age = max_age
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.routes = {}
+
+        # vehicle id -> (route, stop, status) of its latest update, and (route, direction, stop) -> (time, vehicle id)
+        # of the last arrival there
+        self.vehicles = LRUCache(MAX_VEHICLES)
+        self.stop_arrivals = LRUCache(MAX_STOP_ARRIVALS)
+
+
+    def __get_buffer(self, route):
+        buffer = self.routes.get(route)
+        if buffer is None:
+            buffer = self.routes[route] = RouteBuffer(self.buffer_size)
+        return buffer
+
+
+    def record_arrival(self, route, direction, stop, at, vehicle_id=None):
+        """
+        A vehicle of `route` reached `stop` at `at` (epoch seconds). The gap since the previous vehicle of the
+        route in the same direction reached the same stop is recorded as a headway, unless it was the same vehicle.
+        """
+        key = (route, direction, stop)
+        previous_at, previous_vehicle = self.stop_arrivals.get(key, (None, None))
+        if previous_at is not None and at <= previous_at:
+            # Repeated or out of order update for an arrival we've already seen
+            return
+
+        self.stop_arrivals.put(key, (at, vehicle_id))
+        if previous_at is not None and (vehicle_id is None or vehicle_id != previous_vehicle):
+            with self.lock:
+                self.__get_buffer(route).headways.append((at, at - previous_at))
+
+
+    def record_delay(self, route, delay, at=None):
+        """
+        A vehicle of `route` is predicted `delay` seconds after its schedule (negative when early)
+        """
+        with self.lock:
+            self.__get_buffer(route).delays.append((self.clock() if at is None else at, delay))
+
+
+    def set_vehicle(self, vehicle_id, route, direction=None, stop=None, status=None, at=None):
+        """
+        Latest position of a vehicle. It arrives at `stop` when it moves to STOPPED_AT there; further STOPPED_AT
+        updates while it dwells at the same stop are not new arrivals.
+        """
+        previous = self.vehicles.get(vehicle_id, None)
+        self.vehicles.put(vehicle_id, (route, stop, status))
+
+        if status == "STOPPED_AT" and stop is not None and previous != (route, stop, status):
+            self.record_arrival(route, direction, stop, self.clock() if at is None else at, vehicle_id)
+
+
+    def remove_vehicle(self, vehicle_id):
+        self.vehicles.pop(vehicle_id)
+
+
+    def clear_vehicles(self):
+        self.vehicles.clear()
+
+
+    def get_status(self, route) -> LiveStatus:
+        """
+        Recent service on a route, from observations no older than `max_age`
+        """
+        cutoff = self.clock() - self.max_age
+        with self.lock:
+            buffer = self.routes.get(route)
+            headways = [value for at, value in buffer.headways if at >= cutoff] if buffer else []
+            delays = [value for at, value in buffer.delays if at >= cutoff] if buffer else []
+            times = [at for at, _ in buffer.headways] + [at for at, _ in buffer.delays] if buffer else []
+
+        return LiveStatus(
+            route=route,
+            vehicles=sum(1 for vehicle_route, _, _ in self.vehicles.values() if vehicle_route == route),
+            headway=statistics.median(headways) if headways else None,
+            delay=statistics.median(delays) if delays else None,
+            observations=len(headways) + len(delays),
+            updated=max(times) if times else None
+        )
+
+
+    def get_routes(self) -> list:
+        """
+        Routes anything has been observed on
+        """
+        with self.lock:
+            return sorted(self.routes, key=str)
@@ -1,52 +1,270 @@
-from dataclasses import dataclass, field
-from functools import cache
 from transit.stop import Stop
 
-@dataclass
-class Route:
-    name: str
-    id: str
-    stops: list = field(default_factory=list)
-    line_name: str = field(default=None)
+# Direction ids, as in GTFS / the MBTA API
+OUTBOUND = 0
+INBOUND = 1
+
+
+class StopSequence():
+    """
+    One ordered stop sequence of a route (a pattern, e.g. one branch) in one direction, with a stop name ->
+    position index so finding a stop on it never scans the sequence.
+
+    Providers can return a list of these from `get_stops_for_route()` for routes that don't run along a single
+    line of stops; a plain list of stops is one outbound sequence.
+    """
+    __slots__ = ("direction", "stops", "positions")
+
+    def __init__(self, stops=None, direction=OUTBOUND) -> None:
+        self.direction = direction
+        self.stops = []
+        # (a stop visited twice keeps its first position)
+        self.positions = {}
+
+        for stop in stops or ():
+            self.append(stop)
+
+
+    def append(self, stop : Stop):
+        self.positions.setdefault(stop.name, len(self.stops))
+        self.stops.append(stop)
+
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.direction, self.stops) == (other.direction, other.stops)
+
+
+    def __repr__(self):
+        return f"StopSequence(stops={self.stops!r}, direction={self.direction!r})"
+
+
+def to_sequences(stops) -> list:
+    """
+    A provider's stops for a route (see `BaseDataProvider.get_stops_for_route()`) as a list of StopSequences
+    """
+    stops = list(stops)
+    if not stops:
+        return []
+    if isinstance(stops[0], StopSequence):
+        return [sequence for sequence in stops if sequence.stops]
+    return [StopSequence(stops)]
+
+
+def is_stretch_of(sequence, other) -> bool:
+    """
+    Whether `sequence` appears in `other` as consecutive items (a pattern that runs along a stretch of another one,
+    e.g. a short turn, adds no rides of its own)
+    """
+    length = len(sequence)
+    return any(other[i:i + length] == sequence for i in range(len(other) - length + 1))
+
+
+class Route():
+    """
+    A route and its stops in travel order.
+
+    A route has one or more stop sequences (`sequences`): one per pattern and direction, so a branched route never
+    has a branch's last stop followed by another branch's first. A direction the route has no sequences for is
+    ridden along its other direction's sequences reversed. `stops` are the route's distinct stops, in sequence
+    order. Stops are identified by name, as everywhere in a `Network`.
+    """
+    __slots__ = ("name", "id", "stops", "stop_names", "line_name", "sequences")
+
+    def __init__(self, name, id, stops=None, line_name=None) -> None:
+        self.name = name
+        self.id = id
+        self.line_name = line_name
+
+        # Distinct stops, plus their names so membership checks don't scan the list
+        self.stops = []
+        self.stop_names = set()
+
+        self.sequences = []
+
+        for stop in stops or ():
+            self.add_stop(stop)
+
+
+    def add_stop(self, stop : Stop):
+        """
+        Append a stop to the route's last sequence, starting an outbound one if there is none (always go through
+        this or `add_sequence()` rather than `stops.append()`)
+        """
+        if not self.sequences:
+            self.sequences.append(StopSequence())
+        self.sequences[-1].append(stop)
+
+        if stop.name not in self.stop_names:
+            self.stops.append(stop)
+            self.stop_names.add(stop.name)
+
+
+    def add_sequence(self, stops, direction=OUTBOUND):
+        """
+        Add a stop sequence (a pattern) in a direction. Empty sequences are ignored.
+        """
+        stops = list(stops)
+        if not stops:
+            return
+
+        self.sequences.append(StopSequence(direction=direction))
+        for stop in stops:
+            self.add_stop(stop)
+
+
+    def get_sequences(self, direction=OUTBOUND) -> list:
+        """
+        Stop lists in travel order for a direction, one per sequence
+        """
+        return [
+            sequence.stops[::-1] if reverse else sequence.stops for sequence, reverse in self.__get_rides(direction)
+        ]
+
+
+    def get_stops(self, direction=OUTBOUND) -> list:
+        """
+        Stops in travel order for a direction, along the route's first sequence
+        """
+        sequences = self.get_sequences(direction)
+        return sequences[0] if sequences else []
+
+
+    def get_position(self, stop : Stop, direction=OUTBOUND):
+        """
+        Position of a stop along the first sequence serving it in a direction, None if the route doesn't serve it
+        """
+        for sequence, reverse in self.__get_rides(direction):
+            position = get_sequence_position(sequence, stop, reverse)
+            if position is not None:
+                return position
+
+        return None
+
+
+    def get_direction(self, origin : Stop, destination : Stop):
+        """
+        The direction in which the route goes from `origin` to `destination`, None if it doesn't serve both
+        """
+        ride = self.__find_ride(origin, destination)
+        return ride[0] if ride is not None else None
+
+
+    def get_stops_between(self, origin : Stop, destination : Stop) -> list:
+        """
+        Stops ridden through from `origin` to `destination` (both included), in travel order
+        """
+        ride = self.__find_ride(origin, destination)
+        if ride is None:
+            return []
+
+        _, sequence, reverse, board, alight = ride
+        if reverse:
+            last = len(sequence.stops) - 1
+            return sequence.stops[last - alight:last - board + 1][::-1]
+        return sequence.stops[board:alight + 1]
+
+
+    def get_ride_length(self, origin : Stop, destination : Stop):
+        """
+        Number of stops travelled from `origin` to `destination`, None if the route doesn't take you there
+        """
+        ride = self.__find_ride(origin, destination)
+        if ride is None:
+            return None
+
+        *_, board, alight = ride
+        return alight - board
+
+
+    def __find_ride(self, origin, destination):
+        """
+        Shortest ride from `origin` to `destination` along one sequence: (direction, sequence, reversed, board
+        position, alight position), or None
+        """
+        best = None
+
+        for direction in (OUTBOUND, INBOUND):
+            for sequence, reverse in self.__get_rides(direction):
+                board = get_sequence_position(sequence, origin, reverse)
+                alight = get_sequence_position(sequence, destination, reverse)
+
+                if board is not None and alight is not None and board < alight:
+                    if best is None or alight - board < best[4] - best[3]:
+                        best = (direction, sequence, reverse, board, alight)
+
+        return best
+
+
+    def __get_rides(self, direction):
+        """
+        (sequence, reversed) for every sequence ridden in a direction: the route's own sequences in that
+        direction, or if it has none, its other sequences ridden backwards
+        """
+        own = [(sequence, False) for sequence in self.sequences if sequence.direction == direction]
+        return own or [(sequence, True) for sequence in self.sequences]
 
 
     def has_stop(self, stop : Stop) -> bool:
         """
         Check if this route contains the provided stop
         """
-        if stop in self.stops:
-            return True
-        return False
+        return stop.name in self.stop_names
     
 
-    def has_stops(self, stop1, stop2):
+    def has_stops(self, *stops):
         """
-        Check if this route contains both stops (we could probably make this accept *args)
+        Check if this route contains all of the provided stops
         """
-        return self.has_stop(stop1) and self.has_stop(stop2)
+        return all(stop.name in self.stop_names for stop in stops)
        
 
     def get_connecting_stops(self):
         """
         Return a list of stops for this route which are associated with multiple routes
         """
-        results = []
-        for stop in self.stops:
-            if stop.is_associated_with_multiple_routes():
-                results.append(stop)
-        return results
+        return [stop for stop in self.stops if stop.is_associated_with_multiple_routes()]
 
 
     def get_connecting_routes(self):
         """
         Look through the list of stops to find all routes that are adjacent
         """
-        results = []
+        # dict keys keep first-seen order and make the de-duplication O(1)
+        results = {}
 
         for stop in self.stops:
             if stop.is_associated_with_multiple_routes():
                 for associated_route in stop.route_associations:
-                    if associated_route not in results and associated_route != self.name:
-                        results.append(associated_route)
+                    if associated_route != self.name:
+                        results[associated_route] = None
+
+        return list(results)
+
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (
+            (self.name, self.id, self.line_name, self.sequences) ==
+            (other.name, other.id, other.line_name, other.sequences)
+        )
+
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+    def __repr__(self):
+        return f"Route(name={self.name!r}, id={self.id!r}, stops={self.stops!r}, line_name={self.line_name!r})"
+
 
-        return results
+def get_sequence_position(sequence, stop, reverse=False):
+    """
+    Position of a stop along a sequence, or along it ridden backwards
+    """
+    position = sequence.positions.get(stop.name)
+    if position is None or not reverse:
+        return position
+    return len(sequence.stops) - 1 - position
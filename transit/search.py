@@ -0,0 +1,215 @@
+from collections import Counter
+from dataclasses import dataclass
+import re
+import unicodedata
+
+# Common spellings and abbreviations normalized to one form, so "Park St" and "Park Street" are the same tokens
+SYNONYMS = {
+    "street": "st",
+    "saint": "st",
+    "square": "sq",
+    "center": "ctr",
+    "centre": "ctr",
+    "avenue": "ave",
+    "av": "ave",
+    "station": "sta",
+    "road": "rd",
+    "mount": "mt",
+    "boulevard": "blvd",
+    "and": "&",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9&]+")
+
+
+@dataclass
+class StopMatch:
+    name: str
+    score: float
+
+
+def normalize(text) -> tuple:
+    """
+    Lowercase, strip accents and punctuation, and canonicalize abbreviations; returns the tokens
+    """
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return tuple(SYNONYMS.get(token, token) for token in TOKEN_PATTERN.findall(text))
+
+
+def get_trigrams(text) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def get_edit_distance(a, b, limit) -> int:
+    """
+    Levenshtein distance, giving up (returning `limit + 1`) as soon as it must exceed `limit`
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+
+    return previous[-1]
+
+
+class StopNameIndex():
+    """
+    Search index over stop names, built once per network.
+
+    * every name is reduced to normalized tokens (see `normalize()`)
+    * a prefix table (a flattened trie: token prefix -> names) answers autocomplete-style queries: every query
+      token has to start some token of the name, in any order ("kendall", "park st", "harvard sq")
+    * a trigram index finds candidates for misspelled queries, which are then ranked by edit distance
+
+    Prefix postings are kept shortest name first. A prefix match scores higher the more of the name the query
+    covers, so the best `limit` matches are simply the first ones found and a broad query ("st") never has to
+    look at every stop. Fuzzy matching only runs when nothing matches by prefix.
+    """
+    # A prefix match scores PREFIX_SCORE plus up to 0.19 for how much of the name the query covers. Matches covering
+    # at least half of the name are considered safe to use without asking the user (see `get_best_match()`), as
+    # long as the query has at least MIN_QUERY_LENGTH characters and the next best match scores MIN_SCORE_GAP less.
+    PREFIX_SCORE = 0.8
+    CONFIDENT_SCORE = PREFIX_SCORE + 0.19 * 0.5
+    MIN_QUERY_LENGTH = 3
+    MIN_SCORE_GAP = 0.05
+    # Fuzzy candidates (by shared trigrams) that get the more expensive edit distance check
+    MAX_FUZZY_CANDIDATES = 50
+    # Trigrams found in more than this share of names (" st", "ave") say little and cost a lot to count
+    COMMON_TRIGRAM_SHARE = 0.05
+
+    def __init__(self, names) -> None:
+        self.names = list(names)
+        self.normalized = []
+        self.exact = {}
+        prefixes = {}
+        self.trigrams = {}
+
+        for name_idx, name in enumerate(self.names):
+            tokens = normalize(name)
+            text = " ".join(tokens)
+            self.normalized.append(text)
+            self.exact.setdefault(text, name_idx)
+
+            for token in set(tokens):
+                for end in range(1, len(token) + 1):
+                    prefixes.setdefault(token[:end], []).append(name_idx)
+
+            for trigram in get_trigrams(text):
+                self.trigrams.setdefault(trigram, []).append(name_idx)
+
+        def rank(name_idx):
+            return (len(self.normalized[name_idx]), self.names[name_idx])
+
+        # prefix -> names ordered by rank, and the same names as a set for intersections
+        self.prefix_lists = {prefix: sorted(postings, key=rank) for prefix, postings in prefixes.items()}
+        self.prefix_sets = {prefix: set(postings) for prefix, postings in prefixes.items()}
+
+        self.common_trigram_count = max(len(self.names) * self.COMMON_TRIGRAM_SHARE, self.MAX_FUZZY_CANDIDATES)
+
+
+    def search(self, query, limit=10) -> list:
+        """
+        Ranked matches for a (partial, possibly misspelled) stop name, best first
+        """
+        tokens = normalize(query)
+        if not tokens:
+            return []
+
+        text = " ".join(tokens)
+        scores = {}
+
+        if text in self.exact:
+            scores[self.exact[text]] = 1.0
+
+        for name_idx in self.__get_prefix_matches(tokens, limit):
+            # Prefer names that the query covers more completely
+            coverage = len(text) / max(len(self.normalized[name_idx]), 1)
+            scores.setdefault(name_idx, self.PREFIX_SCORE + 0.19 * min(coverage, 1.0))
+
+        if not scores:
+            for name_idx, score in self.__get_fuzzy_matches(text):
+                scores[name_idx] = score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.names[item[0]]))
+        return [StopMatch(name=self.names[name_idx], score=round(score, 3)) for name_idx, score in ranked[:limit]]
+
+
+    def get_best_match(self, query):
+        """
+        The single stop a query refers to, or None if there's no confident, unambiguous match: the query has to
+        name the stop exactly, or be a prefix match that covers most of the name and clearly beats the runner-up
+        ("ken" is as much Kendall/MIT as Kenmore)
+        """
+        matches = self.search(query, limit=2)
+        if not matches:
+            return None
+
+        best = matches[0]
+        if best.score == 1.0:
+            return best.name
+
+        if len(" ".join(normalize(query))) < self.MIN_QUERY_LENGTH or best.score < self.CONFIDENT_SCORE:
+            return None
+        if len(matches) > 1 and best.score - matches[1].score < self.MIN_SCORE_GAP:
+            return None
+        return best.name
+
+
+    def __get_prefix_matches(self, tokens, limit):
+        """
+        The `limit` best-ranked names in which every token prefixes some token of the name
+        """
+        prefixes = set(tokens)
+        for prefix in prefixes:
+            if prefix not in self.prefix_sets:
+                return []
+
+        # Walk the shortest posting list in rank order, checking the others by membership
+        ordered = sorted(prefixes, key=lambda prefix: len(self.prefix_sets[prefix]))
+        others = [self.prefix_sets[prefix] for prefix in ordered[1:]]
+
+        matches = []
+        for name_idx in self.prefix_lists[ordered[0]]:
+            if all(name_idx in other for other in others):
+                matches.append(name_idx)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+    def __get_fuzzy_matches(self, text):
+        """
+        Candidates sharing the most trigrams with the query, scored by edit distance over the length
+        """
+        postings = [self.trigrams[t] for t in get_trigrams(text) if t in self.trigrams]
+        selective = [p for p in postings if len(p) <= self.common_trigram_count]
+
+        shared = Counter()
+        for posting in selective or postings:
+            shared.update(posting)
+
+        # Allow roughly one typo per four characters
+        limit = max(1, len(text) // 4)
+
+        matches = []
+        for name_idx, _ in shared.most_common(self.MAX_FUZZY_CANDIDATES):
+            candidate = self.normalized[name_idx]
+            distance = get_edit_distance(text, candidate, limit)
+
+            if distance <= limit:
+                matches.append((name_idx, 0.79 * (1 - distance / max(len(text), len(candidate)))))
+            elif len(candidate) > len(text):
+                # A misspelled prefix of a longer name ("kendal" -> "kendall mit")
+                distance = get_edit_distance(text, candidate[:len(text)], limit)
+                if distance <= limit:
+                    matches.append((name_idx, 0.7 * (1 - distance / len(text))))
+
+        return matches
@@ -0,0 +1,442 @@
+"""
+Long-running HTTP query service over a `TransitMap`.
+
+The network is loaded once at startup and every request reads whatever network is current (see `Network`), so
+one warm process answers any number of concurrent queries. Requests are handled on an asyncio event loop; route
+planning, the only CPU-heavy part, runs in a worker pool so it never blocks other requests. Planned responses
+for hot origin / destination pairs are kept in a small LRU cache keyed by network version.
+
+    GET /routes
+    GET /stops[?q=<partial name>&limit=<n>]
+    GET /stops/nearest?lat=<latitude>&lon=<longitude>[&k=<n>&max_distance=<meters>]
+    GET /connecting-stops
+    GET /stats
+    GET /plan?origin=<stop>&destination=<stop>[&optimize=transfers|stops]
+    GET /plan/alternatives?origin=<stop>&destination=<stop>[&optimize=transfers|stops&k=<n>]
+        (the Pareto set over transfers, stops and line changes, or the k best itineraries)
+    GET /live[?route=<route name>]  (real-time headways and delays, see `transit/realtime.py`)
+    GET /metrics            (Prometheus text format, see `transit/metrics.py`)
+    GET /health
+
+Only the standard library is used: a minimal HTTP/1.1 implementation (GET, keep-alive) on `asyncio.start_server`.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from transit import metrics
+from transit import planner
+from transit.lru import LRUCache
+from transit.system import UnknownStopError
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+JSON_CONTENT_TYPE = "application/json"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class HTTPError(Exception):
+    def __init__(self, status, payload) -> None:
+        super().__init__(payload)
+        self.status = status
+        self.payload = payload
+
+
+class TransitService():
+    # Planned responses kept for hot origin / destination pairs
+    CACHE_SIZE = 4096
+    # Largest request line / header accepted
+    MAX_LINE = 16384
+
+    def __init__(self, transit_map, workers=0, cache_size=CACHE_SIZE) -> None:
+        """
+        `workers` processes plan routes; with 0, planning runs on a thread next to the event loop instead (no
+        parallelism, but no process start-up or copy of the graph either).
+        """
+        self.transit_map = transit_map
+        self.workers = workers
+        self.cache = LRUCache(cache_size)
+        self.server = None
+
+        # Open connections and the tasks serving them, so `stop()` can close idle keep-alive connections
+        self.connections = {}
+
+        # (network, executor): a process pool holds a copy of one network's graph, so it is replaced along with it
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+        self.handlers = {
+            "/routes": self.get_routes,
+            "/stops": self.get_stops,
+            "/stops/nearest": self.get_nearest_stops,
+            "/connecting-stops": self.get_connecting_stops,
+            "/stats": self.get_stats,
+            "/plan": self.plan,
+            "/plan/alternatives": self.plan_alternatives,
+            "/live": self.get_live,
+            "/metrics": self.get_metrics,
+            "/health": self.get_health,
+        }
+
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Load the network and start listening; returns the asyncio server
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.transit_map.load_stops)
+
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=self.MAX_LINE)
+        return self.server
+
+
+    async def serve_forever(self, host="127.0.0.1", port=8080):
+        server = await self.start(host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop()
+
+
+    async def stop(self):
+        """
+        Stop listening, close open connections and wait for their handlers to finish
+        """
+        self.close()
+
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+
+
+    def close(self):
+        """
+        Stop listening and shut the worker pool down (connections in progress are left alone, see `stop()`)
+        """
+        if self.server is not None:
+            self.server.close()
+
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool[1].shutdown(wait=False)
+                self.pool = None
+
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve requests on one connection until the client closes it or asks us to
+        """
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                # Nothing here takes a body, but don't let one be parsed as the next request
+                length = int(headers.get("content-length") or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    status, content_type, body = self.__encode(400, {"error": "Malformed request line"})
+                    keep_alive = False
+                else:
+                    method, target, version = parts
+                    status, content_type, body = await self.dispatch(method, target)
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+                head = (
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n"
+                )
+                writer.write(head.encode("latin-1") + body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+
+    async def dispatch(self, method, target):
+        """
+        Route a request to its handler, returns (status, content type, body bytes)
+        """
+        url = urlsplit(target)
+        handler = self.handlers.get(url.path.rstrip("/") or "/")
+
+        if handler is None:
+            return self.__encode(404, {"error": f"Unknown path: {url.path}"})
+        if method != "GET":
+            return self.__encode(405, {"error": f"Method not allowed: {method}"})
+
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        try:
+            result = handler(query)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except HTTPError as e:
+            return self.__encode(e.status, e.payload)
+        except Exception as e:
+            return self.__encode(500, {"error": str(e)})
+
+        if isinstance(result, tuple):
+            # Already encoded (e.g. from the response cache)
+            return result
+        return self.__encode(200, result)
+
+
+    def __encode(self, status, payload):
+        if isinstance(payload, str):
+            return status, METRICS_CONTENT_TYPE, payload.encode("utf-8")
+        return status, JSON_CONTENT_TYPE, json.dumps(payload).encode("utf-8")
+
+
+    def get_routes(self, query):
+        network = self.transit_map.network
+        return [
+            {"name": route.name, "id": route.id, "line": route.line_name, "stops": len(route.stops)}
+            for route in sorted(network.routes.values(), key=lambda route: route.name)
+        ]
+
+
+    def get_stops(self, query):
+        network = self.transit_map.network
+
+        if "q" in query:
+            limit = self.__get_int(query, "limit", 10)
+            return [asdict(match) for match in network.stop_search.search(query["q"], limit)]
+
+        return [
+            {"name": stop.name, "id": stop.id, "routes": list(stop.route_associations)}
+            for stop in sorted(network.stops.values(), key=lambda stop: stop.name)
+        ]
+
+
+    def get_nearest_stops(self, query):
+        latitude = self.__get_float(query, "lat")
+        longitude = self.__get_float(query, "lon")
+        max_distance = self.__get_float(query, "max_distance") if "max_distance" in query else None
+
+        return [
+            {"name": stop.name, "id": stop.id, "meters": round(meters, 1)}
+            for stop, meters in self.transit_map.get_nearest_stops(
+                latitude, longitude, self.__get_int(query, "k", 1), max_distance
+            )
+        ]
+
+
+    def get_connecting_stops(self, query):
+        return {name: list(routes) for name, routes in sorted(self.transit_map.get_connecting_stops().items())}
+
+
+    def get_stats(self, query):
+        return {
+            "most_stops": [list(stat) for stat in self.transit_map.get_routes_with_most_stops()],
+            "least_stops": [list(stat) for stat in self.transit_map.get_routes_with_least_stops()],
+            "stop_degrees": self.transit_map.get_stop_degree_histogram(),
+            "lines": [asdict(stats) for stats in self.transit_map.get_line_stats()],
+        }
+
+
+    def get_live(self, query):
+        realtime = self.transit_map.realtime
+        if realtime is None:
+            raise HTTPError(404, {"error": "No real-time feed"})
+
+        if "route" in query:
+            if query["route"] not in self.transit_map.network.routes:
+                raise HTTPError(404, {"error": f"Unknown route: {query['route']}"})
+            return asdict(realtime.get_status(query["route"]))
+
+        return [asdict(realtime.get_status(route)) for route in realtime.get_routes()]
+
+
+    def get_metrics(self, query):
+        return metrics.REGISTRY.render()
+
+
+    def get_health(self, query):
+        network = self.transit_map.network
+        return {
+            "status": "ok",
+            "version": network.version,
+            "routes": len(network.routes),
+            "stops": len(network.stops),
+            "plan_cache": asdict(self.cache.stats),
+        }
+
+
+    async def plan(self, query):
+        return await self.__plan(query, _plan, _plan_in_worker)
+
+
+    async def plan_alternatives(self, query):
+        k = self.__get_int(query, "k", 0) if "k" in query else None
+        if k is not None and k < 1:
+            raise HTTPError(400, {"error": f"Invalid k: {query['k']}"})
+
+        return await self.__plan(query, _plan_alternatives, _plan_alternatives_in_worker, k)
+
+
+    async def __plan(self, query, function, worker_function, *options):
+        """
+        Run a planner function (on the graph, or by its worker process version) for the origin / destination in
+        the query, answering hot pairs from the response cache
+        """
+        optimize = query.get("optimize", planner.FEWEST_TRANSFERS)
+        if optimize not in (planner.FEWEST_TRANSFERS, planner.FEWEST_STOPS):
+            raise HTTPError(400, {"error": f"Unknown optimization: {optimize}"})
+
+        network = self.transit_map.network
+        origin = self.__get_stop(network, query, "origin")
+        destination = self.__get_stop(network, query, "destination")
+
+        key = (network.version, function.__name__, origin.name, destination.name, optimize, *options)
+        cached = self.cache.get(key, None)
+        if cached is not None:
+            return cached
+
+        graph = network.graph
+        origin_idx = graph.stop_index[origin.name]
+        destination_idx = graph.stop_index[destination.name]
+
+        loop = asyncio.get_running_loop()
+        executor = self.__get_executor(network)
+        if self.workers > 0:
+            result = await loop.run_in_executor(
+                executor, worker_function, origin_idx, destination_idx, optimize, *options
+            )
+        else:
+            result = await loop.run_in_executor(
+                executor, function, graph, origin_idx, destination_idx, optimize, *options
+            )
+
+        if not result:
+            response = self.__encode(404, {
+                "origin": origin.name, "destination": destination.name, "error": "No route found"
+            })
+        else:
+            response = self.__encode(200, dict(
+                {"origin": origin.name, "destination": destination.name, "optimize": optimize}, **result
+            ))
+
+        self.cache.put(key, response)
+        return response
+
+
+    def __get_stop(self, network, query, parameter):
+        if not query.get(parameter):
+            raise HTTPError(400, {"error": f"Missing parameter: {parameter}"})
+
+        try:
+            return self.transit_map.get_stop_from_string(query[parameter])
+        except UnknownStopError:
+            suggestions = [match.name for match in network.stop_search.search(query[parameter], limit=3)]
+            raise HTTPError(404, {"error": "Unknown Stop!", parameter: query[parameter], "suggestions": suggestions})
+
+
+    def __get_int(self, query, parameter, default):
+        try:
+            return int(query.get(parameter, default))
+        except ValueError:
+            raise HTTPError(400, {"error": f"Invalid {parameter}: {query[parameter]}"})
+
+
+    def __get_float(self, query, parameter):
+        if parameter not in query:
+            raise HTTPError(400, {"error": f"Missing parameter: {parameter}"})
+        try:
+            return float(query[parameter])
+        except ValueError:
+            raise HTTPError(400, {"error": f"Invalid {parameter}: {query[parameter]}"})
+
+
+    def __get_executor(self, network):
+        with self.pool_lock:
+            if self.pool is not None and (self.workers == 0 or self.pool[0] is network):
+                return self.pool[1]
+
+            if self.pool is not None:
+                # Queries already submitted to the old pool still finish
+                self.pool[1].shutdown(wait=False)
+
+            if self.workers > 0:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker, initargs=(network.graph,)
+                )
+            else:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="planner")
+
+            self.pool = (network, executor)
+            return executor
+
+
+def itinerary_to_dict(itinerary) -> dict:
+    return {
+        "routes": itinerary.routes,
+        "transfers": itinerary.transfers,
+        "stops": itinerary.stops,
+        "line_changes": itinerary.line_changes,
+        "legs": [asdict(leg) for leg in itinerary.legs],
+    }
+
+
+def _plan(graph, origin_idx, destination_idx, optimize):
+    itinerary = planner.plan(graph, origin_idx, destination_idx, optimize)
+    return None if itinerary is None else itinerary_to_dict(itinerary)
+
+
+def _plan_alternatives(graph, origin_idx, destination_idx, optimize, k):
+    itineraries = planner.plan_alternatives(graph, origin_idx, destination_idx, optimize, k)
+    return {"itineraries": [itinerary_to_dict(itinerary) for itinerary in itineraries]} if itineraries else None
+
+
+# Set in each worker process by `_init_worker()`
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _plan_in_worker(origin_idx, destination_idx, optimize):
+    return _plan(_worker_graph, origin_idx, destination_idx, optimize)
+
+
+def _plan_alternatives_in_worker(origin_idx, destination_idx, optimize, k):
+    return _plan_alternatives(_worker_graph, origin_idx, destination_idx, optimize, k)
@@ -0,0 +1,313 @@
+"""
+Versioned binary snapshot of a loaded network.
+
+    header      magic, format version, route / stop / slot counts
+    sections    (offset, length) of every section below, in order
+    ...         8-byte aligned sections: the string table, the route and stop tables, and the graph's CSR arrays
+
+All integers are little-endian unsigned 32-bit. Loading maps the file read-only and hands `TransitGraph`
+memoryviews straight into the mapping, so opening a snapshot costs next to nothing and every process that
+opens the same file shares one copy of the arrays through the page cache.
+"""
+
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+from transit.graph import CSR, TransitGraph
+from transit.route import Route, StopSequence
+from transit.stop import Stop
+
+MAGIC = b"TMAP"
+VERSION = 4
+
+HEADER = struct.Struct("<4sIIII")
+SECTION = struct.Struct("<QQ")
+
+SECTIONS = (
+    "string_offsets",       # string count + 1
+    "string_data",          # utf-8 bytes
+    "route_table",          # (name, id, line name) string numbers and direction per graph route (stop sequence)
+    "route_lines",          # line number per route
+    "stop_table",           # (name, id, [latitude, longitude]) string numbers per stop
+    "route_stop_offsets",
+    "route_stop_values",
+    "slot_routes",
+    "stop_route_offsets",
+    "stop_route_values",
+    "stop_slot_values",     # shares stop_route_offsets
+    "transfer_offsets",
+    "transfer_route_values",
+    "transfer_stop_values", # shares transfer_offsets
+    "transfer_board_values",# shares transfer_offsets
+    "walk_offsets",
+    "walk_stop_values",
+    "walk_meter_values",    # shares walk_offsets
+)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(path, routes, graph):
+    """
+    Write a snapshot of the routes (in graph order, each route once) and their graph. The file is written next
+    to `path` and renamed into place, so processes that have the previous snapshot mapped never see a partly
+    written file.
+    """
+    routes = list(routes)
+    strings = StringTableBuilder()
+    stops = {}
+    for route in routes:
+        for stop in route.stops:
+            stops.setdefault(stop.name, stop)
+
+    if len(stops) != len(graph.stop_names):
+        # The graph still numbers stops no route serves any more: renumber without them
+        graph = TransitGraph.from_routes(routes, walks=graph.get_walks())
+
+    route_table = array("I")
+    for route in routes:
+        # One row per graph route, like `TransitGraph.from_routes()` numbers them
+        for sequence in route.sequences or [StopSequence()]:
+            route_table.extend((
+                strings.add(route.name),
+                strings.add_value(route.id),
+                strings.add_value(route.line_name),
+                sequence.direction
+            ))
+
+    stop_table = array("I")
+    for name in graph.stop_names:
+        stop = stops[name]
+        location = [stop.latitude, stop.longitude] if stop.has_location else None
+        stop_table.extend((strings.add(name), strings.add_value(stop.id), strings.add_value(location)))
+
+    string_offsets, string_data = strings.build()
+
+    sections = {
+        "string_offsets": string_offsets,
+        "string_data": string_data,
+        "route_table": route_table,
+        "route_lines": graph.route_lines,
+        "stop_table": stop_table,
+        "route_stop_offsets": graph.route_stops.offsets,
+        "route_stop_values": graph.route_stops.values,
+        "slot_routes": graph.slot_routes,
+        "stop_route_offsets": graph.stop_routes.offsets,
+        "stop_route_values": graph.stop_routes.values,
+        "stop_slot_values": graph.stop_slots.values,
+        "transfer_offsets": graph.transfer_routes.offsets,
+        "transfer_route_values": graph.transfer_routes.values,
+        "transfer_stop_values": graph.transfer_stops.values,
+        "transfer_board_values": graph.transfer_boards.values,
+        "walk_offsets": graph.walk_stops.offsets,
+        "walk_stop_values": graph.walk_stops.values,
+        "walk_meter_values": graph.walk_meters,
+    }
+
+    payloads = [to_bytes(sections[name]) for name in SECTIONS]
+
+    position = align(HEADER.size + SECTION.size * len(SECTIONS))
+    table = []
+    for payload in payloads:
+        table.append((position, len(payload)))
+        position = align(position + len(payload))
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(graph.route_names), len(graph.stop_names), len(graph.slot_routes)))
+            for offset, length in table:
+                f.write(SECTION.pack(offset, length))
+
+            for (offset, length), payload in zip(table, payloads):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(payload)
+
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def read_snapshot(path):
+    """
+    Map a snapshot, returns (routes, stops, graph): Route / Stop objects keyed by name like `TransitMap`
+    holds them, and a graph backed by the mapped file
+    """
+    graph, route_table, stop_table, get_value = map_snapshot(path)
+    route_names = graph.route_names
+    stop_names = graph.stop_names
+
+    stops = {}
+    for s, name in enumerate(stop_names):
+        # (left in the numbering of graphs written before route-less stops were dropped)
+        if not len(graph.stop_routes[s]):
+            continue
+        location = get_value(stop_table[3 * s + 2]) or (None, None)
+        stop = Stop(name=name, id=get_value(stop_table[3 * s + 1]), latitude=location[0], longitude=location[1])
+        for route_idx in graph.stop_routes[s]:
+            stop.add_route_association(route_names[route_idx])
+        stops[name] = stop
+
+    routes = {}
+    for r, name in enumerate(route_names):
+        # A route's sequences are consecutive graph routes
+        route = routes.get(name)
+        if route is None:
+            route = routes[name] = Route(
+                name=name,
+                id=get_value(route_table[4 * r + 1]),
+                line_name=get_value(route_table[4 * r + 2])
+            )
+        route.add_sequence((stops[stop_names[stop_idx]] for stop_idx in graph.route_stops[r]), route_table[4 * r + 3])
+
+    return routes, stops, graph
+
+
+def read_graph(path, fingerprint=None):
+    """
+    Map only the planner graph of a snapshot. Given the `get_fingerprint()` of the file that is expected, raises
+    SnapshotError if the file has been replaced since.
+    """
+    return map_snapshot(path, fingerprint)[0]
+
+
+def get_fingerprint(path):
+    """
+    (inode, size, modification time) of a snapshot file, which change whenever it is rewritten (see
+    `write_snapshot()`). None if there's no such file.
+    """
+    try:
+        return stat_fingerprint(os.stat(path))
+    except OSError:
+        return None
+
+
+def stat_fingerprint(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def map_snapshot(path, fingerprint=None):
+    """
+    Map the file and build the graph over it, returns (graph, route table, stop table, function decoding the
+    id / line name strings the tables refer to)
+    """
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        mapped_fingerprint = stat_fingerprint(stat)
+        if fingerprint is not None and tuple(fingerprint) != mapped_fingerprint:
+            raise SnapshotError(f"{path} has been rewritten since it was mapped")
+
+        # Too short for the header and section table (and mmap refuses an empty file with a ValueError)
+        if stat.st_size < HEADER.size + SECTION.size * len(SECTIONS):
+            raise SnapshotError(f"{path} is not a transit map snapshot")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, route_count, stop_count, slot_count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not a transit map snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"{path} is snapshot version {version}, expected {VERSION}")
+    if sys.byteorder != "little":
+        # The arrays are used in place, which only works when they're already in native byte order
+        raise SnapshotError("Snapshots can only be mapped on little-endian machines")
+
+    view = memoryview(buffer)
+    sections = {}
+    for i, name in enumerate(SECTIONS):
+        offset, length = SECTION.unpack_from(buffer, HEADER.size + SECTION.size * i)
+        if offset + length > len(buffer):
+            raise SnapshotError(f"{path} is truncated")
+        section = view[offset:offset + length]
+        sections[name] = section if name == "string_data" else section.cast("I")
+
+    string_offsets = sections["string_offsets"]
+    string_data = sections["string_data"]
+
+    def get_string(number):
+        return str(string_data[string_offsets[number]:string_offsets[number + 1]], "utf-8")
+
+    def get_value(number):
+        return json.loads(get_string(number))
+
+    route_table = sections["route_table"]
+    stop_table = sections["stop_table"]
+
+    route_names = [get_string(route_table[4 * r]) for r in range(route_count)]
+    stop_names = [get_string(stop_table[3 * s]) for s in range(stop_count)]
+
+    graph = TransitGraph(
+        route_names,
+        stop_names,
+        CSR(sections["route_stop_offsets"], sections["route_stop_values"]),
+        CSR(sections["stop_route_offsets"], sections["stop_route_values"]),
+        CSR(sections["stop_route_offsets"], sections["stop_slot_values"]),
+        sections["slot_routes"],
+        CSR(sections["transfer_offsets"], sections["transfer_route_values"]),
+        CSR(sections["transfer_offsets"], sections["transfer_stop_values"]),
+        CSR(sections["transfer_offsets"], sections["transfer_board_values"]),
+        CSR(sections["walk_offsets"], sections["walk_stop_values"]),
+        sections["walk_meter_values"],
+        sections["route_lines"]
+    )
+    # Keep the mapping alive for as long as the graph is
+    graph.buffer = buffer
+    graph.snapshot_path = path
+    graph.snapshot_fingerprint = mapped_fingerprint
+
+    return graph, route_table, stop_table, get_value
+
+
+class StringTableBuilder():
+    """
+    Collects de-duplicated strings and numbers them
+    """
+
+    def __init__(self) -> None:
+        self.numbers = {}
+        self.encoded = []
+
+
+    def add(self, string) -> int:
+        number = self.numbers.get(string)
+        if number is None:
+            number = len(self.encoded)
+            self.numbers[string] = number
+            self.encoded.append(string.encode("utf-8"))
+        return number
+
+
+    def add_value(self, value) -> int:
+        """
+        Ids and line names aren't always strings (None, or ints from some providers), so store them (and stop
+        locations) as JSON
+        """
+        return self.add(json.dumps(value))
+
+
+    def build(self):
+        offsets = array("I", [0])
+        for encoded in self.encoded:
+            offsets.append(offsets[-1] + len(encoded))
+        return offsets, b"".join(self.encoded)
+
+
+def to_bytes(values) -> bytes:
+    if isinstance(values, bytes):
+        return values
+
+    values = array("I", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def align(position, boundary=8):
+    return (position + boundary - 1) // boundary * boundary
@@ -0,0 +1,194 @@
+"""
+Spatial lookups over stop coordinates.
+
+`SpatialGrid` buckets points into square cells of a fixed size, on an equirectangular projection around the
+points' mean latitude (accurate to within a few percent across a metro area). Finding every pair within a radius
+only compares points in neighbouring cells, and a nearest-point query widens ring by ring from the query's cell,
+so neither ever compares every point with every other. `StopLocationIndex` puts stops in a grid, for walking
+transfers and nearest-stop lookups.
+"""
+
+import heapq
+import math
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+# Cell edge in meters: about one typical walking-transfer radius
+CELL_SIZE = 250
+
+# Headroom for the projection's distortion away from the mean latitude, when deciding how many cells to look at
+PROJECTION_MARGIN = 1.1
+
+
+def get_distance(latitude1, longitude1, latitude2, longitude2) -> float:
+    """
+    Great-circle (haversine) distance in meters
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialGrid():
+    """
+    Uniform grid over (latitude, longitude) points, numbered by their position in `points`. Points given as None
+    (no known location) are left out of every result.
+    """
+
+    def __init__(self, points, cell_size=CELL_SIZE) -> None:
+        self.points = list(points)
+        self.cell_size = cell_size
+
+        located = [point for point in self.points if point is not None]
+        mean_latitude = sum(latitude for latitude, _ in located) / len(located) if located else 0.0
+        self.x_scale = METERS_PER_DEGREE * math.cos(math.radians(mean_latitude)) / cell_size
+        self.y_scale = METERS_PER_DEGREE / cell_size
+
+        # (x, y) -> point indexes
+        self.cells = {}
+        for i, point in enumerate(self.points):
+            if point is not None:
+                self.cells.setdefault(self.__get_cell(*point), []).append(i)
+
+        # Bounding box of the occupied cells, (min x, min y, max x, max y)
+        if self.cells:
+            xs = [x for x, _ in self.cells]
+            ys = [y for _, y in self.cells]
+            self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            self.bounds = None
+
+
+    def __get_cell(self, latitude, longitude):
+        return math.floor(longitude * self.x_scale), math.floor(latitude * self.y_scale)
+
+
+    def __len__(self):
+        return sum(len(members) for members in self.cells.values())
+
+
+    def get_pairs(self, radius):
+        """
+        (i, j, meters) for every pair of points (i < j) no more than `radius` meters apart
+        """
+        reach = math.ceil(radius * PROJECTION_MARGIN / self.cell_size)
+        points = self.points
+
+        for (x, y), members in self.cells.items():
+            for dx in range(-reach, reach + 1):
+                for dy in range(-reach, reach + 1):
+                    others = self.cells.get((x + dx, y + dy))
+                    if not others:
+                        continue
+
+                    # Each pair is seen from both cells, but only yielded from the one holding the lower index
+                    for i in members:
+                        latitude, longitude = points[i]
+                        for j in others:
+                            if i < j:
+                                meters = get_distance(latitude, longitude, *points[j])
+                                if meters <= radius:
+                                    yield i, j, meters
+
+
+    def get_nearest(self, latitude, longitude, k=1, max_distance=None) -> list:
+        """
+        Up to `k` (index, meters) of the points closest to a location, nearest first, optionally only those within
+        `max_distance` meters
+        """
+        if self.bounds is None or k <= 0:
+            return []
+
+        x, y = self.__get_cell(latitude, longitude)
+        min_x, min_y, max_x, max_y = self.bounds
+        # Rings closer than the bounding box are empty, and by this one every occupied cell has been searched
+        ring = max(min_x - x, x - max_x, min_y - y, y - max_y, 0)
+        last_ring = max(x - min_x, max_x - x, y - min_y, max_y - y)
+
+        candidates = []
+
+        def add(members):
+            for i in members:
+                meters = get_distance(latitude, longitude, *self.points[i])
+                if max_distance is None or meters <= max_distance:
+                    candidates.append((meters, i))
+
+        while True:
+            if max_distance is not None and (ring - 1) * self.cell_size / PROJECTION_MARGIN > max_distance:
+                break
+
+            if 8 * ring > len(self.cells):
+                # A ring this wide has more cells than are occupied: look at the rest of the occupied ones instead
+                for (cell_x, cell_y), members in self.cells.items():
+                    if max(abs(cell_x - x), abs(cell_y - y)) >= ring:
+                        add(members)
+                break
+
+            for cell in self.__get_ring(x, y, ring):
+                add(self.cells.get(cell, ()))
+
+            # Anything outside the rings searched so far is at least this far away
+            covered = ring * self.cell_size / PROJECTION_MARGIN
+            if len(candidates) >= k and heapq.nsmallest(k, candidates)[-1][0] <= covered:
+                break
+            if ring >= last_ring:
+                break
+            ring += 1
+
+        return [(i, meters) for meters, i in heapq.nsmallest(k, candidates)]
+
+
+    @staticmethod
+    def __get_ring(x, y, ring):
+        """
+        Cells exactly `ring` cells away (in the Chebyshev sense) from (x, y)
+        """
+        if ring == 0:
+            yield x, y
+            return
+
+        for dx in range(-ring, ring + 1):
+            yield x + dx, y - ring
+            yield x + dx, y + ring
+        for dy in range(-ring + 1, ring):
+            yield x - ring, y + dy
+            yield x + ring, y + dy
+
+
+class StopLocationIndex():
+    """
+    The stops with a known location, by position
+    """
+
+    def __init__(self, stops, cell_size=CELL_SIZE) -> None:
+        self.stops = [stop for stop in stops if stop.has_location]
+        self.grid = SpatialGrid(((stop.latitude, stop.longitude) for stop in self.stops), cell_size)
+
+
+    def __len__(self):
+        return len(self.stops)
+
+
+    def get_nearest(self, latitude, longitude, k=1, max_distance=None) -> list:
+        """
+        (stop name, meters) of up to `k` stops closest to a location, nearest first
+        """
+        return [
+            (self.stops[i].name, meters) for i, meters in self.grid.get_nearest(latitude, longitude, k, max_distance)
+        ]
+
+
+    def get_walks(self, radius, connects=None) -> list:
+        """
+        (stop name, stop name, meters) of every two differently named stops within `radius` meters of each other,
+        only keeping the pairs `connects(stop, other)` accepts if given
+        """
+        walks = []
+        for i, j, meters in self.grid.get_pairs(radius):
+            stop, other = self.stops[i], self.stops[j]
+            if stop.name != other.name and (connects is None or connects(stop, other)):
+                walks.append((stop.name, other.name, meters))
+        return walks
@@ -0,0 +1,236 @@
+"""
+Network statistics kept up to date as routes come and go, so that asking for them never sorts or scans the
+network.
+
+Everything follows from which stops each route serves: its stop count, how many routes serve each stop (a stop
+served by two or more is a connecting stop), and per-line totals. `NetworkStats.updated()` derives the statistics
+of the next network from the routes a refresh removed and added, touching only what those routes touch.
+"""
+
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class LineStats:
+    line: str
+    routes: int
+    # Sum of the stop counts of the line's routes
+    route_stops: int
+    # Distinct stops served by any of the line's routes
+    stops: int
+
+
+class NetworkStats():
+    """
+    Statistics of one network. Like `Network` it is never modified once built; `updated()` returns a new
+    instance that shares what didn't change.
+
+    Routes are bucketed by stop count, with the distinct counts kept sorted, so the routes with the most / fewest
+    stops, and the k largest / smallest routes, are read off the ends without looking at any other route.
+    """
+    __slots__ = (
+        "stop_counts", "count_routes", "counts", "degrees", "degree_histogram", "line_routes", "line_stops", "lines"
+    )
+
+    def __init__(self) -> None:
+        # route name -> number of stops
+        self.stop_counts = {}
+        # number of stops -> routes with that many (a dict used as an insertion-ordered set)
+        self.count_routes = {}
+        # Distinct stop counts, ascending
+        self.counts = []
+
+        # stop name -> number of routes serving it, and number of routes -> number of stops served by that many
+        self.degrees = {}
+        self.degree_histogram = {}
+
+        # line name -> {route name: number of stops}, {stop name: number of the line's routes serving it}
+        self.line_routes = {}
+        self.line_stops = {}
+        # line name -> LineStats
+        self.lines = {}
+
+
+    @classmethod
+    def from_routes(cls, routes):
+        return cls().updated(added=routes)
+
+
+    def updated(self, removed=(), added=()):
+        """
+        Statistics after taking the `removed` routes out and putting the `added` ones in. A route that changed
+        is passed in both, its old version removed and its new one added.
+        """
+        stats = NetworkStats()
+        stats.stop_counts = dict(self.stop_counts)
+        stats.count_routes = dict(self.count_routes)
+        stats.counts = list(self.counts)
+        stats.degrees = dict(self.degrees)
+        stats.degree_histogram = dict(self.degree_histogram)
+        stats.line_routes = dict(self.line_routes)
+        stats.line_stops = dict(self.line_stops)
+        stats.lines = dict(self.lines)
+
+        # Nested dicts are shared with this instance until they are first modified
+        copied = set()
+        touched_lines = set()
+
+        for route in removed:
+            stats.__remove_route(route, copied)
+            touched_lines.add(route.line_name)
+        for route in added:
+            stats.__add_route(route, copied)
+            touched_lines.add(route.line_name)
+
+        for line in touched_lines:
+            routes = stats.line_routes.get(line)
+            if routes:
+                stats.lines[line] = LineStats(line, len(routes), sum(routes.values()), len(stats.line_stops[line]))
+            else:
+                stats.line_routes.pop(line, None)
+                stats.line_stops.pop(line, None)
+                stats.lines.pop(line, None)
+
+        return stats
+
+
+    def __own(self, attribute, key, copied):
+        """
+        A private copy of `getattr(self, attribute)[key]` that is safe to modify
+        """
+        mapping = getattr(self, attribute)
+        if (attribute, key) not in copied or key not in mapping:
+            mapping[key] = dict(mapping.get(key, ()))
+            copied.add((attribute, key))
+        return mapping[key]
+
+
+    def __add_route(self, route, copied):
+        count = len(route.stops)
+        self.stop_counts[route.name] = count
+
+        if count not in self.count_routes:
+            insort(self.counts, count)
+        self.__own("count_routes", count, copied)[route.name] = None
+
+        line_stops = self.__own("line_stops", route.line_name, copied)
+        self.__own("line_routes", route.line_name, copied)[route.name] = count
+
+        for name in {stop.name for stop in route.stops}:
+            self.__set_degree(name, self.degrees.get(name, 0) + 1)
+            line_stops[name] = line_stops.get(name, 0) + 1
+
+
+    def __remove_route(self, route, copied):
+        count = self.stop_counts.pop(route.name)
+
+        bucket = self.__own("count_routes", count, copied)
+        del bucket[route.name]
+        if not bucket:
+            del self.count_routes[count]
+            del self.counts[bisect_left(self.counts, count)]
+
+        line_stops = self.__own("line_stops", route.line_name, copied)
+        del self.__own("line_routes", route.line_name, copied)[route.name]
+
+        for name in {stop.name for stop in route.stops}:
+            self.__set_degree(name, self.degrees[name] - 1)
+            if line_stops[name] == 1:
+                del line_stops[name]
+            else:
+                line_stops[name] -= 1
+
+
+    def __set_degree(self, name, degree):
+        previous = self.degrees.get(name, 0)
+        if previous:
+            self.degree_histogram[previous] -= 1
+            if not self.degree_histogram[previous]:
+                del self.degree_histogram[previous]
+
+        if degree:
+            self.degrees[name] = degree
+            self.degree_histogram[degree] = self.degree_histogram.get(degree, 0) + 1
+        else:
+            del self.degrees[name]
+
+
+    def get_most_stops(self) -> list:
+        """
+        (route name, count stops) of every route tied for the most stops, by name
+        """
+        if not self.counts:
+            return []
+        return self.__get_bucket(self.counts[-1])
+
+
+    def get_least_stops(self) -> list:
+        """
+        (route name, count stops) of every route tied for the fewest stops, by name
+        """
+        if not self.counts:
+            return []
+        return self.__get_bucket(self.counts[0])
+
+
+    def get_largest(self, k) -> list:
+        """
+        The `k` routes with the most stops, most first (ties by name)
+        """
+        return self.__take(reversed(self.counts), k)
+
+
+    def get_smallest(self, k) -> list:
+        """
+        The `k` routes with the fewest stops, fewest first (ties by name)
+        """
+        return self.__take(self.counts, k)
+
+
+    def __take(self, counts, k):
+        result = []
+        for count in counts:
+            if len(result) >= k:
+                break
+            result.extend(self.__get_bucket(count)[:k - len(result)])
+        return result
+
+
+    def __get_bucket(self, count):
+        return [(name, count) for name in sorted(self.count_routes[count])]
+
+
+    def get_degree(self, stop_name) -> int:
+        """
+        Number of routes serving a stop
+        """
+        return self.degrees.get(stop_name, 0)
+
+
+    def get_degree_histogram(self) -> dict:
+        """
+        Number of routes serving a stop -> number of stops served by that many routes, ascending
+        """
+        return dict(sorted(self.degree_histogram.items()))
+
+
+    @property
+    def connecting_stop_count(self) -> int:
+        return sum(stops for degree, stops in self.degree_histogram.items() if degree >= 2)
+
+
+    def get_line_stats(self) -> list:
+        """
+        `LineStats` of every line, by line name
+        """
+        return sorted(self.lines.values(), key=lambda stats: str(stats.line))
+
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.stop_counts, self.degrees, self.lines) == (other.stop_counts, other.degrees, other.lines)
+
+
+    __hash__ = None
@@ -1,13 +1,74 @@
-from dataclasses import dataclass, field
+class Stop():
+    __slots__ = ("name", "id", "latitude", "longitude", "route_list", "route_set", "frozen_associations")
+
+    def __init__(self, name, id="", route_associations=None, latitude=None, longitude=None) -> None:
+        self.name = name
+        self.id = id
+
+        # WGS 84 degrees, None when the provider doesn't know where the stop is
+        self.latitude = latitude
+        self.longitude = longitude
+
+        # Route names in the order they were associated (used for display), plus the same names as a set for
+        # lookups. `route_associations` freezes the list into a tuple the first time it's read.
+        self.route_list = []
+        self.route_set = set()
+        self.frozen_associations = None
+
+        for route_name in route_associations or ():
+            self.add_route_association(route_name)
+
+
+    def add_route_association(self, route_name):
+        """
+        Associate this stop with a route (by name). Associating the same route twice is a no-op.
+        """
+        if route_name in self.route_set:
+            return
+
+        self.route_list.append(route_name)
+        self.route_set.add(route_name)
+        self.frozen_associations = None
+
+
+    @property
+    def route_associations(self) -> tuple:
+        """
+        Route names in the order they were associated
+        """
+        if self.frozen_associations is None:
+            self.frozen_associations = tuple(self.route_list)
+        return self.frozen_associations
+
+
+    def is_associated_with_route(self, route_name) -> bool:
+        """
+        Check if the stop is serviced by the given route
+        """
+        return route_name in self.route_set
+
+
+    @property
+    def has_location(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
 
-@dataclass
-class Stop:
-    name: str
-    id: str = ""
-    route_associations: list = field(default_factory=list)
 
     def is_associated_with_multiple_routes(self):
         """
         Helper method to check if the stop is associated with more than one route
         """
-        return len(self.route_associations) > 1
\ No newline at end of file
+        return len(self.route_list) > 1
+
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.name, self.id, self.route_list) == (other.name, other.id, other.route_list)
+
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+    def __repr__(self):
+        return f"Stop(name={self.name!r}, id={self.id!r}, route_associations={self.route_list!r})"
@@ -1,127 +1,401 @@
-from functools import cache
+from datetime import date
+import threading
+
 from transit.stop import Stop
-from transit.route import Route
-import logging
+from transit.route import Route, to_sequences
+from transit.network import Network, NetworkDiff
+from transit import metrics
+from transit import planner
+from transit import snapshot
+from transit import timetable
+from transit.lru import MISSING, CacheStats, LRUCache
+from transit.spatial import StopLocationIndex
+
+class UnknownStopError(Exception):
+    pass
+
+
+class UnknownRouteError(Exception):
+    pass
+
 
 class TransitMap():
-    routes = {}
-    stops = {}
     data_provider = None
 
+    # Plan results remembered (per network version) by default
+    PLAN_CACHE_SIZE = 10000
 
-    def __init__(self, data_provider=None) -> None:
+    # Meters riders walk between nearby stops to change routes, by default
+    WALK_RADIUS = 250
+
+
+    def __init__(self, data_provider=None, plan_cache_size=PLAN_CACHE_SIZE, walk_radius=WALK_RADIUS) -> None:
+        """
+        `plan_cache_size` bounds how many `plan()` results are kept for repeated queries (0 disables the cache).
+        Stops within `walk_radius` meters of each other are connected by walking transfers (0 for none beyond what
+        the data provider lists).
+        """
         self.data_provider = data_provider
+        self.walk_radius = walk_radius
+
+        # The current network. It is only ever replaced as a whole (a single reference assignment), so queries
+        # read it without locking; `load_lock` just keeps two loads from running at the same time.
+        self.network = Network()
+        self.load_lock = threading.Lock()
+
+        # (network, TransferMatrix) for the network the matrix was computed for
+        self.transfer_matrix = None
+
+        # (network, service date, Timetable) for the last timetable loaded
+        self.timetable = None
+
+        # (network version, origin index, destination index, optimize) -> Itinerary or None. The version in the
+        # key means a new network can never be answered from an old one; `plan()` also drops the old entries.
+        self.plan_cache = LRUCache(plan_cache_size)
+        self.plan_cache_version = None
+
+        # Live service state (a `RealtimeState`) when a real-time feed is attached, see `follow_realtime()`
+        self.realtime = None
+
+
+    @property
+    def routes(self):
+        return self.network.routes
+
+
+    @property
+    def stops(self):
+        return self.network.stops
+
+
+    @property
+    def graph(self):
+        return self.network.graph
 
 
-    @cache
     def load_routes(self):       
-        route_list = self.data_provider.get_all_routes()
+        """
+        Loads the list of routes (without their stops) if nothing has been loaded yet
+        """
+        if self.network.routes:
+            return
 
-        for route in route_list:
-            self.routes[route.name] = route
+        with self.load_lock:
+            if not self.network.routes:
+                self.network = Network(
+                    {route.name: route for route in self.data_provider.get_all_routes()},
+                    version=self.network.version + 1
+                )
 
 
-    @cache     
     def load_stops(self):
         """
-        Loads all the stop information, will lazy-load routes if not already populated
-        """
-        if not self.routes:
-            self.load_routes()
-        
-        for route_name in self.routes.keys():
-            route = self.routes[route_name]
-            stops = self.data_provider.get_stops_for_route(route.id)
-           
-            for stop in stops:
-                # Add this to the list of all stops if we haven't already seen it
-                if stop.name not in self.stops:
-                    stop.route_associations.append(route.name)
-                    self.stops[stop.name] = stop
-                else:
-                    # Otherwise, just append the list of routes
-                    self.stops[stop.name].route_associations.append(route.name)
-                
-                # Add this stop to the route info
-                route.stops.append(self.stops[stop.name])
-                    
-
-    @cache
-    def get_connecting_stops(self):
+        Loads all the stop information (and routes, if not already populated) if it hasn't been loaded yet
         """
-        We'll define "connecting stops" as stops that service two or more routes
+        if self.network.is_loaded:
+            return
+
+        with self.load_lock:
+            if not self.network.is_loaded:
+                self.network = self.__fetch_network(list(self.network.routes.values()) or None)
+
+
+    def reload(self):
+        """
+        Fetch the whole network from the data provider again and swap it in. Queries running meanwhile keep
+        using the previous network until they finish.
+        """
+        with self.load_lock:
+            self.network = self.__fetch_network()
+
+
+    def refresh(self):
+        """
+        Fetch the current routes and stops, and swap in a network patched with only what changed since the last
+        load. Returns the `NetworkDiff` that was applied (empty if nothing changed, in which case the current
+        network is kept as is).
+        """
+        with self.load_lock:
+            if not self.network.is_loaded:
+                self.network = self.__fetch_network()
+                return NetworkDiff(added_routes=list(self.network.routes.keys()))
+
+            with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "routes"):
+                routes = self.data_provider.get_all_routes()
+            with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "stops"):
+                stops_by_route = self.data_provider.get_stops_for_routes([route.id for route in routes])
+
+            with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "diff"):
+                diff = self.network.diff(routes, stops_by_route)
+
+            if not diff.is_empty:
+                with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "walks"):
+                    walks = self.__get_walks(stops_by_route)
+                with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "apply"):
+                    self.network = self.network.apply(diff, routes, stops_by_route, self.network.version + 1, walks)
+
+            return diff
+
+
+    def __fetch_network(self, routes=None) -> Network:
+        if routes is None:
+            with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "routes"):
+                routes = self.data_provider.get_all_routes()
+
+        # Fetch everything up front (the provider may do this concurrently or in bulk), then merge in route
+        # order so stop / route associations come out the same regardless of how the data was fetched
+        with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "stops"):
+            stops_by_route = self.data_provider.get_stops_for_routes([route.id for route in routes])
+
+        with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "walks"):
+            walks = self.__get_walks(stops_by_route)
+
+        with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "build"):
+            return Network.build(routes, stops_by_route, version=self.network.version + 1, walks=walks)
+
+
+    def __get_walks(self, stops_by_route):
+        """
+        Walking transfers between the fetched stops: those within `walk_radius` of each other, plus any the data
+        provider lists
+        """
+        stops = {}
+        for route_stops in stops_by_route.values():
+            for sequence in to_sequences(route_stops):
+                for stop in sequence.stops:
+                    stops.setdefault(stop.name, stop)
+
+        walks = list(self.data_provider.get_walking_transfers(list(stops.values())))
+        if self.walk_radius:
+            walks.extend(StopLocationIndex(stops.values()).get_walks(self.walk_radius))
+        return walks
+
+
+    def save_snapshot(self, path):
+        """
+        Write the loaded network to a binary snapshot file (see `transit/snapshot.py`)
+        """
+        self.load_stops()
+        network = self.network
+        route_names = dict.fromkeys(network.graph.route_names)
+        snapshot.write_snapshot(path, [network.routes[name] for name in route_names], network.graph)
+
+
+    def load_snapshot(self, path):
+        """
+        Load the network from a snapshot file instead of the data provider. The planner's graph is used straight
+        from the memory-mapped file.
+        """
+        with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "snapshot"):
+            routes, stops, graph = snapshot.read_snapshot(path)
+
+        with self.load_lock:
+            self.network = Network(routes, stops, graph, version=self.network.version + 1)
+
+
+    def get_transfer_matrix(self):
+        """
+        All-pairs minimum transfer counts for the current network (see `transit/transfers.py`), computed on
+        first use and again after the network changes
+        """
+        # NumPy is only needed for this, so don't make every user of the map pay for importing it
+        from transit.transfers import TransferMatrix
+
+        self.load_stops()
+        network = self.network
+
+        cached = self.transfer_matrix
+        if cached is not None and cached[0] is network:
+            return cached[1]
+
+        matrix = TransferMatrix.from_graph(network.graph)
+        self.transfer_matrix = (network, matrix)
+        return matrix
+
+
+    def load_transfer_matrix(self, path):
+        """
+        Use a matrix saved with `TransferMatrix.save()` for the current network (e.g. next to its snapshot)
+        """
+        from transit.transfers import TransferMatrix
+
+        network = self.network
+        matrix = TransferMatrix.load(path, network.graph)
+        self.transfer_matrix = (network, matrix)
+        return matrix
+
+
+    def get_timetable(self, service_date=None) -> timetable.Timetable:
         """
-        connecting_stops = {}
-        for stop_name, stop_details in self.stops.items():
-            if len(stop_details.route_associations) >= 2:
-                connecting_stops[stop_name] = stop_details.route_associations
-        return connecting_stops
+        Scheduled trips of the current network from the data provider (see `BaseDataProvider.get_trips()`) on one
+        service date, today's unless given. Loaded on first use and again after the network or the date changes.
+        """
+        if service_date is None:
+            service_date = date.today()
+
+        self.load_stops()
+        network = self.network
+
+        cached = self.timetable
+        if cached is not None and cached[0] is network and cached[1] == service_date:
+            return cached[2]
+
+        routes = list(network.routes.values())
+
+        with metrics.REGISTRY.time(metrics.LOAD_SECONDS, "timetable"):
+            trips = self.data_provider.get_trips([route.id for route in routes], service_date)
+            result = timetable.Timetable.from_trips(
+                trips, {route.id: route.name for route in routes}, network.graph.stop_names
+            )
+        self.timetable = (network, service_date, result)
+        return result
 
 
-    @cache
-    def __get_route_stats(self):
+    def plan_journey(self, origin: Stop, destination: Stop, departure_time, service_date=None,
+                     max_transfers=timetable.MAX_TRANSFERS, transfer_time=0) -> timetable.Journey:
         """
-        Helper function which returns a list of tuples (route name, count stops)
+        Earliest arrival at `destination` leaving `origin` no earlier than `departure_time` (seconds after midnight,
+        or "HH:MM[:SS]") on `service_date` (today if None), with board / alight stops and times for every leg.
+        Returns None if there's no way to get there on the schedule.
         """
-        stop_counts = [(name, len(details.stops)) for name, details in self.routes.items()]
-        return sorted(stop_counts, key=lambda stop: stop[1])
+        if isinstance(departure_time, str):
+            departure_time = timetable.parse_time(departure_time)
+
+        schedule = self.get_timetable(service_date)
+        if origin.name not in schedule.stop_index or destination.name not in schedule.stop_index:
+            return None
+
+        return timetable.plan_journey(
+            schedule,
+            schedule.stop_index[origin.name],
+            schedule.stop_index[destination.name],
+            departure_time,
+            max_transfers,
+            transfer_time
+        )
+
+
+    def follow_realtime(self, state=None):
+        """
+        Start following the data provider's real-time feed of the loaded routes (see
+        `transit/data_providers/streaming.py`); returns the streaming provider, to `stop()` it later
+        """
+        from transit.data_providers.streaming import MBTAStreamingProvider
+        from transit.realtime import RealtimeState
+
+        self.load_stops()
+        self.realtime = state if state is not None else RealtimeState()
+
+        route_names = {route.id: route.name for route in self.network.routes.values()}
+        base_url = getattr(self.data_provider, "API_BASE_URL", None)
+        stream = MBTAStreamingProvider(self.realtime, route_names, base_url=base_url)
+        stream.start()
+        return stream
+
+
+    def get_live_status(self, route_name):
+        """
+        Recent headway, delay and vehicle count of a route (a `LiveStatus`), None without a real-time feed
+        """
+        if self.realtime is None:
+            return None
+        return self.realtime.get_status(route_name)
+
+
+    def get_expected_wait(self, itinerary) -> float:
+        """
+        Seconds an itinerary is expected to spend waiting for vehicles, from the live headways and delays of its
+        routes. None without a real-time feed or without observations for every route.
+        """
+        waits = [self.get_live_status(route) for route in itinerary.routes]
+        if any(status is None or status.expected_wait is None for status in waits):
+            return None
+        return sum(status.expected_wait for status in waits)
+
+
+    def get_connecting_stops(self):
+        """
+        We'll define "connecting stops" as stops that service two or more routes
+        """
+        return self.network.connecting_stops
 
 
     def get_routes_with_most_stops(self):
         """
-        Since there can be ties, this is slightly more advanced than just getting the last element of a sorted list.
+        Every route tied for the most stops, as (route name, count stops)
         """
-        stop_list = []
-        max_value = None
-        route_stats = self.__get_route_stats()
-        
-        for x in range(len(route_stats)-1, 0, -1):
-            if max_value is None:
-                max_value = route_stats[x][1]
-                stop_list.append(route_stats[x])
-                continue
+        return self.network.stats.get_most_stops()
 
-            if route_stats[x][1] >= max_value:
-                stop_list.append(route_stats[x])
-            else:
-                break
 
-        return stop_list
-    
-    
     def get_routes_with_least_stops(self):
         """
-        Since there can be ties, this is slightly more advanced than just getting the first of a sorted list.
+        Every route tied for the fewest stops, as (route name, count stops)
+        """
+        return self.network.stats.get_least_stops()
+
+
+    def get_largest_routes(self, k) -> list:
+        """
+        The `k` routes with the most stops, as (route name, count stops)
+        """
+        return self.network.stats.get_largest(k)
+
+
+    def get_smallest_routes(self, k) -> list:
+        """
+        The `k` routes with the fewest stops, as (route name, count stops)
         """
-        stop_list = []
-        min_value = None
+        return self.network.stats.get_smallest(k)
 
-        route_stats = self.__get_route_stats()
 
-        for route_stat in route_stats:
-            line, count = route_stat
+    def get_stop_degree_histogram(self) -> dict:
+        """
+        Number of routes serving a stop -> how many stops are served by that many routes
+        """
+        return self.network.stats.get_degree_histogram()
 
-            if min_value is None:
-                min_value = count
-                stop_list.append(route_stat)
-                continue
 
-            if count <= min_value:
-                stop_list.append(route_stat)
-            else:
-                break
-        
-        return stop_list
+    def get_line_stats(self) -> list:
+        """
+        Route, stop and distinct stop counts per line (see `transit/stats.py`)
+        """
+        return self.network.stats.get_line_stats()
 
 
     def get_stop_from_string(self, stop_string) -> Stop:
         """
-        Wrapper around stop dictionary lookup -> raises an exception if not found
+        Look a stop up by name. Falls back to the search index for inexact input ("kendall", "park st") as long as
+        it confidently points at a single stop, raises `UnknownStopError` otherwise.
         """
-        if stop_string in self.stops:
-            return self.stops[stop_string]
-        else:
-            raise Exception('Unknown Stop!')
+        network = self.network
+
+        if stop_string in network.stops:
+            return network.stops[stop_string]
+
+        match = network.stop_search.get_best_match(stop_string)
+        if match is not None:
+            return network.stops[match]
+
+        raise UnknownStopError('Unknown Stop!')
+
+
+    def search_stops(self, query, limit=10) -> list:
+        """
+        Ranked stop name matches for a partial or misspelled query (see `transit/search.py`)
+        """
+        return self.network.stop_search.search(query, limit)
+
+
+    def get_nearest_stops(self, latitude, longitude, k=1, max_distance=None) -> list:
+        """
+        (stop, meters) of up to `k` stops closest to a location, nearest first, optionally only those within
+        `max_distance` meters. Stops the data provider has no location for are never returned.
+        """
+        network = self.network
+        return [
+            (network.stops[name], meters)
+            for name, meters in network.stop_locations.get_nearest(latitude, longitude, k, max_distance)
+        ]
 
 
     def get_route_from_string(self, route_string) -> Route:
@@ -131,79 +405,108 @@ class TransitMap():
         if route_string in self.routes:
             return self.routes[route_string]
         else:
-            raise Exception('Unknown Route!')
+            raise UnknownRouteError('Unknown Route!')
     
 
-    def get_routes_for_stops(self, origin: Stop, destination: Stop, checked_routes = None) -> list:
-        """
-        Try to determine a list of routes between stops (can result in recursive calls)
-        """
-        results = []
-
-        logging.info(f"Origin: {origin}")
-        logging.info(f"Destination: {destination}")
-
-        if checked_routes is None:
-            checked_routes = []
-
-        # Attempt to short-circuit the logic below by looking for any direct routes
-        # This may seem a bit redundant, but as a base case, we want to exhaust all potential direct routes 
-        # before searching connections or possibly recursing
-        for route_string in origin.route_associations:
-            route = self.get_route_from_string(route_string)
-
-            if route.has_stops(origin, destination):
-                results.append(route_string)
-                return results
-           
-        # Check all of the routes associated with the origin
-        for route_string in origin.route_associations:
-            if route_string in checked_routes:
-                continue
-            logging.info(f"Checking route: {route_string}")
-            
-            # Keep track of what's already been checked
-            checked_routes.append(route_string)
-            route = self.get_route_from_string(route_string)
-
-            # If we didn't find a direct connection on this route, start looking for "intersecting routes"
-            for connecting_route in route.get_connecting_routes():
-                if connecting_route in destination.route_associations:
-                    return [route_string, connecting_route]
-
-            # If all else fails, we need to look through connecting stops
-            connecting_stops = route.get_connecting_stops()
-            logging.info(f"Connecting Stops: {connecting_stops}")
-            for intersection_stop in connecting_stops:
-                if intersection_stop == origin:
-                    continue
-
-               # If this stop ONLY contains connections to "same line" then we can skip it.
-                if self.route_serviced_by_same_line_as_stop(route, intersection_stop):
-                    logging.info(f"Skipping: {intersection_stop}")
-                    checked_routes.extend(intersection_stop.route_associations)
-                    continue
-
-                logging.info(f"Recursing: {intersection_stop}")
-                result = self.get_routes_for_stops(intersection_stop, destination, checked_routes)
-                
-                if result:
-                    results.append(route_string)
-                    results.extend(result)
-                    return results
-    
-        return []
+    def plan(self, origin: Stop, destination: Stop, optimize=planner.FEWEST_TRANSFERS) -> planner.Itinerary:
+        """
+        Find an itinerary between two stops with the fewest transfers (default) or the fewest stops.
+        Returns None if the destination can't be reached from the origin.
+
+        Results are cached per network version, so repeated queries are answered from memory; treat the returned
+        itinerary as read-only.
+        """
+        self.load_stops()
+        network = self.network
+        graph = network.graph
+
+        origin_idx = graph.stop_index[origin.name]
+        destination_idx = graph.stop_index[destination.name]
+
+        return self.__get_cached(
+            network,
+            (network.version, origin_idx, destination_idx, optimize),
+            lambda: planner.plan(graph, origin_idx, destination_idx, optimize)
+        )
+
+
+    def plan_alternatives(self, origin: Stop, destination: Stop, optimize=planner.FEWEST_TRANSFERS, k=None) -> list:
+        """
+        Itineraries between two stops that trade transfers, stops and line changes off against each other: every
+        Pareto-optimal one (none of the others is at least as good on all three), or with `k` the k best. Either
+        way they're ranked by `optimize` first, the other criteria breaking ties; empty if the destination can't be
+        reached.
+
+        Cached like `plan()`; treat the returned list as read-only.
+        """
+        self.load_stops()
+        network = self.network
+        graph = network.graph
+
+        origin_idx = graph.stop_index[origin.name]
+        destination_idx = graph.stop_index[destination.name]
+
+        return self.__get_cached(
+            network,
+            (network.version, origin_idx, destination_idx, optimize, k),
+            lambda: planner.plan_alternatives(graph, origin_idx, destination_idx, optimize, k)
+        )
+
+
+    def __get_cached(self, network, key, compute):
+        """
+        A plan result from the cache, computing and caching it on a miss
+        """
+        if self.plan_cache_version != network.version:
+            self.plan_cache.clear()
+            self.plan_cache_version = network.version
+
+        result = self.plan_cache.get(key)
+
+        if metrics.REGISTRY.enabled:
+            metrics.PLAN_CACHE.inc("miss" if result is MISSING else "hit")
+
+        if result is MISSING:
+            result = compute()
+            self.plan_cache.put(key, result)
+
+        return result
+
+
+    def get_plan_cache_stats(self) -> CacheStats:
+        """
+        Hits, misses and evictions of the `plan()` result cache
+        """
+        return self.plan_cache.stats
+
+
+    def get_routes_for_stops(self, origin: Stop, destination: Stop, optimize=planner.FEWEST_TRANSFERS) -> list:
+        """
+        Determine the list of routes to travel between two stops (empty if there is no way to get there)
+        """
+        itinerary = self.plan(origin, destination, optimize)
+
+        if itinerary is None:
+            return []
+        return itinerary.routes
+
+
+    def plan_batch(self, pairs, optimize=planner.FEWEST_TRANSFERS, workers=1):
+        """
+        Plan an iterable of (origin name, destination name) pairs, yielding result dicts in input order
+        (see `transit/batch.py`)
+        """
+        # Pulls in multiprocessing, which nothing else at start-up needs
+        from transit import batch
+
+        self.load_stops()
+        return batch.plan_batch(self.network.graph, pairs, optimize, workers)
 
 
     def route_serviced_by_same_line_as_stop(self, route, stop):
         """
         Determine if a stop only is serviced by the same line as the provided route
         """
-        routes = []
-
-        for r in stop.route_associations:
-            route = self.get_route_from_string(r)
-            if route.line_name not in routes:
-                routes.append(route.line_name)
+        lines = {self.get_route_from_string(r).line_name for r in stop.route_associations}
 
-        return [route.line_name] == routes
+        return lines == {route.line_name}
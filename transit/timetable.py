@@ -0,0 +1,387 @@
+"""
+Scheduled (time-dependent) journey planning.
+
+A `Timetable` groups a service day's trips into patterns: trips of one route that visit exactly the same stops
+in the same order without overtaking each other. Each pattern's times are stored position-major in flat arrays,
+so the departures of all its trips from one stop are a contiguous, sorted run that can be binary searched.
+
+`JourneySearch` runs RAPTOR (round-based public transit routing) over it: round k finds the earliest arrival at
+every stop using at most k trips, by scanning each pattern that serves a stop improved in the previous round
+once, from that stop onwards.
+"""
+
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import time
+
+from transit import metrics
+from transit.graph import CSR
+
+# Later than any arrival
+NEVER = 2 ** 31 - 1
+
+# Rounds beyond this many transfers aren't searched
+MAX_TRANSFERS = 5
+
+
+@dataclass
+class Trip:
+    """
+    One scheduled run of a route, as supplied by a data provider (see `BaseDataProvider.get_trips()`). Times are
+    seconds after midnight of the service day (and may go past 24:00:00 for trips running after midnight).
+    """
+    id: str
+    route_id: object
+    stops: list = field(default_factory=list)
+    arrivals: list = field(default_factory=list)
+    departures: list = field(default_factory=list)
+
+
+@dataclass
+class Ride:
+    route: str
+    trip: str
+    board: str
+    alight: str
+    departure: int
+    arrival: int
+
+
+@dataclass
+class Journey:
+    legs: list = field(default_factory=list)
+
+    @property
+    def departure(self) -> int:
+        return self.legs[0].departure
+
+    @property
+    def arrival(self) -> int:
+        return self.legs[-1].arrival
+
+    @property
+    def duration(self) -> int:
+        return self.arrival - self.departure
+
+    @property
+    def routes(self) -> list:
+        return [leg.route for leg in self.legs]
+
+    @property
+    def transfers(self) -> int:
+        return max(len(self.legs) - 1, 0)
+
+
+def parse_time(text) -> int:
+    """
+    "HH:MM" or "HH:MM:SS" (hours may exceed 23, as in GTFS) to seconds after midnight
+    """
+    parts = [int(part) for part in text.strip().split(":")]
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3:
+        raise ValueError(f"Invalid time: {text}")
+
+    hours, minutes, seconds = parts
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_time(seconds) -> str:
+    return f"{seconds // 3600:02}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+class Timetable():
+    """
+    Array-backed timetable of one service day.
+
+    Pattern p visits the stops `pattern_stops[p]` and is run by the trips `pattern_trips[p]` (indexes into
+    `trip_ids`), earliest first. With n trips, the departure of its t-th trip from its i-th stop is
+    `departures[time_offsets[p] + i * n + t]`, and likewise for `arrivals`.
+    """
+
+    def __init__(self, stop_names, trip_ids, pattern_routes, pattern_stops, pattern_trips, time_offsets, arrivals,
+                 departures, stop_patterns, stop_positions) -> None:
+        self.stop_names = stop_names
+        self.trip_ids = trip_ids
+
+        self.pattern_routes = pattern_routes
+        self.pattern_stops = pattern_stops
+        self.pattern_trips = pattern_trips
+        self.time_offsets = time_offsets
+        self.arrivals = arrivals
+        self.departures = departures
+
+        # stop index -> patterns serving it, and the stop's position along each of them (row for row)
+        self.stop_patterns = stop_patterns
+        self.stop_positions = stop_positions
+
+        self.stop_index = {name: i for i, name in enumerate(stop_names)}
+
+
+    @classmethod
+    def from_trips(cls, trips, route_names, stop_names=()):
+        """
+        Build a timetable from provider trips. `route_names` maps route ids to names (trips of other routes are
+        skipped); passing a graph's `stop_names` numbers stops the same way as the graph.
+        """
+        stop_names = list(stop_names)
+        stop_index = {name: i for i, name in enumerate(stop_names)}
+
+        # (route name, stop indexes) -> trips, as (trip id, arrivals, departures)
+        sequences = {}
+
+        for trip in trips:
+            route = route_names.get(trip.route_id)
+            if route is None or len(trip.stops) < 2:
+                continue
+
+            stops = []
+            for name in trip.stops:
+                if name not in stop_index:
+                    stop_index[name] = len(stop_names)
+                    stop_names.append(name)
+                stops.append(stop_index[name])
+
+            sequences.setdefault((route, tuple(stops)), []).append((trip.id, trip.arrivals, trip.departures))
+
+        trip_ids = []
+        pattern_routes = []
+        pattern_stop_rows = []
+        pattern_trip_rows = []
+        time_offsets = array("I")
+        arrivals = array("i")
+        departures = array("i")
+
+        for (route, stops), sequence_trips in sequences.items():
+            for pattern in cls.__split_overtaking(sequence_trips):
+                pattern_routes.append(route)
+                pattern_stop_rows.append(stops)
+                pattern_trip_rows.append(range(len(trip_ids), len(trip_ids) + len(pattern)))
+                time_offsets.append(len(arrivals))
+
+                trip_ids.extend(trip_id for trip_id, _, _ in pattern)
+                for position in range(len(stops)):
+                    arrivals.extend(trip_arrivals[position] for _, trip_arrivals, _ in pattern)
+                    departures.extend(trip_departures[position] for _, _, trip_departures in pattern)
+
+        stop_pattern_rows = [[] for _ in stop_names]
+        stop_position_rows = [[] for _ in stop_names]
+        for pattern_idx, stops in enumerate(pattern_stop_rows):
+            for position, stop_idx in enumerate(stops):
+                stop_pattern_rows[stop_idx].append(pattern_idx)
+                stop_position_rows[stop_idx].append(position)
+
+        return cls(
+            stop_names,
+            trip_ids,
+            pattern_routes,
+            CSR.from_rows(pattern_stop_rows),
+            CSR.from_rows(pattern_trip_rows),
+            time_offsets,
+            arrivals,
+            departures,
+            CSR.from_rows(stop_pattern_rows),
+            CSR.from_rows(stop_position_rows)
+        )
+
+
+    @staticmethod
+    def __split_overtaking(trips):
+        """
+        Sort trips by departure and split them into groups in which no trip overtakes another, so every stop's
+        departures (and arrivals) are in trip order within a pattern
+        """
+        groups = []
+        for trip in sorted(trips, key=lambda trip: trip[2][0]):
+            _, trip_arrivals, trip_departures = trip
+
+            for group in groups:
+                _, last_arrivals, last_departures = group[-1]
+                if all(a >= b for a, b in zip(trip_arrivals, last_arrivals)) and \
+                        all(a >= b for a, b in zip(trip_departures, last_departures)):
+                    group.append(trip)
+                    break
+            else:
+                groups.append([trip])
+
+        return groups
+
+
+    def __len__(self):
+        """
+        Number of trips
+        """
+        return len(self.trip_ids)
+
+
+class JourneySearch():
+    """
+    RAPTOR from one origin stop at a departure time. Without a destination the search is one-to-all and
+    `journey_to()` can be asked about any stop; with one, routes that can't improve on the best arrival at the
+    destination so far are pruned.
+
+    `transfer_time` is the minimum number of seconds allowed for changing trips at a stop.
+    """
+
+    def __init__(self, timetable, origin_idx, departure_time, destination_idx=None, max_transfers=MAX_TRANSFERS,
+                 transfer_time=0):
+        self.timetable = timetable
+        self.origin_idx = origin_idx
+
+        stop_count = len(timetable.stop_names)
+        best = [NEVER] * stop_count
+        best[origin_idx] = departure_time
+
+        # Earliest arrival per stop using at most k trips, and how each improvement was made:
+        # parents[k][stop] = (pattern, trip within pattern, board position, alight position)
+        self.rounds = [list(best)]
+        self.parents = [{}]
+
+        stops = timetable.pattern_stops
+        stop_offsets = stops.offsets
+        stop_values = stops.values
+        trip_offsets = timetable.pattern_trips.offsets
+        time_offsets = timetable.time_offsets
+        arrivals = timetable.arrivals
+        departures = timetable.departures
+
+        marked = {origin_idx}
+        # Patterns scanned, over all rounds
+        self.expanded = 0
+
+        for k in range(1, max_transfers + 2):
+            previous = self.rounds[-1]
+            current = list(previous)
+            parents = {}
+            slack = transfer_time if k > 1 else 0
+
+            # Scan every pattern serving a marked stop once, from the earliest marked position
+            queue = {}
+            for stop_idx in marked:
+                for pattern_idx, position in zip(timetable.stop_patterns[stop_idx], timetable.stop_positions[stop_idx]):
+                    if position < queue.get(pattern_idx, NEVER):
+                        queue[pattern_idx] = position
+            marked = set()
+            self.expanded += len(queue)
+
+            for pattern_idx, start in queue.items():
+                first_stop = stop_offsets[pattern_idx]
+                stop_count_on_pattern = stop_offsets[pattern_idx + 1] - first_stop
+                trip_count = trip_offsets[pattern_idx + 1] - trip_offsets[pattern_idx]
+                base = time_offsets[pattern_idx]
+
+                trip = None
+                board = None
+
+                for position in range(start, stop_count_on_pattern):
+                    stop_idx = stop_values[first_stop + position]
+                    column = base + position * trip_count
+
+                    if trip is not None:
+                        arrival = arrivals[column + trip]
+                        bound = best[stop_idx]
+                        if destination_idx is not None and best[destination_idx] < bound:
+                            bound = best[destination_idx]
+
+                        if arrival < bound:
+                            current[stop_idx] = arrival
+                            best[stop_idx] = arrival
+                            parents[stop_idx] = (pattern_idx, trip, board, position)
+                            marked.add(stop_idx)
+
+                    # Can an earlier trip of this pattern be caught here?
+                    ready = previous[stop_idx]
+                    if ready == NEVER:
+                        continue
+                    ready += slack
+
+                    if trip is None or ready <= departures[column + trip]:
+                        earliest = bisect_left(departures, ready, column, column + trip_count) - column
+                        if earliest < trip_count and (trip is None or earliest < trip):
+                            trip = earliest
+                            board = position
+
+            self.rounds.append(current)
+            self.parents.append(parents)
+
+            if not marked:
+                break
+
+
+    @property
+    def depth(self) -> int:
+        """
+        Rounds run
+        """
+        return len(self.rounds) - 1
+
+
+    def arrival_at(self, destination_idx) -> int:
+        """
+        Earliest arrival time at a stop, `NEVER` if it can't be reached
+        """
+        return min(rounds[destination_idx] for rounds in self.rounds)
+
+
+    def journey_to(self, destination_idx) -> Journey:
+        """
+        Earliest-arrival journey to a stop (the one with the fewest trips among equally early ones), or None
+        """
+        arrival = self.arrival_at(destination_idx)
+        if arrival == NEVER or destination_idx == self.origin_idx:
+            return None
+
+        # The first round that reached the stop this early uses the fewest trips
+        k = next(k for k, rounds in enumerate(self.rounds) if rounds[destination_idx] == arrival)
+
+        timetable = self.timetable
+        legs = []
+        stop_idx = destination_idx
+
+        while k > 0:
+            parent = self.parents[k].get(stop_idx)
+            if parent is None:
+                # The arrival was carried over from an earlier round
+                k -= 1
+                continue
+
+            pattern_idx, trip, board, alight = parent
+            stops = timetable.pattern_stops[pattern_idx]
+            trips = timetable.pattern_trips[pattern_idx]
+            base = timetable.time_offsets[pattern_idx]
+
+            legs.append(Ride(
+                route=timetable.pattern_routes[pattern_idx],
+                trip=timetable.trip_ids[trips[trip]],
+                board=timetable.stop_names[stops[board]],
+                alight=timetable.stop_names[stops[alight]],
+                departure=timetable.departures[base + board * len(trips) + trip],
+                arrival=timetable.arrivals[base + alight * len(trips) + trip]
+            ))
+
+            stop_idx = stops[board]
+            k -= 1
+
+        legs.reverse()
+        return Journey(legs)
+
+
+def plan_journey(timetable, origin_idx, destination_idx, departure_time, max_transfers=MAX_TRANSFERS,
+                 transfer_time=0) -> Journey:
+    """
+    Earliest-arrival journey between two stops leaving no earlier than `departure_time`, or None
+    """
+    if not metrics.REGISTRY.enabled:
+        search = JourneySearch(timetable, origin_idx, departure_time, destination_idx, max_transfers, transfer_time)
+        return search.journey_to(destination_idx)
+
+    started = time.perf_counter()
+    search = JourneySearch(timetable, origin_idx, departure_time, destination_idx, max_transfers, transfer_time)
+    journey = search.journey_to(destination_idx)
+
+    metrics.record_query(
+        "journey", timetable.stop_names[origin_idx], timetable.stop_names[destination_idx],
+        f"departure={format_time(departure_time)}", started, search, journey is not None
+    )
+    return journey
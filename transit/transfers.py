@@ -0,0 +1,97 @@
+import numpy as np
+
+# Value stored for stop pairs that can't be reached from one another
+UNREACHABLE = 255
+
+
+class TransferMatrix():
+    """
+    Minimum number of transfers between every pair of stops, precomputed from a `TransitGraph`.
+
+    Route-to-route distances come from a breadth-first search run for all routes at once (each level is one
+    boolean matrix product). The stop x stop matrix is then the minimum over the routes serving each end,
+    which is folded in one route at a time with vectorized `np.minimum`. Entries are uint8, so the matrix takes
+    one byte per stop pair and can be memory-mapped back from disk.
+    """
+
+    def __init__(self, stop_names, matrix) -> None:
+        self.stop_names = stop_names
+        self.matrix = matrix
+        self.stop_index = {name: i for i, name in enumerate(stop_names)}
+
+
+    @classmethod
+    def from_graph(cls, graph):
+        route_count = len(graph.route_names)
+        stop_count = len(graph.stop_names)
+
+        adjacency = np.zeros((route_count, route_count), dtype=bool)
+        for route_idx in range(route_count):
+            adjacency[route_idx, np.asarray(graph.transfer_routes[route_idx], dtype=np.intp)] = True
+
+        # All-sources BFS over routes: `frontier` holds, for every source route, the routes first reached
+        # at the current level
+        route_transfers = np.full((route_count, route_count), UNREACHABLE, dtype=np.uint8)
+        np.fill_diagonal(route_transfers, 0)
+        reached = np.eye(route_count, dtype=bool)
+        frontier = reached.copy()
+        level = 0
+
+        while frontier.any() and level < UNREACHABLE - 1:
+            level += 1
+            frontier = (frontier @ adjacency) & ~reached
+            route_transfers[frontier] = level
+            reached |= frontier
+
+        route_stops = [np.unique(np.asarray(graph.route_stops[r], dtype=np.intp)) for r in range(route_count)]
+
+        # stop x route: fewest transfers from a stop to any point on a route
+        stop_to_route = np.full((stop_count, route_count), UNREACHABLE, dtype=np.uint8)
+        for route_idx, stops in enumerate(route_stops):
+            stop_to_route[stops] = np.minimum(stop_to_route[stops], route_transfers[route_idx])
+
+        # stop x stop: fewest transfers to any route serving the destination
+        matrix = np.full((stop_count, stop_count), UNREACHABLE, dtype=np.uint8)
+        for route_idx, stops in enumerate(route_stops):
+            matrix[:, stops] = np.minimum(matrix[:, stops], stop_to_route[:, route_idx, np.newaxis])
+
+        return cls(list(graph.stop_names), matrix)
+
+
+    def get_stop_indexes(self, stop_names) -> np.ndarray:
+        """
+        Convert stop names to the indexes used by `transfers()`
+        """
+        return np.fromiter((self.stop_index[name] for name in stop_names), dtype=np.intp)
+
+
+    def transfers(self, origin_ids, destination_ids) -> np.ndarray:
+        """
+        Transfers between stop indexes, looked up for the whole batch at once. The arguments broadcast like any
+        NumPy index: two equal-length arrays give one answer per pair, `origins[:, None]` and `destinations`
+        give the full origin x destination table. Unreachable pairs are `UNREACHABLE`.
+        """
+        return self.matrix[np.asarray(origin_ids, dtype=np.intp), np.asarray(destination_ids, dtype=np.intp)]
+
+
+    def save(self, path):
+        """
+        Store the matrix as a .npy file; the stop numbering is the graph's, so keep it next to the network
+        (e.g. its snapshot)
+        """
+        with open(path, "wb") as f:
+            np.save(f, self.matrix)
+
+
+    @classmethod
+    def load(cls, path, graph, mmap=True):
+        """
+        Load a matrix saved for `graph`. By default it is memory-mapped rather than read into memory.
+        """
+        matrix = np.load(path, mmap_mode="r" if mmap else None)
+
+        stop_count = len(graph.stop_names)
+        if matrix.shape != (stop_count, stop_count):
+            raise ValueError(f"Transfer matrix {path} has shape {matrix.shape}, the network has {stop_count} stops")
+
+        return cls(list(graph.stop_names), matrix)